@@ -0,0 +1,15 @@
+-- Add compact binary embedding storage to product_embeddings
+-- Stores raw little-endian float32/float16 bytes (2 KB / 1 KB per 512-d vector)
+-- instead of ~10 KB of JSON float text. The JSON column becomes optional:
+-- rows written after this migration hold the blob only, older rows keep
+-- their JSON until they are recomputed
+
+ALTER TABLE product_embeddings
+MODIFY COLUMN embedding JSON NULL,
+ADD COLUMN embedding_blob MEDIUMBLOB DEFAULT NULL
+COMMENT 'Raw little-endian embedding bytes (see embedding_dtype)',
+ADD COLUMN embedding_dtype VARCHAR(16) DEFAULT NULL
+COMMENT 'float32 or float16';
+
+-- Verify the columns were added
+DESCRIBE product_embeddings;
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the batched CLIP service mode
+Starts services/clipService.py with different batch sizes, drives it with
+several concurrent clients and reports throughput and p95 latency
+"""
+
+import argparse
+import base64
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+SERVICE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'services', 'clipService.py')
+DEFAULT_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp', 'real_test_images', 'product_1464.jpg')
+
+class ServiceClient:
+    """Minimal stdin/stdout client that matches responses by request_id"""
+
+    def __init__(self, args):
+        self.process = subprocess.Popen(
+            [sys.executable, SERVICE_PATH] + args,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1
+        )
+        self.lock = threading.Lock()
+        self.waiting = {}
+        self.ready = threading.Event()
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def _read(self):
+        for line in self.process.stdout:
+            try:
+                response = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if response.get('status') == 'service_ready':
+                self.ready.set()
+                continue
+            request_id = response.get('request_id')
+            with self.lock:
+                slot = self.waiting.pop(request_id, None)
+            if slot:
+                slot['response'] = response
+                slot['event'].set()
+
+    def request(self, payload):
+        slot = {'event': threading.Event(), 'response': None}
+        with self.lock:
+            self.waiting[payload['request_id']] = slot
+            self.process.stdin.write(json.dumps(payload) + '\n')
+            self.process.stdin.flush()
+        slot['event'].wait()
+        return slot['response']
+
+    def close(self):
+        try:
+            self.process.stdin.write(json.dumps({'action': 'shutdown'}) + '\n')
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.wait(timeout=30)
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    index = max(0, int(round(pct / 100.0 * len(ordered))) - 1)
+    return ordered[index]
+
+def run_case(batch_size, window_ms, clients, requests_per_client, base64_data):
+    """Run one configuration and return its metrics"""
+    service_args = ['--max-batch-size', str(batch_size), '--batch-window-ms', str(window_ms)]
+    client = ServiceClient(service_args)
+    if not client.ready.wait(timeout=300):
+        client.close()
+        raise RuntimeError('CLIP service did not become ready')
+
+    # Warm-up so model initialisation is not measured
+    client.request({'action': 'process_base64', 'base64_data': base64_data, 'request_id': 'warmup'})
+
+    latencies = []
+    latency_lock = threading.Lock()
+
+    def worker(worker_id):
+        for n in range(requests_per_client):
+            start = time.perf_counter()
+            response = client.request({
+                'action': 'process_base64',
+                'base64_data': base64_data,
+                'request_id': f'c{worker_id}_{n}'
+            })
+            elapsed = (time.perf_counter() - start) * 1000
+            if response.get('status') != 'success':
+                raise RuntimeError(response.get('message'))
+            with latency_lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    wall_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - wall_start
+    client.close()
+
+    return {
+        'batch_size': batch_size,
+        'window_ms': window_ms if batch_size > 1 else 0,
+        'requests': len(latencies),
+        'throughput_rps': len(latencies) / wall_time,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark batched CLIP inference')
+    parser.add_argument('--image', default=DEFAULT_IMAGE, help='Image used for every request')
+    parser.add_argument('--batch-sizes', default='1,2,4,8,16', help='Comma separated max batch sizes')
+    parser.add_argument('--window-ms', type=int, default=20, help='Batch collection window')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=10, help='Requests per client')
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as f:
+        base64_data = base64.b64encode(f.read()).decode('ascii')
+
+    print(f"🔬 Batched CLIP benchmark: {args.clients} clients x {args.requests} requests")
+    print(f"{'batch':>6} {'window':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9}")
+
+    for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+        result = run_case(batch_size, args.window_ms, args.clients, args.requests, base64_data)
+        print(f"{result['batch_size']:>6} {result['window_ms']:>7} {result['throughput_rps']:>8.2f} "
+              f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f}")
+
+if __name__ == '__main__':
+    main()
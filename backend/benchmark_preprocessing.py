@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Preprocessing Benchmark
+Compares CLIPImageProcessor with the fast path (services/fastPreprocess.py),
+with and without reduced-scale JPEG decoding: time per image (decode +
+preprocess), largest pixel difference from the processor and, with --embed,
+cosine similarity of the resulting embeddings
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BACKEND_DIR, 'services'))
+
+from fastPreprocess import FastPreprocessor
+
+DEFAULT_IMAGE_DIR = os.path.join(BACKEND_DIR, 'temp', 'real_test_images')
+MODEL_NAME = 'openai/clip-vit-base-patch32'
+
+def load_files(args):
+    paths = args.images or [
+        os.path.join(DEFAULT_IMAGE_DIR, name) for name in sorted(os.listdir(DEFAULT_IMAGE_DIR))
+    ]
+    files = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            files.append((os.path.basename(path), f.read()))
+    return files
+
+def timed(function, files, repeats):
+    """Pixel tensors for every file and mean ms per image"""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        outputs = [function(data) for _, data in files]
+    return np.concatenate(outputs), (time.perf_counter() - start) * 1000 / (repeats * len(files))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark fast CLIP preprocessing against CLIPImageProcessor')
+    parser.add_argument('--images', nargs='*', help='Image files (default: temp/real_test_images)')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--embed', action='store_true', help='Also compare embeddings (loads the vision tower)')
+    args = parser.parse_args()
+    
+    from transformers import CLIPImageProcessor
+    processor = CLIPImageProcessor.from_pretrained(MODEL_NAME)
+    fast = FastPreprocessor(processor)
+    files = load_files(args)
+    
+    def with_processor(data):
+        image = Image.open(io.BytesIO(data)).convert('RGB')
+        return processor(images=[image], return_tensors='pt')['pixel_values'].numpy()
+    
+    def with_fast(data):
+        return fast([Image.open(io.BytesIO(data)).convert('RGB')]).numpy().copy()
+    
+    def with_fast_draft(data):
+        return fast([fast.decode(data)]).numpy().copy()
+    
+    print(f"🔬 Preprocessing benchmark: {len(files)} images x {args.repeats} repeats")
+    reference, reference_ms = timed(with_processor, files, args.repeats)
+    modes = [('processor', reference, reference_ms)]
+    for name, function in (('fast', with_fast), ('fast+draft', with_fast_draft)):
+        pixels, ms = timed(function, files, args.repeats)
+        modes.append((name, pixels, ms))
+    
+    embeddings = {}
+    if args.embed:
+        import torch
+        from transformers import CLIPVisionModelWithProjection
+        model = CLIPVisionModelWithProjection.from_pretrained(MODEL_NAME).eval()
+        for name, pixels, _ in modes:
+            with torch.no_grad():
+                features = model(pixel_values=torch.from_numpy(pixels)).image_embeds.numpy()
+            embeddings[name] = features / np.linalg.norm(features, axis=1, keepdims=True)
+    
+    print(f"{'mode':>12} {'ms/image':>9} {'speedup':>8} {'max |diff|':>11} {'min cosine':>11}")
+    for name, pixels, ms in modes:
+        difference = np.abs(pixels - reference).max()
+        cosine = '-'
+        if embeddings:
+            cosine = f"{np.sum(embeddings[name] * embeddings['processor'], axis=1).min():.5f}"
+        print(f"{name:>12} {ms:>9.2f} {reference_ms / ms:>7.1f}x {difference:>11.2e} {cosine:>11}")
+    
+    print("ℹ️ 'fast' must match the processor to float rounding (the service checks this at startup).")
+    print("   'fast+draft' decodes JPEGs at a reduced DCT scale first, so it differs slightly.")
+
+if __name__ == '__main__':
+    main()
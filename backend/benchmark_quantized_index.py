@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Quantized Index Benchmark
+Compares the float32 index with the int8 coarse scan + re-ranking:
+recall@5 against exact search on the professor test images, plus the bytes
+each search scans and the memory the index really keeps resident
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BACKEND_DIR, 'services'))
+
+from embeddingIndex import EmbeddingIndex
+
+# Same images professor_final_working.js runs against
+PROFESSOR_IMAGES = [os.path.join('/Users/soha/Downloads', f'test{i}.jpg') for i in range(1, 7)]
+DEFAULT_SNAPSHOT = os.path.join(BACKEND_DIR, 'clip_index')
+MODEL_NAME = 'openai/clip-vit-base-patch32'
+
+def load_catalog(args):
+    """Catalog rows from an index snapshot, or a synthetic clustered catalog"""
+    if args.synthetic:
+        rng = np.random.default_rng(0)
+        centers = rng.standard_normal((max(1, args.synthetic // 20), 512)).astype(np.float32)
+        rows = centers[rng.integers(0, len(centers), args.synthetic)]
+        rows = rows + 0.6 * rng.standard_normal(rows.shape).astype(np.float32)
+        return np.arange(args.synthetic), rows, 'synthetic'
+    
+    index = EmbeddingIndex()
+    index.load_snapshot(args.snapshot, MODEL_NAME)
+    return index.product_ids.copy(), np.asarray(index.matrix[:index.size]), args.snapshot
+
+def load_queries(args, catalog):
+    """Embed the professor test images; fall back to perturbed catalog rows"""
+    images = [path for path in (args.images or PROFESSOR_IMAGES) if os.path.exists(path)]
+    if images and not args.synthetic:
+        from clipService import PersistentCLIPService
+        service = PersistentCLIPService()
+        loaded = [service._load_request_image({"image_path": path})[0] for path in images]
+        return service._embed_images(loaded), [os.path.basename(path) for path in images]
+    
+    print("⚠️ Professor images not found - using perturbed catalog rows as queries")
+    rng = np.random.default_rng(1)
+    picks = rng.integers(0, len(catalog), args.queries)
+    queries = catalog[picks] + 0.3 * rng.standard_normal((len(picks), catalog.shape[1])).astype(np.float32)
+    return queries, [f'row_{pick}' for pick in picks]
+
+def build_index(product_ids, rows, quantization=None, rerank_factor=4):
+    index = EmbeddingIndex(quantization=quantization, rerank_factor=rerank_factor)
+    index.load([{"product_id": int(pid), "embedding": row} for pid, row in zip(product_ids, rows)])
+    return index
+
+def run_searches(index, queries, top_k):
+    """Top-K ids per query and mean latency in ms"""
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append([pid for pid, _ in index.search(query, top_k)])
+    return results, (time.perf_counter() - start) * 1000 / max(1, len(queries))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark quantized CLIP index modes')
+    parser.add_argument('--snapshot', default=DEFAULT_SNAPSHOT, help='Index snapshot directory (see clipService.py --snapshot)')
+    parser.add_argument('--synthetic', type=int, default=0, help='Use N synthetic embeddings instead of a snapshot')
+    parser.add_argument('--images', nargs='*', help='Query images (default: professor test images)')
+    parser.add_argument('--labels', help='JSON file mapping image file name -> expected product_id')
+    parser.add_argument('--queries', type=int, default=200, help='Fallback query count')
+    parser.add_argument('--rerank-factors', default='1,2,4', help='Comma separated re-rank multipliers')
+    parser.add_argument('--top-k', type=int, default=5)
+    args = parser.parse_args()
+    
+    product_ids, rows, source = load_catalog(args)
+    queries, names = load_queries(args, rows)
+    labels = {}
+    if args.labels:
+        with open(args.labels) as f:
+            labels = json.load(f)
+    
+    print(f"🔬 Quantized index benchmark: {len(product_ids)} products from {source}, {len(queries)} queries")
+    
+    exact_index = build_index(product_ids, rows)
+    exact, exact_ms = run_searches(exact_index, queries, args.top_k)
+    exact_stats = exact_index.stats()
+    exact_bytes = exact_stats['memory_bytes']
+    
+    def hit_rate(results):
+        hits = [labels[name] in found for name, found in zip(names, results) if name in labels]
+        return f"{100 * sum(hits) / len(hits):.1f}%" if hits else 'n/a'
+    
+    print(f"{'mode':>8} {'rerank':>7} {'recall@' + str(args.top_k):>10} {'hit@' + str(args.top_k):>7} "
+          f"{'ms/query':>9} {'scan MB':>8} {'RAM MB':>7} {'saved':>6}")
+    print(f"{'float32':>8} {'-':>7} {1.0:>10.3f} {hit_rate(exact):>7} {exact_ms:>9.2f} "
+          f"{exact_stats['scan_bytes'] / 2**20:>8.2f} {exact_bytes / 2**20:>7.2f} {'0%':>6}")
+    
+    for factor in [int(f) for f in args.rerank_factors.split(',')]:
+        index = build_index(product_ids, rows, 'int8', factor)
+        found, ms = run_searches(index, queries, args.top_k)
+        recall = np.mean([
+            len(set(a) & set(b)) / max(1, len(a)) for a, b in zip(exact, found)
+        ])
+        stats = index.stats()
+        saved = 100 * (1 - stats['memory_bytes'] / exact_bytes)
+        print(f"{'int8':>8} {factor:>7} {recall:>10.3f} {hit_rate(found):>7} {ms:>9.2f} "
+              f"{stats['scan_bytes'] / 2**20:>8.2f} {stats['memory_bytes'] / 2**20:>7.2f} {saved:>5.0f}%")
+    
+    print("ℹ️ RAM MB counts the full-precision pages resident after the searches; in int8 mode")
+    print("   they live in a spill file and only the re-rank shortlists are paged in.")
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,10 @@
 require('dotenv').config();
-const { spawn } = require('child_process');
 const path = require('path');
 const fs = require('fs');
 const db = require('./config/db');
+const { saveProductEmbedding } = require('./utils/embeddingBlob');
+const clipServiceManager = require('./services/clipServiceManager');
+const { loadBatchImageSources } = require('./utils/imageSource');
 
 async function completeMissingEmbeddings() {
   console.log('🔍 Finding and Processing Missing Embeddings');
@@ -78,13 +80,8 @@ async function completeMissingEmbeddings() {
         for (const embedding of embeddings) {
           if (embedding.embedding && embedding.embedding.length > 0) {
             try {
-              await db.query(`
-                INSERT INTO product_embeddings (product_id, embedding, embedding_model, created_at)
-                VALUES (?, ?, 'clip-vit-base-patch32', NOW())
-                ON DUPLICATE KEY UPDATE 
-                  embedding = VALUES(embedding),
-                  created_at = NOW()
-              `, [embedding.product_id, JSON.stringify(embedding.embedding)]);
+              // One statement: the compact binary form when the column exists, JSON otherwise
+              await saveProductEmbedding(embedding.product_id, embedding.embedding, embedding.embeddingBlob);
               successCount++;
               console.log(`   ✅ Saved embedding for product ${embedding.product_id} (${embedding.embedding.length} dimensions)`);
             } catch (dbError) {
@@ -132,180 +129,29 @@ async function completeMissingEmbeddings() {
     console.error('❌ Error:', error);
   } finally {
     await db.end();
+    await clipServiceManager.shutdown();
   }
 }
 
-function processWithCLIP(products) {
-  return new Promise((resolve, reject) => {
-    const pythonScript = `
-import torch
-from transformers import CLIPProcessor, CLIPModel
-from PIL import Image
-import requests
-import json
-import sys
-import numpy as np
-import traceback
-import io
-from io import BytesIO
-
-def process_products():
-    try:
-        # Load CLIP model with explicit device handling
-        model_name = "openai/clip-vit-base-patch32"
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        print(f"Loading CLIP model on {device}...", file=sys.stderr)
-        
-        model = CLIPModel.from_pretrained(model_name)
-        processor = CLIPProcessor.from_pretrained(model_name)
-        model = model.to(device)
-        
-        print(f"Model loaded successfully", file=sys.stderr)
-        
-        # Read products from stdin
-        input_data = sys.stdin.read()
-        products = json.loads(input_data)
-        
-        print(f"Processing {len(products)} products...", file=sys.stderr)
-        
-        results = []
-        
-        for i, product in enumerate(products):
-            try:
-                print(f"Processing product {i+1}/{len(products)}: {product['product_id']}", file=sys.stderr)
-                
-                # Get image
-                image_url = product['image_data']
-                if not image_url or image_url.strip() == '':
-                    results.append({
-                        'product_id': product['product_id'],
-                        'embedding': [],
-                        'error': 'No image URL'
-                    })
-                    continue
-                
-                # Load and process image with better error handling
-                try:
-                    if image_url.startswith('http'):
-                        response = requests.get(image_url, timeout=15, stream=True)
-                        response.raise_for_status()
-                        image = Image.open(BytesIO(response.content)).convert('RGB')
-                    else:
-                        # Handle local file paths
-                        image = Image.open(image_url).convert('RGB')
-                    
-                    # Resize if too large to prevent memory issues
-                    if image.size[0] > 512 or image.size[1] > 512:
-                        image.thumbnail((512, 512), Image.Resampling.LANCZOS)
-                    
-                except Exception as img_error:
-                    print(f"Image loading failed for {product['product_id']}: {img_error}", file=sys.stderr)
-                    results.append({
-                        'product_id': product['product_id'],
-                        'embedding': [],
-                        'error': f'Image loading failed: {str(img_error)}'
-                    })
-                    continue
-                
-                # Generate embedding with device handling
-                try:
-                    inputs = processor(images=image, return_tensors="pt").to(device)
-                    with torch.no_grad():
-                        image_features = model.get_image_features(**inputs)
-                        # Normalize for cosine similarity
-                        image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-                        embedding = image_features.squeeze().cpu().numpy().tolist()
-                    
-                    results.append({
-                        'product_id': product['product_id'],
-                        'embedding': embedding,
-                        'error': None
-                    })
-                    print(f"Successfully processed product {product['product_id']}", file=sys.stderr)
-                    
-                except Exception as clip_error:
-                    print(f"CLIP processing failed for {product['product_id']}: {clip_error}", file=sys.stderr)
-                    results.append({
-                        'product_id': product['product_id'],
-                        'embedding': [],
-                        'error': f'CLIP processing failed: {str(clip_error)}'
-                    })
-                
-            except Exception as e:
-                print(f"General error for product {product['product_id']}: {e}", file=sys.stderr)
-                results.append({
-                    'product_id': product['product_id'],
-                    'embedding': [],
-                    'error': str(e)
-                })
-        
-        print(json.dumps(results))
-        
-    except Exception as e:
-        print(f"Critical error: {e}", file=sys.stderr)
-        print(json.dumps([{'error': f'Model loading failed: {str(e)}'}]))
-
-if __name__ == "__main__":
-    process_products()
-`;
-
-    // Use the virtual environment Python if available
-    const pythonCmd = path.join(__dirname, 'clip_env', 'bin', 'python');
-    const pythonProcess = spawn(pythonCmd, ['-c', pythonScript], {
-      stdio: ['pipe', 'pipe', 'pipe'],
-      timeout: 300000 // 5 minute timeout
-    });
-
-    let output = '';
-    let errorOutput = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-      output += data.toString();
-    });
-
-    pythonProcess.stderr.on('data', (data) => {
-      errorOutput += data.toString();
-      console.log('Python:', data.toString().trim()); // Show progress
-    });
-
-    pythonProcess.on('error', (error) => {
-      reject(new Error(`Python process error: ${error.message}`));
-    });
-
-    pythonProcess.on('close', (code, signal) => {
-      if (signal) {
-        reject(new Error(`Python process killed by signal: ${signal}`));
-        return;
-      }
-      
-      if (code !== 0) {
-        reject(new Error(`Python process failed with code ${code}: ${errorOutput}`));
-        return;
-      }
-
-      try {
-        const lines = output.trim().split('\n');
-        const lastLine = lines[lines.length - 1];
-        
-        if (lastLine.startsWith('[') && lastLine.endsWith(']')) {
-          const results = JSON.parse(lastLine);
-          resolve(results);
-        } else {
-          reject(new Error(`Invalid Python output format: ${lastLine}`));
-        }
-      } catch (error) {
-        reject(new Error(`Failed to parse Python output: ${error.message}\nOutput: ${output}`));
-      }
-    });
-
-    // Send data to Python with error handling
-    try {
-      pythonProcess.stdin.write(JSON.stringify(products));
-      pythonProcess.stdin.end();
-    } catch (error) {
-      reject(new Error(`Failed to send data to Python: ${error.message}`));
+async function processWithCLIP(products) {
+  // Images are fetched concurrently here, then embedded by the shared CLIP service
+  const { items, failures } = await loadBatchImageSources(products);
+  const results = failures.map(({ product_id, error }) => ({ product_id, embedding: [], error }));
+  
+  if (items.length > 0) {
+    const embedded = await clipServiceManager.precomputeBatch(items);
+    for (const result of embedded) {
+      console.log(`Python: ${result.status === 'success' ? 'Successfully processed' : 'Failed'} product ${result.product_id}`);
+      results.push({
+        product_id: result.product_id,
+        embedding: result.embedding || [],
+        embeddingBlob: result.embeddingBlob,
+        error: result.status === 'success' ? null : result.message
+      });
     }
-  });
+  }
+  
+  return results;
 }
 
 completeMissingEmbeddings().catch(console.error); 
\ No newline at end of file
@@ -1,8 +1,9 @@
 require('dotenv').config();
-const { spawn } = require('child_process');
 const path = require('path');
 const fs = require('fs');
 const db = require('./config/db');
+const { embeddingTextColumns, embeddingFromRow } = require('./utils/embeddingBlob');
+const clipServiceManager = require('./services/clipServiceManager');
 
 async function instantClipSearch() {
   console.log('⚡ INSTANT CLIP Search - Full Database');
@@ -31,6 +32,9 @@ async function instantClipSearch() {
     console.log(`✅ Found ${embeddingCount[0].count} pre-computed embeddings`);
     console.log('🔍 Ready for instant similarity search!\n');
 
+    // Let the shared CLIP service finish loading before timing requests
+    await clipServiceManager.waitForReady(120000);
+    
     const allResults = [];
 
     // Process each professor test image
@@ -186,112 +190,18 @@ async function instantClipSearch() {
     if (db) {
       await db.end();
     }
+    await clipServiceManager.shutdown();
   }
 }
 
 async function searchWithPrecomputedEmbeddings(queryImagePath) {
-  return new Promise((resolve, reject) => {
-    // First, get the query image embedding
-    const pythonScript = `
-import sys
-import json
-import warnings
-warnings.filterwarnings("ignore")
-
-try:
-    import torch
-    import numpy as np
-    from PIL import Image
-    from transformers import CLIPProcessor, CLIPModel
-except ImportError as e:
-    print(f"Import error: {e}")
-    sys.exit(1)
-
-class InstantSearch:
-    def __init__(self):
-        self.model = None
-        self.processor = None
-        self.device = "cpu"
-        
-    def setup(self):
-        print("Loading CLIP for query embedding...")
-        self.model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-        self.processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-        print("Ready for instant search!")
-            
-    def get_query_embedding(self, image_path):
-        image = Image.open(image_path).convert('RGB')
-        inputs = self.processor(images=image, return_tensors="pt")
-        with torch.no_grad():
-            features = self.model.get_image_features(**inputs)
-            features = features / features.norm(dim=-1, keepdim=True)
-        return features.cpu().numpy().flatten().tolist()
-
-try:
-    searcher = InstantSearch()
-    searcher.setup()
-    
-    query_embedding = searcher.get_query_embedding("${queryImagePath}")
-    
-    print("QUERY_EMBEDDING_READY")
-    print(json.dumps(query_embedding))
-    
-except Exception as e:
-    print(f"FAILED: {e}")
-    sys.exit(1)
-`;
-
-    const pythonProcess = spawn('python3', ['-c', pythonScript]);
-    
-    let outputData = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-      const text = data.toString();
-      outputData += text;
-      
-      if (text.includes('Loading') || text.includes('Ready')) {
-        console.log('   ', text.trim());
-      }
-    });
-
-    pythonProcess.stderr.on('data', (data) => {
-      console.log('   Error:', data.toString().trim());
-    });
-
-    pythonProcess.on('close', async (code) => {
-      if (code === 0) {
-        try {
-          // Extract query embedding
-          const lines = outputData.trim().split('\n');
-          let queryEmbedding = null;
-          
-          for (let i = lines.length - 1; i >= 0; i--) {
-            const line = lines[i].trim();
-            if (line.startsWith('[') && line.endsWith(']')) {
-              queryEmbedding = JSON.parse(line);
-              break;
-            }
-          }
-          
-          if (!queryEmbedding) {
-            reject(new Error('Failed to get query embedding'));
-            return;
-          }
-
-          console.log('   ✅ Query embedding computed, searching database...');
-          
-          // Now search against all pre-computed embeddings
-          const searchResults = await performInstantSearch(queryEmbedding);
-          resolve(searchResults);
-          
-        } catch (parseError) {
-          reject(new Error('Failed to process query embedding'));
-        }
-      } else {
-        reject(new Error('Failed to compute query embedding'));
-      }
-    });
-  });
+  // Query embedding from the shared persistent CLIP service
+  const response = await clipServiceManager.processImage(queryImagePath);
+  
+  console.log('   ✅ Query embedding computed, searching database...');
+  
+  // Now search against all pre-computed embeddings
+  return performInstantSearch(response.embedding);
 }
 
 async function performInstantSearch(queryEmbedding, topK = 5) {
@@ -300,7 +210,7 @@ async function performInstantSearch(queryEmbedding, topK = 5) {
     const [embeddings] = await db.query(`
       SELECT 
         pe.product_id,
-        pe.embedding,
+        ${await embeddingTextColumns()},
         p.product_name,
         IFNULL(p.brand, '') as brand,
         IFNULL(p.variety, '') as variety,
@@ -316,7 +226,10 @@ async function performInstantSearch(queryEmbedding, topK = 5) {
     
     for (const row of embeddings) {
       try {
-        const productEmbedding = JSON.parse(row.embedding);
+        const productEmbedding = embeddingFromRow(row);
+        if (!productEmbedding) {
+          continue;
+        }
         
         // Cosine similarity calculation
         let dotProduct = 0;
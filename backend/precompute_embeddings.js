@@ -1,8 +1,10 @@
 require('dotenv').config();
-const { spawn } = require('child_process');
 const path = require('path');
 const fs = require('fs');
 const db = require('./config/db');
+const { saveProductEmbedding } = require('./utils/embeddingBlob');
+const clipServiceManager = require('./services/clipServiceManager');
+const { loadBatchImageSources } = require('./utils/imageSource');
 
 async function precomputeAllEmbeddings() {
   console.log('🚀 Pre-computing CLIP Embeddings for Production');
@@ -55,6 +57,7 @@ async function precomputeAllEmbeddings() {
 
     // Process in batches for stability
     const batchSize = 10;
+    await clipServiceManager.waitForReady(120000);
     let processed = 0;
     
     for (let i = 0; i < productsToProcess.length; i += batchSize) {
@@ -69,13 +72,8 @@ async function precomputeAllEmbeddings() {
         // Save embeddings to database
         for (const embedding of embeddings) {
           if (embedding.success) {
-            await db.query(`
-              INSERT INTO product_embeddings (product_id, embedding) 
-              VALUES (?, ?)
-              ON DUPLICATE KEY UPDATE 
-              embedding = VALUES(embedding),
-              created_at = CURRENT_TIMESTAMP
-            `, [embedding.product_id, JSON.stringify(embedding.embedding)]);
+            // One statement: the compact binary form when the column exists, JSON otherwise
+            await saveProductEmbedding(embedding.product_id, embedding.embedding, embedding.embeddingBlob);
             
             processed++;
             console.log(`   ✅ Saved embedding for product ${embedding.product_id}`);
@@ -111,149 +109,22 @@ async function precomputeAllEmbeddings() {
 }
 
 async function computeBatchEmbeddings(products) {
-  return new Promise((resolve, reject) => {
-    const pythonScript = `
-import sys
-import json
-import base64
-import io
-import warnings
-warnings.filterwarnings("ignore")
-
-try:
-    import torch
-    import numpy as np
-    from PIL import Image
-    from transformers import CLIPProcessor, CLIPModel
-    import requests
-except ImportError as e:
-    print(f"Import error: {e}")
-    sys.exit(1)
-
-class EmbeddingComputer:
-    def __init__(self):
-        self.model = None
-        self.processor = None
-        self.device = "cpu"
-        
-    def setup(self):
-        print("Loading CLIP model for embedding computation...")
-        self.model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-        self.processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-        print("✅ CLIP model loaded successfully")
-            
-    def get_embedding_from_url(self, image_url):
-        try:
-            response = requests.get(image_url, timeout=15)
-            image = Image.open(io.BytesIO(response.content)).convert('RGB')
-            
-            inputs = self.processor(images=image, return_tensors="pt")
-            with torch.no_grad():
-                features = self.model.get_image_features(**inputs)
-                features = features / features.norm(dim=-1, keepdim=True)
-            
-            return features.cpu().numpy().flatten().tolist()
-        except Exception as e:
-            raise Exception(f"Failed to process image: {str(e)}")
-
-products_data = ${JSON.stringify(products)}
-
-try:
-    computer = EmbeddingComputer()
-    computer.setup()
-    
-    results = []
-    
-    for i, product in enumerate(products_data):
-        print(f"Processing product {i+1}/{len(products_data)}: {product['product_id']}")
-        
-        try:
-            if product['image_data'] and product['image_data'].startswith('http'):
-                embedding = computer.get_embedding_from_url(product['image_data'])
-                
-                results.append({
-                    'product_id': product['product_id'],
-                    'embedding': embedding,
-                    'success': True
-                })
-                print(f"✅ Success for product {product['product_id']}")
-            else:
-                results.append({
-                    'product_id': product['product_id'],
-                    'success': False,
-                    'error': 'Invalid image URL'
-                })
-                print(f"❌ Invalid image URL for product {product['product_id']}")
-                
-        except Exception as e:
-            results.append({
-                'product_id': product['product_id'],
-                'success': False,
-                'error': str(e)
-            })
-            print(f"❌ Error for product {product['product_id']}: {str(e)}")
-    
-    print("BATCH_COMPLETE")
-    print(json.dumps(results))
-    
-except Exception as e:
-    print(f"BATCH_FAILED: {e}")
-    sys.exit(1)
-`;
-
-    const pythonProcess = spawn('python3', ['-c', pythonScript]);
-    
-    let outputData = '';
-    let errorData = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-      const text = data.toString();
-      outputData += text;
-      
-      // Show progress
-      if (text.includes('Processing product') || text.includes('✅') || text.includes('❌')) {
-        console.log('   ', text.trim());
-      }
-    });
-
-    pythonProcess.stderr.on('data', (data) => {
-      errorData += data.toString();
-    });
-
-    pythonProcess.on('close', (code) => {
-      if (code === 0) {
-        try {
-          // Find the JSON result
-          const lines = outputData.trim().split('\n');
-          let jsonResult = null;
-          
-          for (let i = lines.length - 1; i >= 0; i--) {
-            const line = lines[i].trim();
-            if (line.startsWith('[') && line.endsWith(']')) {
-              jsonResult = JSON.parse(line);
-              break;
-            }
-          }
-          
-          if (jsonResult) {
-            resolve(jsonResult);
-          } else {
-            reject(new Error('No valid results found'));
-          }
-        } catch (parseError) {
-          console.error('Parse error:', parseError);
-          reject(new Error('Failed to parse batch results'));
-        }
+  // Images are fetched concurrently here, then embedded by the shared CLIP service
+  const { items, failures } = await loadBatchImageSources(products);
+  const results = failures.map(({ product_id, error }) => ({ product_id, success: false, error }));
+  
+  if (items.length > 0) {
+    const embedded = await clipServiceManager.precomputeBatch(items);
+    for (const result of embedded) {
+      if (result.status === 'success') {
+        results.push({ product_id: result.product_id, embedding: result.embedding, embeddingBlob: result.embeddingBlob, success: true });
       } else {
-        console.error('Python error:', errorData);
-        reject(new Error('Batch processing failed'));
+        results.push({ product_id: result.product_id, success: false, error: result.message });
       }
-    });
-
-    pythonProcess.on('error', (error) => {
-      reject(error);
-    });
-  });
+    }
+  }
+  
+  return results;
 }
 
 // Run if called directly
@@ -1,8 +1,9 @@
 require('dotenv').config();
-const { spawn } = require('child_process');
 const path = require('path');
 const fs = require('fs');
 const db = require('./config/db');
+const { embeddingTextColumns, embeddingFromRow } = require('./utils/embeddingBlob');
+const clipServiceManager = require('./services/clipServiceManager');
 
 async function professorFinalWorking() {
   console.log('🎓 Professor CLIP Test - FINAL WORKING VERSION');
@@ -21,6 +22,9 @@ async function professorFinalWorking() {
     const [embeddingCount] = await db.query('SELECT COUNT(*) as count FROM product_embeddings');
     console.log(`📊 Database: ${embeddingCount[0].count} pre-computed embeddings available\n`);
 
+    // Let the shared CLIP service finish loading before timing requests
+    await clipServiceManager.waitForReady(120000);
+    
     const allResults = [];
 
     for (const imageFile of testImages) {
@@ -169,71 +173,14 @@ ${top5Accuracy >= 80 ?
     console.error('❌ Error:', error);
   } finally {
     await db.end();
+    await clipServiceManager.shutdown();
   }
 }
 
-function getQueryEmbedding(imagePath) {
-  return new Promise((resolve, reject) => {
-    const pythonScript = `
-import torch
-import numpy as np
-from PIL import Image
-from transformers import CLIPProcessor, CLIPModel
-import json
-
-try:
-    # Load CLIP model
-    model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-    processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-    
-    # Process image
-    image = Image.open("${imagePath}").convert('RGB')
-    inputs = processor(images=image, return_tensors="pt")
-    
-    with torch.no_grad():
-        features = model.get_image_features(**inputs)
-        # Normalize for cosine similarity
-        features = features / features.norm(dim=-1, keepdim=True)
-        embedding = features.cpu().numpy().flatten().tolist()
-    
-    print(json.dumps(embedding))
-    
-except Exception as e:
-    print(f"ERROR: {e}")
-`;
-
-    const pythonProcess = spawn('python3', ['-c', pythonScript]);
-    let output = '';
-    let errorOutput = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-      output += data.toString();
-    });
-
-    pythonProcess.stderr.on('data', (data) => {
-      errorOutput += data.toString();
-    });
-
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        reject(new Error(`Python process failed: ${errorOutput}`));
-        return;
-      }
-
-      try {
-        const lines = output.trim().split('\n');
-        const lastLine = lines[lines.length - 1];
-        if (lastLine.startsWith('[') && lastLine.endsWith(']')) {
-          const embedding = JSON.parse(lastLine);
-          resolve(embedding);
-        } else {
-          reject(new Error('Failed to get valid embedding'));
-        }
-      } catch (error) {
-        reject(new Error(`Failed to parse embedding: ${error.message}`));
-      }
-    });
-  });
+async function getQueryEmbedding(imagePath) {
+  // Query embedding from the shared persistent CLIP service
+  const response = await clipServiceManager.processImage(imagePath);
+  return response.embedding;
 }
 
 async function searchSimilarProductsFixed(queryEmbedding, topK = 5) {
@@ -242,7 +189,7 @@ async function searchSimilarProductsFixed(queryEmbedding, topK = 5) {
     const [embeddings] = await db.query(`
       SELECT 
         pe.product_id,
-        CAST(pe.embedding AS CHAR(100000)) as embedding_text,
+        ${await embeddingTextColumns()},
         p.product_name,
         IFNULL(p.brand, '') as brand,
         IFNULL(p.variety, '') as variety,
@@ -260,18 +207,13 @@ async function searchSimilarProductsFixed(queryEmbedding, topK = 5) {
     
     for (const row of embeddings) {
       try {
-        // Try to parse the embedding text
-        let embeddingText = row.embedding_text;
-        
-        // Clean up any potential formatting issues
-        embeddingText = embeddingText.trim();
-        if (embeddingText.endsWith('...')) {
-          // Skip truncated embeddings
+        // Decode the embedding (binary blob or JSON text)
+        const productEmbedding = embeddingFromRow(row);
+        if (!productEmbedding) {
+          // Skip missing or truncated embeddings
           continue;
         }
         
-        const productEmbedding = JSON.parse(embeddingText);
-        
         // Ensure both embeddings have the same length
         if (productEmbedding.length !== queryEmbedding.length) {
           continue;
@@ -5,6 +5,7 @@ const fs = require('fs');
 const path = require('path');
 const crypto = require('crypto');
 const db = require('../config/db');
+const { embeddingTextColumns, embeddingFromRow } = require('../utils/embeddingBlob');
 
 // CLIP image similarity search endpoint
 router.post('/search', async (req, res) => {
@@ -93,21 +94,21 @@ function getQueryEmbedding(imagePath) {
 import torch
 import numpy as np
 from PIL import Image
-from transformers import CLIPProcessor, CLIPModel
+from transformers import CLIPImageProcessor, CLIPVisionModelWithProjection
 import json
 import sys
 
 try:
-    # Load CLIP model
-    model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-    processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+    # Load the CLIP vision tower only (no text tower or tokenizer)
+    model = CLIPVisionModelWithProjection.from_pretrained("openai/clip-vit-base-patch32")
+    processor = CLIPImageProcessor.from_pretrained("openai/clip-vit-base-patch32")
     
     # Process image
     image = Image.open("${imagePath}").convert('RGB')
     inputs = processor(images=image, return_tensors="pt")
     
     with torch.no_grad():
-        features = model.get_image_features(**inputs)
+        features = model(**inputs).image_embeds
         # Normalize for cosine similarity
         features = features / features.norm(dim=-1, keepdim=True)
         embedding = features.cpu().numpy().flatten().tolist()
@@ -162,7 +163,7 @@ async function searchSimilarProducts(queryEmbedding, topK = 5) {
     const [embeddings] = await db.query(`
       SELECT 
         pe.product_id,
-        CAST(pe.embedding AS CHAR(100000)) as embedding_text,
+        ${await embeddingTextColumns()},
         p.product_name,
         IFNULL(p.brand, '') as brand,
         IFNULL(p.variety, '') as variety,
@@ -180,14 +181,12 @@ async function searchSimilarProducts(queryEmbedding, topK = 5) {
     
     for (const row of embeddings) {
       try {
-        // Parse the embedding
-        let embeddingText = row.embedding_text.trim();
-        if (embeddingText.endsWith('...')) {
-          continue; // Skip truncated embeddings
+        // Decode the embedding (binary blob or JSON text)
+        const productEmbedding = embeddingFromRow(row);
+        if (!productEmbedding) {
+          continue; // Skip missing or truncated embeddings
         }
         
-        const productEmbedding = JSON.parse(embeddingText);
-        
         // Ensure matching dimensions
         if (productEmbedding.length !== queryEmbedding.length) {
           continue;
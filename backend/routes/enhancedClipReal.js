@@ -5,6 +5,8 @@ const fs = require('fs');
 const path = require('path');
 const crypto = require('crypto');
 const db = require('../config/db');
+const { embeddingTextColumns, embeddingFromRow } = require('../utils/embeddingBlob');
+const enhancedClipServiceManager = require('../services/enhancedClipServiceManager');
 
 // Enhanced CLIP search with REAL smart cropping for failed products
 router.post('/enhanced-search', async (req, res) => {
@@ -351,72 +353,8 @@ except Exception as e:
 }
 
 function getCLIPEmbedding(imagePath) {
-  return new Promise((resolve, reject) => {
-    const pythonScript = `
-import torch
-import numpy as np
-from PIL import Image
-from transformers import CLIPProcessor, CLIPModel
-import json
-import sys
-
-try:
-    # Load CLIP model
-    model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-    processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-    
-    # Process the (potentially smart-cropped) image
-    image = Image.open("${imagePath}").convert('RGB')
-    inputs = processor(images=image, return_tensors="pt")
-    
-    with torch.no_grad():
-        features = model.get_image_features(**inputs)
-        # Normalize for cosine similarity
-        features = features / features.norm(dim=-1, keepdim=True)
-        embedding = features.cpu().numpy().flatten().tolist()
-    
-    print(json.dumps(embedding))
-    
-except Exception as e:
-    print(f"ERROR: {e}", file=sys.stderr)
-    sys.exit(1)
-`;
-
-    const pythonProcess = spawn(path.join(__dirname, '..', 'clip_env', 'bin', 'python'), ['-c', pythonScript], {
-      cwd: path.join(__dirname, '..')
-    });
-    
-    let output = '';
-    let errorOutput = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-      output += data.toString();
-    });
-
-    pythonProcess.stderr.on('data', (data) => {
-      errorOutput += data.toString();
-    });
-
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        reject(new Error(`CLIP embedding failed: ${errorOutput}`));
-        return;
-      }
-
-      try {
-        const lines = output.trim().split('\n');
-        const lastLine = lines[lines.length - 1];
-        if (lastLine.startsWith('[') && lastLine.endsWith(']')) {
-          const embedding = JSON.parse(lastLine);
-          resolve(embedding);
-        } else {
-          reject(new Error('Failed to get valid CLIP embedding'));
-        }
-      } catch (error) {
-        reject(new Error(`Failed to parse CLIP embedding: ${error.message}`));
-      }
-    });
-  });
+  // Warm model in the persistent enhanced CLIP service instead of a per-request spawn
+  return enhancedClipServiceManager.embedImage(imagePath);
 }
 
 async function searchSimilarProducts(queryEmbedding, topK = 5) {
@@ -425,7 +363,7 @@ async function searchSimilarProducts(queryEmbedding, topK = 5) {
     const [embeddings] = await db.query(`
       SELECT 
         pe.product_id,
-        CAST(pe.embedding AS CHAR(100000)) as embedding_text,
+        ${await embeddingTextColumns()},
         p.product_name,
         IFNULL(p.brand, '') as brand,
         IFNULL(p.variety, '') as variety,
@@ -443,14 +381,12 @@ async function searchSimilarProducts(queryEmbedding, topK = 5) {
     
     for (const row of embeddings) {
       try {
-        // Parse the embedding
-        let embeddingText = row.embedding_text.trim();
-        if (embeddingText.endsWith('...')) {
-          continue; // Skip truncated embeddings
+        // Decode the embedding (binary blob or JSON text)
+        const productEmbedding = embeddingFromRow(row);
+        if (!productEmbedding) {
+          continue; // Skip missing or truncated embeddings
         }
         
-        const productEmbedding = JSON.parse(embeddingText);
-        
         // Ensure matching dimensions
         if (productEmbedding.length !== queryEmbedding.length) {
           continue;
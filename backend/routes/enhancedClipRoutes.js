@@ -1,10 +1,11 @@
 const express = require('express');
 const router = express.Router();
-const { spawn } = require('child_process');
 const fs = require('fs');
 const path = require('path');
 const crypto = require('crypto');
 const db = require('../config/db');
+const { embeddingTextColumns, embeddingFromRow } = require('../utils/embeddingBlob');
+const enhancedClipServiceManager = require('../services/enhancedClipServiceManager');
 
 // Enhanced CLIP search endpoint with smart cropping
 router.post('/enhanced-search', async (req, res) => {
@@ -129,138 +130,12 @@ router.post('/analyze-cropping', async (req, res) => {
 });
 
 function getEnhancedQueryEmbedding(imagePath, strategies) {
-  return new Promise((resolve, reject) => {
-    const strategiesJson = JSON.stringify(strategies);
-    const pythonScript = `
-import sys
-import os
-sys.path.append('${path.join(__dirname, '..', 'utils')}')
-
-from enhancedClipWithCropping import EnhancedCLIPWithCropping
-import json
-
-try:
-    enhancer = EnhancedCLIPWithCropping()
-    
-    # Parse strategies from command line
-    strategies = ${strategiesJson}
-    
-    # Get enhanced embedding
-    embedding = enhancer.enhanced_search("${imagePath}", strategies)
-    
-    if embedding:
-        print("ENHANCED_EMBEDDING_READY")
-        print(json.dumps(embedding))
-    else:
-        print("ERROR: Failed to generate enhanced embedding", file=sys.stderr)
-        sys.exit(1)
-        
-except Exception as e:
-    print(f"ERROR: {e}", file=sys.stderr)
-    sys.exit(1)
-`;
-
-    const pythonProcess = spawn('python3', ['-c', pythonScript], {
-      cwd: path.join(__dirname, '..')
-    });
-    
-    let output = '';
-    let errorOutput = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-      output += data.toString();
-    });
-
-    pythonProcess.stderr.on('data', (data) => {
-      errorOutput += data.toString();
-    });
-
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        reject(new Error(`Enhanced CLIP process failed: ${errorOutput}`));
-        return;
-      }
-
-      try {
-        const lines = output.trim().split('\n');
-        let embeddingLine = null;
-        
-        for (let i = lines.length - 1; i >= 0; i--) {
-          if (lines[i].startsWith('[') && lines[i].endsWith(']')) {
-            embeddingLine = lines[i];
-            break;
-          }
-        }
-        
-        if (embeddingLine) {
-          const embedding = JSON.parse(embeddingLine);
-          resolve(embedding);
-        } else {
-          reject(new Error('Failed to get valid enhanced embedding'));
-        }
-      } catch (error) {
-        reject(new Error(`Failed to parse enhanced embedding: ${error.message}`));
-      }
-    });
-  });
+  // Runs in the persistent enhanced CLIP service (model and croppers stay loaded)
+  return enhancedClipServiceManager.enhancedSearch(imagePath, strategies);
 }
 
 function analyzeCroppingEffectiveness(imagePath) {
-  return new Promise((resolve, reject) => {
-    const pythonScript = `
-import sys
-import os
-sys.path.append('${path.join(__dirname, '..', 'utils')}')
-
-from enhancedClipWithCropping import EnhancedCLIPWithCropping
-import json
-
-try:
-    enhancer = EnhancedCLIPWithCropping()
-    
-    # Analyze cropping effectiveness
-    analysis = enhancer.analyze_cropping_effectiveness("${imagePath}")
-    
-    if analysis:
-        print(json.dumps(analysis))
-    else:
-        print("ERROR: Failed to analyze cropping", file=sys.stderr)
-        sys.exit(1)
-        
-except Exception as e:
-    print(f"ERROR: {e}", file=sys.stderr)
-    sys.exit(1)
-`;
-
-    const pythonProcess = spawn('python3', ['-c', pythonScript], {
-      cwd: path.join(__dirname, '..')
-    });
-    
-    let output = '';
-    let errorOutput = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-      output += data.toString();
-    });
-
-    pythonProcess.stderr.on('data', (data) => {
-      errorOutput += data.toString();
-    });
-
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        reject(new Error(`Cropping analysis failed: ${errorOutput}`));
-        return;
-      }
-
-      try {
-        const analysis = JSON.parse(output.trim());
-        resolve(analysis);
-      } catch (error) {
-        reject(new Error(`Failed to parse analysis results: ${error.message}`));
-      }
-    });
-  });
+  return enhancedClipServiceManager.analyzeCropping(imagePath);
 }
 
 function getRecommendations(analysis) {
@@ -309,7 +184,7 @@ async function searchSimilarProducts(queryEmbedding, topK = 5) {
     const [embeddings] = await db.query(`
       SELECT 
         pe.product_id,
-        CAST(pe.embedding AS CHAR(100000)) as embedding_text,
+        ${await embeddingTextColumns()},
         p.product_name,
         IFNULL(p.brand, '') as brand,
         IFNULL(p.variety, '') as variety,
@@ -327,14 +202,12 @@ async function searchSimilarProducts(queryEmbedding, topK = 5) {
     
     for (const row of embeddings) {
       try {
-        // Parse the embedding
-        let embeddingText = row.embedding_text.trim();
-        if (embeddingText.endsWith('...')) {
-          continue; // Skip truncated embeddings
+        // Decode the embedding (binary blob or JSON text)
+        const productEmbedding = embeddingFromRow(row);
+        if (!productEmbedding) {
+          continue; // Skip missing or truncated embeddings
         }
         
-        const productEmbedding = JSON.parse(embeddingText);
-        
         // Ensure matching dimensions
         if (productEmbedding.length !== queryEmbedding.length) {
           continue;
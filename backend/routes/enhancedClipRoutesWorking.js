@@ -1,10 +1,11 @@
 const express = require('express');
 const router = express.Router();
-const { spawn } = require('child_process');
 const fs = require('fs');
 const path = require('path');
 const crypto = require('crypto');
 const db = require('../config/db');
+const { embeddingTextColumns, embeddingFromRow } = require('../utils/embeddingBlob');
+const enhancedClipServiceManager = require('../services/enhancedClipServiceManager');
 
 // Enhanced CLIP search endpoint with smart cropping and fallback
 router.post('/enhanced-search', async (req, res) => {
@@ -118,147 +119,13 @@ router.post('/analyze-cropping', async (req, res) => {
 });
 
 function getEnhancedQueryEmbedding(imagePath, strategies) {
-  return new Promise((resolve, reject) => {
-    // Try to use the enhanced CLIP with cropping
-    const pythonScript = `
-import sys
-import os
-sys.path.append('${path.join(__dirname, '..', 'utils')}')
-
-try:
-    from enhancedClipWithCropping import EnhancedCLIPWithCropping
-    import json
-    
-    enhancer = EnhancedCLIPWithCropping()
-    strategies = ${JSON.stringify(strategies)}
-    
-    # Get enhanced embedding
-    embedding = enhancer.enhanced_search("${imagePath}", strategies)
-    
-    if embedding:
-        print("ENHANCED_EMBEDDING_READY")
-        print(json.dumps(embedding))
-    else:
-        print("ERROR: Failed to generate enhanced embedding", file=sys.stderr)
-        sys.exit(1)
-        
-except Exception as e:
-    print(f"ERROR: {e}", file=sys.stderr)
-    sys.exit(1)
-`;
-
-    const pythonProcess = spawn('python3', ['-c', pythonScript], {
-      cwd: path.join(__dirname, '..')
-    });
-    
-    let output = '';
-    let errorOutput = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-      output += data.toString();
-    });
-
-    pythonProcess.stderr.on('data', (data) => {
-      errorOutput += data.toString();
-    });
-
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        reject(new Error(`Enhanced CLIP process failed: ${errorOutput}`));
-        return;
-      }
-
-      try {
-        const lines = output.trim().split('\n');
-        let embeddingLine = null;
-        
-        for (let i = lines.length - 1; i >= 0; i--) {
-          if (lines[i].startsWith('[') && lines[i].endsWith(']')) {
-            embeddingLine = lines[i];
-            break;
-          }
-        }
-        
-        if (embeddingLine) {
-          const embedding = JSON.parse(embeddingLine);
-          resolve(embedding);
-        } else {
-          reject(new Error('Failed to get valid enhanced embedding'));
-        }
-      } catch (error) {
-        reject(new Error(`Failed to parse enhanced embedding: ${error.message}`));
-      }
-    });
-  });
+  // Runs in the persistent enhanced CLIP service (model and croppers stay loaded)
+  return enhancedClipServiceManager.enhancedSearch(imagePath, strategies);
 }
 
 function getOriginalQueryEmbedding(imagePath) {
-  return new Promise((resolve, reject) => {
-    const pythonScript = `
-import torch
-import numpy as np
-from PIL import Image
-from transformers import CLIPProcessor, CLIPModel
-import json
-import sys
-
-try:
-    # Load CLIP model
-    model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-    processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-    
-    # Process image normally (no cropping)
-    image = Image.open("${imagePath}").convert('RGB')
-    inputs = processor(images=image, return_tensors="pt")
-    
-    with torch.no_grad():
-        features = model.get_image_features(**inputs)
-        # Normalize for cosine similarity
-        features = features / features.norm(dim=-1, keepdim=True)
-        embedding = features.cpu().numpy().flatten().tolist()
-    
-    print(json.dumps(embedding))
-    
-except Exception as e:
-    print(f"ERROR: {e}", file=sys.stderr)
-    sys.exit(1)
-`;
-
-    const pythonProcess = spawn(path.join(__dirname, '..', 'clip_env', 'bin', 'python'), ['-c', pythonScript], {
-      cwd: path.join(__dirname, '..')
-    });
-    
-    let output = '';
-    let errorOutput = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-      output += data.toString();
-    });
-
-    pythonProcess.stderr.on('data', (data) => {
-      errorOutput += data.toString();
-    });
-
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        reject(new Error(`Python process failed: ${errorOutput}`));
-        return;
-      }
-
-      try {
-        const lines = output.trim().split('\n');
-        const lastLine = lines[lines.length - 1];
-        if (lastLine.startsWith('[') && lastLine.endsWith(']')) {
-          const embedding = JSON.parse(lastLine);
-          resolve(embedding);
-        } else {
-          reject(new Error('Failed to get valid embedding'));
-        }
-      } catch (error) {
-        reject(new Error(`Failed to parse embedding: ${error.message}`));
-      }
-    });
-  });
+  // Process image normally (no cropping) with the warm model
+  return enhancedClipServiceManager.embedImage(imagePath);
 }
 
 async function searchSimilarProducts(queryEmbedding, topK = 5) {
@@ -267,7 +134,7 @@ async function searchSimilarProducts(queryEmbedding, topK = 5) {
     const [embeddings] = await db.query(`
       SELECT 
         pe.product_id,
-        CAST(pe.embedding AS CHAR(100000)) as embedding_text,
+        ${await embeddingTextColumns()},
         p.product_name,
         IFNULL(p.brand, '') as brand,
         IFNULL(p.variety, '') as variety,
@@ -285,14 +152,12 @@ async function searchSimilarProducts(queryEmbedding, topK = 5) {
     
     for (const row of embeddings) {
       try {
-        // Parse the embedding
-        let embeddingText = row.embedding_text.trim();
-        if (embeddingText.endsWith('...')) {
-          continue; // Skip truncated embeddings
+        // Decode the embedding (binary blob or JSON text)
+        const productEmbedding = embeddingFromRow(row);
+        if (!productEmbedding) {
+          continue; // Skip missing or truncated embeddings
         }
         
-        const productEmbedding = JSON.parse(embeddingText);
-        
         // Ensure matching dimensions
         if (productEmbedding.length !== queryEmbedding.length) {
           continue;
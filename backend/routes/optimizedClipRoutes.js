@@ -5,6 +5,7 @@ const path = require('path');
 const crypto = require('crypto');
 const db = require('../config/db');
 const clipServiceManager = require('../services/clipServiceManager');
+const { hasEmbeddingBlobColumn, storedEmbeddingCondition, tenantFields, toIndexEntry } = require('../utils/embeddingBlob');
 
 // Optimized CLIP search endpoint using persistent service
 router.post('/optimized-search', async (req, res) => {
@@ -12,7 +13,7 @@ router.post('/optimized-search', async (req, res) => {
   console.log('⚡ Optimized CLIP search request received');
   
   try {
-    const { image } = req.body;
+    const { image, user_id, shop_name } = req.body;
     
     if (!image) {
       return res.status(400).json({ error: 'Image data is required' });
@@ -36,21 +37,34 @@ router.post('/optimized-search', async (req, res) => {
     // Extract base64 data
     const base64Data = image.replace(/^data:image\/[a-z]+;base64,/, '');
     
-    // Get CLIP embedding using persistent service (much faster!)
-    const embeddingResult = await clipServiceManager.processBase64Image(base64Data);
+    // Make sure the catalog index is resident in the CLIP service
+    await ensureCatalogIndexLoaded();
+    const indexTime = Date.now();
+    
+    // Optional per-user / per-shop filter: only that tenant's partition is scanned
+    const filters = {};
+    if (user_id !== undefined && user_id !== null) filters.user_id = user_id;
+    if (shop_name) filters.shop_name = shop_name;
+    
+    // Embed and search in one round trip (single matrix-vector product in Python)
+    const searchResult = await clipServiceManager.searchIndex({
+      imageBuffer: Buffer.from(base64Data, 'base64'),
+      topK: 5,
+      minScore: 0.3,
+      filters: Object.keys(filters).length > 0 ? filters : undefined
+    });
     
-    if (embeddingResult.status !== 'success') {
-      throw new Error(`Embedding generation failed: ${embeddingResult.message}`);
+    if (searchResult.status !== 'success') {
+      throw new Error(`Index search failed: ${searchResult.message}`);
     }
     
-    const queryEmbedding = embeddingResult.embedding;
     const embeddingTime = Date.now();
-    console.log(`✅ Embedding computed in ${embeddingTime - startTime}ms`);
+    console.log(`✅ Embedding + index search computed in ${embeddingTime - indexTime}ms`);
     
-    // Search similar products with optimized database query
-    const similarProducts = await searchSimilarProductsOptimized(queryEmbedding, 5);
+    // Attach product details to the matched ids
+    const similarProducts = await attachProductDetails(searchResult.results);
     const searchTime = Date.now();
-    console.log(`🎯 Found ${similarProducts.length} similar products in ${searchTime - embeddingTime}ms`);
+    console.log(`🎯 Found ${similarProducts.length} similar products (details fetched in ${searchTime - embeddingTime}ms)`);
     
     const totalTime = Date.now() - startTime;
     console.log(`⚡ Total optimized search time: ${totalTime}ms`);
@@ -62,9 +76,10 @@ router.post('/optimized-search', async (req, res) => {
       count: similarProducts.length,
       performance: {
         total_time_ms: totalTime,
-        embedding_time_ms: embeddingTime - startTime,
+        index_load_time_ms: indexTime - startTime,
+        embedding_time_ms: embeddingTime - indexTime,
         search_time_ms: searchTime - embeddingTime,
-        optimization: 'persistent_service'
+        optimization: 'persistent_service_index'
       }
     });
     
@@ -115,7 +130,7 @@ router.post('/performance-test', async (req, res) => {
     
     // Test optimized method
     const optimizedStart = Date.now();
-    const optimizedResult = await clipServiceManager.processBase64Image(base64Data);
+    const optimizedResult = await clipServiceManager.embedImageBuffer(Buffer.from(base64Data, 'base64'));
     const optimizedTime = Date.now() - optimizedStart;
     
     // Test traditional method (for comparison)
@@ -173,127 +188,272 @@ router.post('/performance-test', async (req, res) => {
   }
 });
 
+let catalogIndexPromise = null;
+let catalogIndexSync = null;
+
+// How often the index is reconciled with product_embeddings (new/updated/deleted rows)
+const INDEX_SYNC_INTERVAL_MS = 30000;
+
+// How often the tenant tags are re-read: Inventories changes carry no
+// timestamp the product_embeddings watermark could follow
+const TAG_REFRESH_INTERVAL_MS = 5 * 60 * 1000;
+
+const catalogIndexState = {
+  indexedIds: new Set(),
+  watermark: null,
+  lastSyncAt: 0,
+  // product_id -> tenantKey() of the tags the index holds
+  tags: new Map(),
+  lastTagRefreshAt: 0
+};
+
+// Owner and stocking shops of a product, read as tenant tags for filtered search
+// Use with `FROM product_embeddings pe LEFT JOIN Products p ON p.product_id = pe.product_id`
+const TENANT_COLUMNS = `p.user_id,
+        (SELECT GROUP_CONCAT(DISTINCT i.shop_name ORDER BY i.shop_name SEPARATOR '\\n')
+         FROM Inventories i WHERE i.product_id = pe.product_id) as shop_names`;
+
 /**
- * Optimized similarity search with improved database queries
- * @param {Array} queryEmbedding - The query embedding vector
- * @param {number} topK - Number of top results to return
- * @returns {Array} - Top similar products
+ * Columns to read for the index; the binary blob is used when the
+ * add_embedding_blob_column.sql migration has been applied.
+ * Owner and stocking shops are read as tenant tags for filtered search.
+ * Use with `FROM product_embeddings pe LEFT JOIN Products p ON p.product_id = pe.product_id`
  */
-async function searchSimilarProductsOptimized(queryEmbedding, topK = 5) {
-  try {
-    const startTime = Date.now();
-    
-    // Optimized database query - fetch only essential data
-    const [embeddings] = await db.query(`
-      SELECT 
-        pe.product_id,
-        pe.embedding,
-        p.product_name,
-        IFNULL(p.brand, '') as brand,
-        IFNULL(p.variety, '') as variety,
-        IFNULL(p.size, '') as size,
-        COALESCE(p.image_s3_url, p.image) as image_url
-      FROM product_embeddings pe
-      JOIN Products p ON pe.product_id = p.product_id
-      WHERE pe.embedding IS NOT NULL 
-        AND LENGTH(pe.embedding) > 100
-      LIMIT 300
-    `);
+async function embeddingColumns() {
+  const vectorColumns = (await hasEmbeddingBlobColumn())
+    ? 'pe.product_id, pe.embedding, pe.embedding_blob, pe.embedding_dtype, pe.created_at'
+    : 'pe.product_id, pe.embedding, pe.created_at';
+  
+  return `${vectorColumns},
+        ${TENANT_COLUMNS}`;
+}
 
-    const dbTime = Date.now() - startTime;
-    console.log(`📊 Database query completed in ${dbTime}ms (${embeddings.length} products)`);
+/**
+ * Comparable form of a row's tenant tags
+ */
+function tenantKey(row) {
+  return JSON.stringify([row.user_id, row.shop_names || '']);
+}
 
-    const similarities = [];
-    let validCount = 0;
-    const computeStart = Date.now();
-    
-    // Pre-compute query norms for efficiency
-    let queryNorm = 0;
-    for (let i = 0; i < queryEmbedding.length; i++) {
-      queryNorm += queryEmbedding[i] * queryEmbedding[i];
-    }
-    queryNorm = Math.sqrt(queryNorm);
-    
-    if (queryNorm === 0) {
-      throw new Error('Invalid query embedding - zero norm');
+/**
+ * Record the tags the index now holds for these rows
+ */
+function rememberTags(rows) {
+  rows.forEach(row => catalogIndexState.tags.set(row.product_id, tenantKey(row)));
+}
+
+/**
+ * Re-read the owner and stocking shops of every indexed product and retag
+ * the ones that changed, so the shop_name/user_id filters follow Inventories
+ * edits the embedding watermark does not see
+ * @returns {Promise<number>} - Products retagged
+ */
+async function refreshTenantTags() {
+  catalogIndexState.lastTagRefreshAt = Date.now();
+  
+  const [rows] = await db.query(`
+    SELECT pe.product_id, ${TENANT_COLUMNS}
+    FROM product_embeddings pe
+    LEFT JOIN Products p ON p.product_id = pe.product_id
+  `);
+  
+  const changedRows = rows.filter(row =>
+    catalogIndexState.indexedIds.has(row.product_id) && catalogIndexState.tags.get(row.product_id) !== tenantKey(row)
+  );
+  if (changedRows.length > 0) {
+    await clipServiceManager.updateTenantTags(changedRows.map(row => ({ product_id: row.product_id, ...tenantFields(row) })));
+    rememberTags(changedRows);
+  }
+  return changedRows.length;
+}
+
+/**
+ * Track the newest created_at seen so later syncs only fetch changed rows
+ */
+function advanceWatermark(rows) {
+  for (const row of rows) {
+    if (row.created_at && (!catalogIndexState.watermark || row.created_at > catalogIndexState.watermark)) {
+      catalogIndexState.watermark = row.created_at;
     }
-    
-    // Optimized similarity computation
-    for (const row of embeddings) {
-      try {
-        // Parse embedding with error handling
-        let productEmbedding;
-        try {
-          productEmbedding = JSON.parse(row.embedding);
-        } catch (parseError) {
-          continue; // Skip malformed embeddings
-        }
-        
-        // Quick dimension check
-        if (!Array.isArray(productEmbedding) || productEmbedding.length !== queryEmbedding.length) {
-          continue;
-        }
-        
-        // Optimized cosine similarity calculation
-        let dotProduct = 0;
-        let productNorm = 0;
-        let hasInvalidValue = false;
-        
-        for (let i = 0; i < queryEmbedding.length; i++) {
-          const pVal = productEmbedding[i];
-          
-          // Quick validity check
-          if (typeof pVal !== 'number' || !isFinite(pVal)) {
-            hasInvalidValue = true;
-            break;
-          }
-          
-          dotProduct += queryEmbedding[i] * pVal;
-          productNorm += pVal * pVal;
-        }
-        
-        if (hasInvalidValue || productNorm === 0) {
-          continue;
-        }
-        
-        productNorm = Math.sqrt(productNorm);
-        const similarity = dotProduct / (queryNorm * productNorm);
-        
-        // Only include reasonable similarities
-        if (similarity >= 0.3 && similarity <= 1.0) {
-          similarities.push({
-            product_id: row.product_id,
-            product_name: row.product_name,
-            brand: row.brand,
-            variety: row.variety,
-            size: row.size,
-            image_url: row.image_url,
-            similarity: similarity
-          });
-          validCount++;
+  }
+}
+
+/**
+ * Persist the index with its watermark so the next service start can
+ * memory-map it and only fetch rows changed since then
+ */
+async function saveCatalogSnapshot() {
+  try {
+    const watermark = catalogIndexState.watermark ? new Date(catalogIndexState.watermark).toISOString() : null;
+    await clipServiceManager.saveIndexSnapshot(watermark);
+  } catch (error) {
+    console.error('⚠️ Failed to save catalog index snapshot:', error.message);
+  }
+}
+
+/**
+ * Make sure the CLIP service's in-memory index holds every product embedding
+ * Uses the service's memory-mapped snapshot when available, otherwise loads all rows once
+ * @returns {Promise<Object>} - Loaded/skipped counts from the service
+ */
+function ensureCatalogIndexLoaded() {
+  if (!catalogIndexPromise) {
+    catalogIndexPromise = (async () => {
+      const startTime = Date.now();
+      
+      const stats = await clipServiceManager.indexStats({ includeIds: true });
+      if (stats.snapshot && stats.size > 0) {
+        // Snapshot already mapped at service startup - only apply changes since it was written
+        catalogIndexState.indexedIds = new Set(stats.product_ids);
+        catalogIndexState.watermark = stats.snapshot.watermark ? new Date(stats.snapshot.watermark) : null;
+        // The snapshot's tags may predate Inventories changes: compare them all on this sync
+        catalogIndexState.tags = new Map();
+        catalogIndexState.lastTagRefreshAt = 0;
+        if (!catalogIndexState.watermark) {
+          // No watermark recorded: the whole table counts as changed
+          catalogIndexState.watermark = new Date(0);
         }
+        await syncCatalogIndex();
         
-      } catch (e) {
-        // Skip this product and continue
-        continue;
+        console.log(`📊 Catalog index opened from snapshot: ${stats.size} embeddings in ${Date.now() - startTime}ms`);
+        return { loaded: stats.size, skipped: 0 };
       }
+      
+      const [rows] = await db.query(`
+        SELECT ${await embeddingColumns()}
+        FROM product_embeddings pe
+        LEFT JOIN Products p ON p.product_id = pe.product_id
+        WHERE ${await storedEmbeddingCondition()}
+      `);
+      
+      const summary = await clipServiceManager.loadIndex(rows.map(toIndexEntry));
+      
+      catalogIndexState.indexedIds = new Set(rows.map(row => row.product_id));
+      catalogIndexState.watermark = null;
+      advanceWatermark(rows);
+      catalogIndexState.tags = new Map();
+      rememberTags(rows);
+      catalogIndexState.lastSyncAt = Date.now();
+      catalogIndexState.lastTagRefreshAt = Date.now();
+      await saveCatalogSnapshot();
+      
+      console.log(`📊 Catalog index loaded: ${summary.loaded} embeddings (${summary.skipped} skipped) in ${Date.now() - startTime}ms`);
+      return summary;
+    })().catch(error => {
+      // Allow the next request to retry
+      catalogIndexPromise = null;
+      throw error;
+    });
+    return catalogIndexPromise;
+  }
+  
+  return catalogIndexPromise.then(summary => {
+    if (Date.now() - catalogIndexState.lastSyncAt >= INDEX_SYNC_INTERVAL_MS) {
+      // Reconcile in the background; the current search uses the index as is
+      syncCatalogIndex().catch(error => console.error('❌ Catalog index sync failed:', error.message));
+    }
+    return summary;
+  });
+}
+
+/**
+ * Apply rows added by precompute_embeddings.js / complete_missing_embeddings.js
+ * (and deletions) to the resident index without a full reload; every
+ * TAG_REFRESH_INTERVAL_MS also re-reads the tenant tags
+ */
+function syncCatalogIndex() {
+  if (catalogIndexSync) {
+    return catalogIndexSync;
+  }
+  
+  catalogIndexSync = (async () => {
+    catalogIndexState.lastSyncAt = Date.now();
+    
+    const [candidateRows] = catalogIndexState.watermark
+      ? await db.query(`
+          SELECT ${await embeddingColumns()}
+          FROM product_embeddings pe
+          LEFT JOIN Products p ON p.product_id = pe.product_id
+          WHERE ${await storedEmbeddingCondition()} AND pe.created_at >= ?
+        `, [catalogIndexState.watermark])
+      : [[]];
+    
+    // ">=" re-reads rows stamped exactly at the watermark; skip the ones already indexed
+    const changedRows = candidateRows.filter(row =>
+      row.created_at > catalogIndexState.watermark || !catalogIndexState.indexedIds.has(row.product_id)
+    );
+    
+    if (changedRows.length > 0) {
+      await clipServiceManager.upsertEmbeddings(changedRows.map(toIndexEntry));
+      changedRows.forEach(row => catalogIndexState.indexedIds.add(row.product_id));
+      advanceWatermark(changedRows);
+      rememberTags(changedRows);
     }
     
-    const computeTime = Date.now() - computeStart;
-    console.log(`🧮 Similarity computation completed in ${computeTime}ms (${validCount} valid)`);
-    
-    // Sort by similarity and return top K
-    similarities.sort((a, b) => b.similarity - a.similarity);
-    const topResults = similarities.slice(0, topK);
+    const [currentRows] = await db.query(`
+      SELECT pe.product_id FROM product_embeddings pe WHERE ${await storedEmbeddingCondition()}
+    `);
+    const currentIds = new Set(currentRows.map(row => row.product_id));
+    const removedIds = [...catalogIndexState.indexedIds].filter(id => !currentIds.has(id));
+    
+    if (removedIds.length > 0) {
+      await clipServiceManager.removeEmbeddings(removedIds);
+      removedIds.forEach(id => {
+        catalogIndexState.indexedIds.delete(id);
+        catalogIndexState.tags.delete(id);
+      });
+    }
     
-    console.log(`⚡ Optimized search completed: ${Date.now() - startTime}ms total`);
+    const retagged = Date.now() - catalogIndexState.lastTagRefreshAt >= TAG_REFRESH_INTERVAL_MS
+      ? await refreshTenantTags()
+      : 0;
     
-    return topResults;
+    if (changedRows.length > 0 || removedIds.length > 0 || retagged > 0) {
+      console.log(`🔄 Catalog index synced: ${changedRows.length} upserted, ${removedIds.length} removed, ${retagged} retagged`);
+      await saveCatalogSnapshot();
+    }
+  })().finally(() => {
+    catalogIndexSync = null;
+  });
+  
+  return catalogIndexSync;
+}
 
-  } catch (error) {
-    console.error('❌ Optimized search error:', error);
-    throw new Error(`Optimized search failed: ${error.message}`);
+// Reload the index whenever the Python service restarts
+clipServiceManager.on('serviceExit', () => {
+  catalogIndexPromise = null;
+});
+
+/**
+ * Fetch product details for index matches, keeping the similarity order
+ * @param {Array} matches - [{ product_id, similarity }] from the CLIP service
+ * @returns {Array} - Top similar products
+ */
+async function attachProductDetails(matches) {
+  if (!matches || matches.length === 0) {
+    return [];
   }
+  
+  const [products] = await db.query(`
+    SELECT 
+      p.product_id,
+      p.product_name,
+      IFNULL(p.brand, '') as brand,
+      IFNULL(p.variety, '') as variety,
+      IFNULL(p.size, '') as size,
+      COALESCE(p.image_s3_url, p.image) as image_url
+    FROM Products p
+    WHERE p.product_id IN (?)
+  `, [matches.map(match => match.product_id)]);
+  
+  const byId = new Map(products.map(product => [product.product_id, product]));
+  
+  return matches
+    .filter(match => byId.has(match.product_id))
+    .map(match => ({
+      ...byId.get(match.product_id),
+      similarity: match.similarity
+    }));
 }
 
 module.exports = router;
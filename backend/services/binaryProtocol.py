@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Length-Prefixed Binary Framing for the CLIP Service Socket
+Every frame is an 8-byte prefix (big-endian uint32 header length, uint32
+payload length), a UTF-8 JSON header and raw payload bytes:
+requests carry the encoded image file as payload, embedding responses
+carry the raw little-endian float32 vector
+"""
+
+import json
+import struct
+import numpy as np
+
+PREFIX = struct.Struct(">II")
+
+# Sanity limits against a corrupt or hostile length prefix
+MAX_HEADER_BYTES = 1 << 20
+MAX_PAYLOAD_BYTES = 64 << 20
+
+class FrameError(ValueError):
+    """The peer sent a frame that cannot be parsed"""
+
+def _read_exact(stream, size):
+    """Read exactly size bytes; None on a clean EOF before the first byte"""
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = stream.read(remaining)
+        if not chunk:
+            if remaining == size:
+                return None
+            raise FrameError("Connection closed in the middle of a frame")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+def read_frame(stream):
+    """Next (header dict, payload bytes) from a binary stream, or None at EOF"""
+    prefix = _read_exact(stream, PREFIX.size)
+    if prefix is None:
+        return None
+    
+    header_size, payload_size = PREFIX.unpack(prefix)
+    if header_size > MAX_HEADER_BYTES or payload_size > MAX_PAYLOAD_BYTES:
+        raise FrameError(f"Frame too large ({header_size} header / {payload_size} payload bytes)")
+    
+    header = _read_exact(stream, header_size) if header_size else b"{}"
+    payload = _read_exact(stream, payload_size) if payload_size else b""
+    if header is None or payload is None:
+        raise FrameError("Connection closed in the middle of a frame")
+    
+    try:
+        return json.loads(header), payload
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise FrameError(f"Invalid frame header: {e}")
+
+def write_frame(stream, header, payload=b""):
+    """Write one frame and flush it"""
+    header_bytes = json.dumps(header).encode("utf-8")
+    stream.write(PREFIX.pack(len(header_bytes), len(payload)) + header_bytes)
+    if payload:
+        stream.write(payload)
+    stream.flush()
+
+def embedding_payload(embedding):
+    """Raw little-endian float32 bytes of one embedding"""
+    return np.asarray(embedding, dtype="<f4").tobytes()
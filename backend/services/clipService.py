@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 """
 Persistent CLIP Service for Fast Image Similarity Search
-Keeps CLIP model loaded in memory to avoid initialization overhead
+Keeps the CLIP vision tower loaded in memory to avoid initialization overhead
+The one model host for every CLIP entry point: plain/base64 embeddings,
+catalog search, multi-crop (enhanced) requests and batch precompute
 """
 
 import sys
@@ -9,21 +11,138 @@ import json
 import torch
 import numpy as np
 from PIL import Image
-from transformers import CLIPProcessor, CLIPModel
+from transformers import CLIPImageProcessor, CLIPVisionModelWithProjection
 import warnings
 import io
 import base64
 import traceback
+import argparse
+import threading
+import queue
+import time
+import os
+import tempfile
+import socketserver
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from embeddingIndex import EmbeddingIndex, SNAPSHOT_META, TENANT_FIELDS
+from embeddingFormat import OUTPUT_FORMATS, encode_embedding, entry_vector
+from binaryProtocol import FrameError, read_frame, write_frame, embedding_payload
+from embeddingCache import EmbeddingCache
+from inferenceBackend import BACKENDS, create_backend, cosine_agreement, EagerBackend
+from fastPreprocess import FastPreprocessor, compare_with_processor, compare_decode_with_processor
 
 # Suppress warnings for cleaner output
 warnings.filterwarnings("ignore")
 
+MODEL_NAME = "openai/clip-vit-base-patch32"
+
+# The multi-crop pipeline (enhancedClipWithCropping.py + smartCropping.py)
+UTILS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils")
+
+# Exported TorchScript/ONNX vision towers
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "clip_models")
+
+# Real product photos for the backend agreement check (synthetic images when absent)
+CALIBRATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "temp", "real_test_images")
+CALIBRATION_IMAGES = 4
+
+# Largest pixel difference from CLIPImageProcessor accepted for fast preprocessing
+PREPROCESS_TOLERANCE = 1e-3
+
+# Mean pixel difference (normalized units, ~2 uint8 levels) accepted for reduced-scale JPEG decoding
+DRAFT_DECODE_TOLERANCE = 0.03
+
+# Images per forward pass for precompute_batch
+PRECOMPUTE_CHUNK_SIZE = 16
+
+# Actions that produce an image embedding and can share a forward pass
+IMAGE_ACTIONS = ("process_image", "process_base64")
+
+# Multi-crop actions: the cropping runs off the inference thread, only the
+# forward pass over the crops needs the model
+CROP_ACTIONS = ("enhanced_search", "analyze")
+
+# Actions that take the model lock around their forward passes themselves
+UNLOCKED_ACTIONS = CROP_ACTIONS + ("precompute_batch",)
+
+def is_image_request(request):
+    """True when the request needs a forward pass (searches may carry a ready embedding)"""
+    action = request.get("action")
+    if action == "search":
+        return request.get("embedding") is None and request.get("embedding_b64") is None
+    return action in IMAGE_ACTIONS
+
 class PersistentCLIPService:
-    def __init__(self):
+    def __init__(self, batch_window_ms=0, max_batch_size=1, snapshot_dir=None,
+                 quantization=None, rerank_factor=4, ann=None, nprobe=8, ann_lists=None,
+                 decode_workers=0, cache_size=0, cache_dir=None, backend="torch",
+                 backend_int8=False, backend_dir=None, min_agreement=0.98, preprocess="fast",
+                 crop_budget=None):
         self.model = None
         self.processor = None
         self.device = None
+        self.model_name = MODEL_NAME
+        
+        # NumPy preprocessing in place of CLIPImageProcessor (None = processor)
+        self.preprocess_mode = preprocess
+        self.fast_preprocessor = None
+        
+        # Text tower and tokenizer, loaded on the first process_text request
+        self.text_model = None
+        self.tokenizer = None
+        
+        # Inference backend behind get_image_features (eager torch, TorchScript or ONNX Runtime)
+        self.backend = None
+        self.backend_name = backend
+        self.backend_int8 = backend_int8
+        self.backend_dir = backend_dir or BACKEND_DIR
+        self.min_agreement = min_agreement
+        self.backend_agreement = None
+        
+        # Multi-crop pipeline sharing this model, created on the first enhanced request
+        self.enhancer = None
+        self._enhancer_lock = threading.Lock()
+        
+        # Default seconds for the cropping stage of enhanced requests (None = no limit)
+        self.crop_budget = crop_budget
+        
+        # Embeddings keyed by image content hash (None = every image is embedded),
+        # created once the model is loaded and the effective pipeline is known
+        self.cache = None
+        
+        # Catalog embeddings for in-process similarity search
+        self.index = EmbeddingIndex(
+            quantization=quantization,
+            rerank_factor=rerank_factor,
+            ann=ann,
+            nprobe=nprobe,
+            n_lists=ann_lists,
+            # Quantized full-precision vectors spill next to the snapshot (/tmp may be RAM)
+            spill_dir=snapshot_dir if snapshot_dir and os.path.isdir(snapshot_dir) else None
+        )
+        self.snapshot_dir = snapshot_dir
+        
+        # Batching configuration (disabled when max_batch_size <= 1)
+        self.batch_window = max(0, batch_window_ms) / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        
+        # Image decode/preprocess threads (0 = requests are handled in arrival order)
+        self.decode_workers = max(0, decode_workers)
+        
+        # Responses are written from several threads in the concurrent loop
+        self._send_lock = threading.Lock()
+        # Stream responses go to while sys.stdout points at stderr (None = sys.stdout)
+        self._response_stream = None
+        
+        # Serializes model and index access between the stdin loop and socket connections
+        self._model_lock = threading.RLock()
+        
         self._initialize_model()
+        if cache_size or cache_dir:
+            self.cache = EmbeddingCache(self._cache_namespace(), cache_size, cache_dir)
+        self._open_snapshot()
     
     def _initialize_model(self):
         """Initialize CLIP model and processor"""
@@ -33,138 +152,1367 @@ class PersistentCLIPService:
             # Use CPU for consistent performance (GPU optional)
             self.device = "cuda" if torch.cuda.is_available() else "cpu"
             
-            # Load CLIP model and processor
-            model_name = "openai/clip-vit-base-patch32"
-            self.model = CLIPModel.from_pretrained(model_name)
-            self.processor = CLIPProcessor.from_pretrained(model_name)
+            # Only the vision tower + projection and the image processor: every
+            # request embeds images, so the text tower and tokenizer stay unloaded
+            self.model = CLIPVisionModelWithProjection.from_pretrained(self.model_name)
+            self.processor = CLIPImageProcessor.from_pretrained(self.model_name)
             
             # Move model to device
             self.model = self.model.to(self.device)
             self.model.eval()  # Set to evaluation mode
             
-            print(json.dumps({"status": "ready", "message": f"CLIP model loaded on {self.device}"}), flush=True)
+            if self.preprocess_mode == "fast":
+                self.fast_preprocessor = self._load_fast_preprocessor()
+            self.backend = self._load_backend()
             
+            print(json.dumps({
+                "status": "ready",
+                "message": f"CLIP model loaded on {self.device} ({self.backend.name} backend, "
+                           f"{'fast' if self.fast_preprocessor else 'processor'} preprocessing)"
+            }), flush=True)
+        
         except Exception as e:
             print(json.dumps({"status": "error", "message": f"Failed to initialize CLIP: {str(e)}"}), flush=True)
             sys.exit(1)
     
-    def process_image_from_path(self, image_path):
-        """Process image from file path"""
+    def _cache_namespace(self):
+        """
+        Cache namespace: the model plus whatever makes its vectors differ slightly,
+        i.e. the backend actually in use (after any fallback to eager PyTorch) and
+        the preprocessing path, so entries of different pipelines are kept apart
+        """
+        if self.fast_preprocessor is None:
+            preprocess = "processor"
+        else:
+            preprocess = "fast" if self.fast_preprocessor.draft else "fast-nodraft"
+        return f"{self.model_name}@{self.backend.name}+{preprocess}"
+    
+    def _load_backend(self):
+        """
+        Build the configured inference backend and check it against the eager model
+        Falls back to eager PyTorch when the backend cannot be built or disagrees
+        """
+        eager = EagerBackend(self.model)
+        if self.backend_name == "torch" and not self.backend_int8:
+            return eager
+        if self.device != "cpu":
+            print(json.dumps({
+                "status": "warning",
+                "message": f"{self.backend_name} backend is CPU-only; using eager PyTorch on {self.device}"
+            }), flush=True)
+            return eager
+        
         try:
-            # Load and process image
-            image = Image.open(image_path).convert('RGB')
-            
-            # Get image features
-            inputs = self.processor(images=image, return_tensors="pt")
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            
-            with torch.no_grad():
-                image_features = self.model.get_image_features(**inputs)
-                # Normalize features
-                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-            
-            # Convert to numpy and then to list for JSON serialization
-            embedding = image_features.cpu().numpy().flatten().tolist()
-            
+            with redirect_stdout(sys.stderr):
+                backend = create_backend(self.backend_name, self.model, self.model_name,
+                                         self.backend_dir, self.backend_int8)
+            min_cosine, mean_cosine = cosine_agreement(eager, backend, self._calibration_inputs())
+        except Exception as e:
+            print(json.dumps({
+                "status": "warning",
+                "message": f"Failed to build {self.backend_name} backend, using eager PyTorch: {str(e)}"
+            }), flush=True)
+            return eager
+        
+        self.backend_agreement = {"min_cosine": round(min_cosine, 5), "mean_cosine": round(mean_cosine, 5)}
+        if min_cosine < self.min_agreement:
+            print(json.dumps({
+                "status": "warning",
+                "message": f"{backend.name} backend disagrees with eager PyTorch (min cosine {min_cosine:.4f} "
+                           f"< {self.min_agreement}); using eager PyTorch"
+            }), flush=True)
+            return eager
+        
+        print(json.dumps({
+            "status": "ready",
+            "message": f"{backend.name} backend agrees with eager PyTorch (min cosine {min_cosine:.4f})"
+        }), flush=True)
+        return backend
+    
+    def _load_fast_preprocessor(self):
+        """Fast preprocessing when it reproduces CLIPImageProcessor on the calibration images"""
+        try:
+            fast = FastPreprocessor(self.processor)
+            difference = compare_with_processor(fast, self.processor, self._calibration_images())
+        except Exception as e:
+            print(json.dumps({
+                "status": "warning",
+                "message": f"Fast preprocessing unavailable, using CLIPImageProcessor: {str(e)}"
+            }), flush=True)
+            return None
+        
+        if difference > PREPROCESS_TOLERANCE:
+            print(json.dumps({
+                "status": "warning",
+                "message": f"Fast preprocessing differs from CLIPImageProcessor (max {difference:.2e}); "
+                           f"using CLIPImageProcessor"
+            }), flush=True)
+            return None
+        
+        # Every request and precompute decodes through fast.decode, so the draft
+        # decode is checked end to end on JPEG bytes, not just the pixel math
+        try:
+            drift = compare_decode_with_processor(fast, self.processor, self._calibration_images())
+        except Exception as e:
+            drift = None
+            reason = str(e)
+        else:
+            reason = f"mean {drift:.2e} > {DRAFT_DECODE_TOLERANCE}"
+        if drift is None or drift > DRAFT_DECODE_TOLERANCE:
+            fast.draft = False
+            print(json.dumps({
+                "status": "warning",
+                "message": f"Reduced-scale JPEG decoding differs from CLIPImageProcessor ({reason}); "
+                           f"decoding at full size"
+            }), flush=True)
+        return fast
+    
+    def _calibration_images(self):
+        """A few RGB images for the preprocessing and backend checks"""
+        images = []
+        if os.path.isdir(CALIBRATION_DIR):
+            for name in sorted(os.listdir(CALIBRATION_DIR))[:CALIBRATION_IMAGES]:
+                try:
+                    images.append(Image.open(os.path.join(CALIBRATION_DIR, name)).convert('RGB'))
+                except OSError:
+                    continue
+        
+        # Noise and gradients cover both busy and flat images when no photos are around
+        rng = np.random.RandomState(0)
+        while len(images) < CALIBRATION_IMAGES:
+            if len(images) % 2:
+                ramp = np.linspace(0, 255, 256, dtype=np.uint8)
+                pixels = np.stack([*np.meshgrid(ramp, ramp), np.full((256, 256), 128, np.uint8)], axis=-1)
+            else:
+                pixels = rng.randint(0, 256, (256, 256, 3), dtype=np.uint8)
+            images.append(Image.fromarray(pixels))
+        return images
+    
+    def _calibration_inputs(self):
+        """Preprocessed images for the backend agreement check"""
+        return self._preprocess(self._calibration_images(), reuse=False)["pixel_values"]
+    
+    def _open_snapshot(self):
+        """Memory-map the catalog snapshot at startup, if one was configured"""
+        if not self.snapshot_dir or not os.path.exists(os.path.join(self.snapshot_dir, SNAPSHOT_META)):
+            return
+        
+        try:
+            meta = self.index.load_snapshot(self.snapshot_dir, self.model_name)
+            print(json.dumps({
+                "status": "ready",
+                "message": f"Index snapshot mapped: {meta['count']} embeddings (watermark {meta.get('watermark')})"
+            }), flush=True)
+        except Exception as e:
+            # A stale or corrupt snapshot only costs a full reload
+            print(json.dumps({"status": "ready", "message": f"Ignoring index snapshot: {str(e)}"}), flush=True)
+    
+    def save_snapshot(self, request):
+        """Persist the current index so the next start can memory-map it"""
+        directory = request.get("path") or self.snapshot_dir
+        if not directory:
+            return {"status": "error", "message": "No snapshot path provided"}
+        
+        try:
+            meta = self.index.save_snapshot(directory, self.model_name, request.get("watermark"))
+            return {"status": "success", "snapshot": meta}
+        except Exception as e:
+            return {
+                "status": "error",
+                "message": f"Failed to save snapshot: {str(e)}",
+                "traceback": traceback.format_exc()
+            }
+    
+    def load_snapshot(self, request):
+        """Replace the index with a memory-mapped snapshot"""
+        directory = request.get("path") or self.snapshot_dir
+        if not directory:
+            return {"status": "error", "message": "No snapshot path provided"}
+        
+        try:
+            meta = self.index.load_snapshot(directory, self.model_name)
+            return {"status": "success", "snapshot": meta, "index_size": len(self.index)}
+        except Exception as e:
+            return {
+                "status": "error",
+                "message": f"Failed to load snapshot: {str(e)}",
+                "traceback": traceback.format_exc()
+            }
+    
+    def index_stats(self, request):
+        """Index size/memory, snapshot metadata and optionally the indexed ids"""
+        stats = {"status": "success", **self.index.stats()}
+        if request.get("include_ids"):
+            stats["product_ids"] = self.index.product_ids.tolist()
+        return stats
+    
+    def build_ann(self, request):
+        """(Re)train the IVF index on the current catalog"""
+        try:
+            start = time.time()
+            stats = self.index.build_ann(request.get("n_lists"), request.get("nprobe"))
             return {
                 "status": "success",
-                "embedding": embedding,
-                "dimensions": len(embedding)
+                "ann": stats,
+                "build_time_ms": round((time.time() - start) * 1000, 1)
             }
-            
         except Exception as e:
             return {
                 "status": "error",
-                "message": f"Failed to process image: {str(e)}",
+                "message": f"Failed to build ANN index: {str(e)}",
                 "traceback": traceback.format_exc()
             }
     
-    def process_image_from_base64(self, base64_data):
+    @staticmethod
+    def _center_crop(image, center_fraction):
+        """Centered square crop covering center_fraction of the short side"""
+        if not center_fraction:
+            return image
+        width, height = image.size
+        crop_size = min(width, height) * float(center_fraction)
+        left = (width - crop_size) / 2
+        top = (height - crop_size) / 2
+        return image.crop((left, top, left + crop_size, top + crop_size))
+    
+    def _preprocess(self, images, reuse=True):
+        """
+        Processor output (pixel tensors) for a list of PIL images, on the model device
+        reuse=False when the inputs outlive the next _preprocess call on this thread
+        (the fast path otherwise writes into a per-thread buffer)
+        """
+        if self.fast_preprocessor is not None:
+            return {"pixel_values": self.fast_preprocessor(images, reuse).to(self.device)}
+        
+        # Stack all pixel tensors into one batch
+        inputs = self.processor(images=images, return_tensors="pt")
+        return {k: v.to(self.device) for k, v in inputs.items()}
+    
+    def _embed_images(self, images):
+        """
+        Run a single forward pass over a list of PIL images
+        Returns an (N, D) array of L2-normalized embeddings
+        """
+        return self._forward(self._preprocess(images))
+    
+    def _forward(self, inputs):
+        """Forward pass over preprocessed inputs; returns (N, D) L2-normalized embeddings"""
+        with torch.no_grad():
+            image_features = self.backend.get_image_features(**inputs)
+            # Normalize features
+            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+        
+        return image_features.cpu().numpy()
+    
+    def _embedding_result(self, embedding, output_format=None):
+        """
+        Build the success response for a single embedding row
+        output_format: "json" (float list, default), "float32" or "float16" (base64 bytes)
+        """
+        output_format = output_format or "json"
+        if output_format not in OUTPUT_FORMATS:
+            return {"status": "error", "message": f"Unknown output format: {output_format}"}
+        
+        if output_format != "json":
+            return {"status": "success", **encode_embedding(embedding, output_format)}
+        
+        # Convert to list for JSON serialization
+        embedding = embedding.flatten().tolist()
+        
+        return {
+            "status": "success",
+            "embedding": embedding,
+            "dimensions": len(embedding)
+        }
+    
+    def process_image_from_path(self, image_path, output_format=None, center_fraction=None):
+        """Process image from file path"""
+        return self._process_image_request({
+            "action": "process_image",
+            "image_path": image_path,
+            "format": output_format,
+            "center_fraction": center_fraction
+        }, "image")
+    
+    def process_image_from_base64(self, base64_data, output_format=None, center_fraction=None):
         """Process image from base64 string"""
+        return self._process_image_request({
+            "action": "process_base64",
+            "base64_data": base64_data,
+            "format": output_format,
+            "center_fraction": center_fraction
+        }, "base64 image")
+    
+    def _process_image_request(self, request, label):
+        """Embedding response for a single image request"""
         try:
-            # Decode base64 image
-            image_data = base64.b64decode(base64_data)
-            image = Image.open(io.BytesIO(image_data)).convert('RGB')
+            embedding, cached, error = self._request_embedding(request)
+            if error:
+                return {"status": "error", "message": error}
+            result = self._embedding_result(embedding, request.get("format"))
+            if cached:
+                result["cached"] = True
+            return result
+        
+        except Exception as e:
+            return {
+                "status": "error",
+                "message": f"Failed to process {label}: {str(e)}",
+                "traceback": traceback.format_exc()
+            }
+    
+    def process_batch(self, requests):
+        """
+        Process several image requests with one forward pass
+        Returns one result per request, in the same order
+        """
+        results = [None] * len(requests)
+        images = []
+        positions = []
+        keys = []
+        
+        # Decode every image first; decode failures only affect their own request
+        for i, request in enumerate(requests):
+            try:
+                data, error = self._request_image_data(request)
+                if error:
+                    results[i] = {"status": "error", "message": error}
+                    continue
+                
+                key = self._cache_key(request, data)
+                cached = self.cache.get(key) if key else None
+                if cached is not None:
+                    results[i] = self._image_result(request, cached)
+                    results[i]["cached"] = True
+                    continue
+                
+                images.append(self._decode_image(data, request))
+                positions.append(i)
+                keys.append(key)
+            except Exception as e:
+                label = "image" if request.get("image_path") else "base64 image"
+                results[i] = {
+                    "status": "error",
+                    "message": f"Failed to process {label}: {str(e)}",
+                    "traceback": traceback.format_exc()
+                }
+        
+        if images:
+            try:
+                embeddings = self._embed_images(images)
+                for row, i in enumerate(positions):
+                    if keys[row]:
+                        self.cache.put(keys[row], embeddings[row])
+                    results[i] = self._image_result(requests[i], embeddings[row])
+                    results[i]["batch_size"] = len(images)
+            except Exception as e:
+                for i in positions:
+                    results[i] = {
+                        "status": "error",
+                        "message": f"Failed to process batch: {str(e)}",
+                        "traceback": traceback.format_exc()
+                    }
+        
+        return results
+    
+    def _request_image_data(self, request):
+        """Encoded image bytes a request refers to; returns (bytes, error_message)"""
+        action = request.get("action")
+        
+        if request.get("image_bytes") is not None:
+            # Raw encoded image from a binary socket frame
+            return request["image_bytes"], None
+        
+        if action != "process_base64" and request.get("image_path"):
+            with open(request["image_path"], "rb") as f:
+                return f.read(), None
+        if action == "process_image":
+            return None, "No image_path provided"
+        
+        base64_data = request.get("base64_data")
+        if not base64_data:
+            if action == "search":
+                return None, "No embedding, image_path or base64_data provided"
+            if action == "process_base64":
+                return None, "No base64_data provided"
+            return None, "No image_path or base64_data provided"
+        if base64_data.startswith('data:image'):
+            base64_data = base64_data.split(',', 1)[1]
+        return base64.b64decode(base64_data), None
+    
+    def _decode_image(self, data, request):
+        """RGB PIL image from encoded bytes, center-cropped when the request asks for it"""
+        if self.fast_preprocessor is not None:
+            # Reduced-scale JPEG decode, still large enough for the crop
+            image = self.fast_preprocessor.decode(data, request.get("center_fraction"))
+        else:
+            image = Image.open(io.BytesIO(data)).convert('RGB')
+        return self._center_crop(image, request.get("center_fraction"))
+    
+    def _load_request_image(self, request):
+        """Load the image a request refers to; returns (image, error_message)"""
+        data, error = self._request_image_data(request)
+        if error:
+            return None, error
+        return self._decode_image(data, request), None
+    
+    def _cache_key(self, request, data, variant=None):
+        """Embedding cache key for a request's image bytes (None when caching is off)"""
+        if self.cache is None:
+            return None
+        if variant is None:
+            center_fraction = request.get("center_fraction")
+            variant = f"center={float(center_fraction):g}" if center_fraction else ""
+        return self.cache.key(data, variant)
+    
+    def _request_embedding(self, request):
+        """
+        Embedding of one request's image, from the cache when the same bytes were seen before
+        Returns (embedding, cached, error_message)
+        """
+        data, error = self._request_image_data(request)
+        if error:
+            return None, False, error
+        
+        key = self._cache_key(request, data)
+        embedding = self.cache.get(key) if key else None
+        if embedding is not None:
+            return embedding, True, None
+        
+        embedding = self._embed_images([self._decode_image(data, request)])[0]
+        if key:
+            self.cache.put(key, embedding)
+        return embedding, False, None
+    
+    def _image_result(self, request, embedding):
+        """Response for an image request once its embedding is known (search or plain embedding)"""
+        if request.get("action") == "search":
+            return self._search_result(request, embedding)
+        return self._embedding_result(embedding, request.get("format"))
+    
+    def cache_stats(self, request):
+        """Hit/miss counts and size of the embedding cache"""
+        if self.cache is None:
+            return {"status": "success", "enabled": False}
+        return {"status": "success", "enabled": True, **self.cache.stats()}
+    
+    def precompute_batch(self, request):
+        """
+        Embed catalog images for the precompute scripts
+        items: [{product_id, image_path | base64_data}], embedded PRECOMPUTE_CHUNK_SIZE
+        images per forward pass. Returns one result per item, in order; an
+        unreadable image only fails its own item
+        """
+        items = request.get("items") or []
+        output_format = request.get("format")
+        results = []
+        
+        for start in range(0, len(items), PRECOMPUTE_CHUNK_SIZE):
+            chunk = items[start:start + PRECOMPUTE_CHUNK_SIZE]
+            chunk_results = [None] * len(chunk)
+            images = []
+            positions = []
+            keys = []
             
-            # Get image features
-            inputs = self.processor(images=image, return_tensors="pt")
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            for i, item in enumerate(chunk):
+                try:
+                    data, error = self._request_image_data(item)
+                    if error:
+                        raise ValueError(error)
+                    
+                    key = self._cache_key(item, data)
+                    cached = self.cache.get(key) if key else None
+                    if cached is not None:
+                        chunk_results[i] = {**self._embedding_result(cached, output_format), "cached": True}
+                        continue
+                    
+                    images.append(self._decode_image(data, item))
+                    positions.append(i)
+                    keys.append(key)
+                except Exception as e:
+                    chunk_results[i] = {"status": "error", "message": f"Failed to load image: {str(e)}"}
             
-            with torch.no_grad():
-                image_features = self.model.get_image_features(**inputs)
-                # Normalize features
-                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+            if images:
+                try:
+                    # Decoding and preprocessing stay outside the model lock
+                    inputs = self._preprocess(images)
+                    with self._model_lock:
+                        embeddings = self._forward(inputs)
+                    for row, i in enumerate(positions):
+                        if keys[row]:
+                            self.cache.put(keys[row], embeddings[row])
+                        chunk_results[i] = self._embedding_result(embeddings[row], output_format)
+                except Exception as e:
+                    for i in positions:
+                        chunk_results[i] = {"status": "error", "message": f"Failed to process batch: {str(e)}"}
             
-            # Convert to numpy and then to list for JSON serialization
-            embedding = image_features.cpu().numpy().flatten().tolist()
+            for item, result in zip(chunk, chunk_results):
+                results.append({"product_id": item.get("product_id"), **result})
+        
+        succeeded = sum(1 for result in results if result["status"] == "success")
+        return {
+            "status": "success",
+            "results": results,
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded
+        }
+    
+    def _text_tower(self):
+        """Text tower + projection and tokenizer, imported and loaded on first use"""
+        if self.text_model is None:
+            from transformers import CLIPTextModelWithProjection, CLIPTokenizerFast
             
+            self.tokenizer = CLIPTokenizerFast.from_pretrained(self.model_name)
+            self.text_model = CLIPTextModelWithProjection.from_pretrained(self.model_name).to(self.device).eval()
+        return self.text_model, self.tokenizer
+    
+    def process_text(self, request):
+        """Embedding of a text query in the same space as the image embeddings"""
+        text = request.get("text")
+        if not text:
+            return {"status": "error", "message": "No text provided"}
+        
+        try:
+            text_model, tokenizer = self._text_tower()
+            inputs = tokenizer([text], padding=True, truncation=True, return_tensors="pt")
+            with torch.no_grad():
+                features = text_model(**{k: v.to(self.device) for k, v in inputs.items()}).text_embeds
+                features = features / features.norm(dim=-1, keepdim=True)
+            return self._embedding_result(features.cpu().numpy()[0], request.get("format"))
+        except Exception as e:
             return {
-                "status": "success",
-                "embedding": embedding,
-                "dimensions": len(embedding)
+                "status": "error",
+                "message": f"Failed to process text: {str(e)}",
+                "traceback": traceback.format_exc()
             }
+    
+    def _cropping_pipeline(self):
+        """Multi-crop pipeline reusing this service's model (loads only the croppers)"""
+        with self._enhancer_lock:
+            if self.enhancer is None:
+                if UTILS_DIR not in sys.path:
+                    sys.path.append(UTILS_DIR)
+                from enhancedClipWithCropping import EnhancedCLIPWithCropping
+                
+                with redirect_stdout(sys.stderr):
+                    self.enhancer = EnhancedCLIPWithCropping(
+                        model_name=self.model_name,
+                        model=self.backend,
+                        processor=self.processor,
+                        device=self.device
+                    )
+        return self.enhancer
+    
+    def _request_image_file(self, request):
+        """
+        Path of the request image; base64 payloads are written to a temp file
+        because the croppers read from disk. Returns (path, temp_path_to_remove)
+        """
+        if request.get("image_path"):
+            return request["image_path"], None
+        
+        image_bytes = request.get("image_bytes")
+        if image_bytes is None:
+            base64_data = request.get("base64_data")
+            if not base64_data:
+                raise ValueError("No image_path or base64_data provided")
+            if base64_data.startswith('data:image'):
+                base64_data = base64_data.split(',', 1)[1]
+            image_bytes = base64.b64decode(base64_data)
+        
+        fd, temp_path = tempfile.mkstemp(suffix='.jpg')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(image_bytes)
+        return temp_path, temp_path
+    
+    def _prepare_crops(self, request):
+        """
+        Cropping stage of enhanced_search/analyze (no model involved, so it can
+        run off the inference thread). Returns (response, None) when the request
+        is already answered (cache hit, bad input) or (None, prepared): the crops
+        as enhancer.prepare_crops returns them plus their processor "inputs"
+        """
+        action = request.get("action")
+        strategies = request.get("strategies")
+        budget = request.get("budget", self.crop_budget)
+        key = None
+        if action == "enhanced_search" and self.cache is not None:
+            data, error = self._request_image_data(request)
+            if error:
+                return {"status": "error", "message": error}, None
+            key = self._cache_key(request, data, "enhanced:" + ",".join(strategies or ["default"]))
+            cached = self.cache.get(key)
+            if cached is not None:
+                return {"status": "success", "embedding": cached.tolist(), "dimensions": len(cached), "cached": True}, None
+        
+        enhancer = self._cropping_pipeline()
+        image_path, temp_path = self._request_image_file(request)
+        try:
+            # The pipeline reports progress with print(); stdout carries responses
+            with redirect_stdout(sys.stderr):
+                if strategies:
+                    prepared = enhancer.prepare_crops(image_path, strategies, budget=budget)
+                else:
+                    prepared = enhancer.prepare_crops(image_path, budget=budget)
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+        
+        with redirect_stdout(sys.stderr):
+            prepared["inputs"] = enhancer.prepared_inputs(prepared)
+        prepared["cache_key"] = key
+        return None, prepared
+    
+    def _crops_result(self, request, prepared, embeddings):
+        """Response of enhanced_search/analyze once the crops' embeddings are known"""
+        enhancer = self._cropping_pipeline()
+        with redirect_stdout(sys.stderr):
+            crops = enhancer.embed_prepared(prepared, embeddings)
+            if request.get("action") != "enhanced_search":
+                analysis = enhancer.analyze_crops(crops)
+                if not analysis:
+                    return {"status": "error", "message": "Failed to analyze cropping"}
+                return {"status": "success", "analysis": analysis}
+            embedding = enhancer.pooled_embedding(crops)
+        
+        if not embedding:
+            return {"status": "error", "message": "Failed to generate enhanced embedding"}
+        if crops['skipped']:
+            # Degraded by the time budget: answer, but do not cache it for calmer times
+            return {"status": "success", "embedding": embedding, "dimensions": len(embedding),
+                    "skipped": crops['skipped']}
+        if prepared["cache_key"]:
+            self.cache.put(prepared["cache_key"], embedding)
+        return {"status": "success", "embedding": embedding, "dimensions": len(embedding)}
+    
+    @staticmethod
+    def _crops_error(request, error):
+        return {
+            "status": "error",
+            "message": f"Failed to process {request.get('action')} request: {str(error)}",
+            "traceback": traceback.format_exc()
+        }
+    
+    def process_crops(self, request):
+        """
+        Multi-crop actions: enhanced_search (weighted average embedding of the
+        image and its smart crops) and analyze (crop strategies ranked against
+        the original)
+        A "budget" in seconds (default --crop-budget) limits the cropping stage:
+        strategies that do not fit are skipped and listed under "skipped".
+        Only the crops' forward pass holds the model lock
+        """
+        try:
+            result, prepared = self._prepare_crops(request)
+            if result is not None:
+                return result
             
+            embeddings = None
+            if prepared["inputs"] is not None:
+                with self._model_lock:
+                    embeddings = self.enhancer.embed_inputs(prepared["inputs"])
+            return self._crops_result(request, prepared, embeddings)
+        except Exception as e:
+            return self._crops_error(request, e)
+    
+    def load_index(self, entries):
+        """Replace the catalog index with the given product embeddings"""
+        try:
+            summary = self.index.load(entries or [])
+            return {"status": "success", **summary}
         except Exception as e:
             return {
                 "status": "error",
-                "message": f"Failed to process base64 image: {str(e)}",
+                "message": f"Failed to load index: {str(e)}",
                 "traceback": traceback.format_exc()
             }
     
+    def upsert_embedding(self, request):
+        """Insert or replace one (or many) product embeddings without a reload"""
+        entries = request.get("entries")
+        if entries is None:
+            entries = [{
+                "product_id": request.get("product_id"),
+                "embedding": request.get("embedding"),
+                "embedding_b64": request.get("embedding_b64"),
+                "dtype": request.get("dtype", "float32"),
+                **{field: request[field] for field in TENANT_FIELDS if field in request}
+            }]
+        
+        inserted = updated = 0
+        errors = []
+        for entry in entries:
+            try:
+                if entry.get("product_id") is None or (entry.get("embedding") is None and entry.get("embedding_b64") is None):
+                    raise ValueError("product_id and embedding (or embedding_b64) are required")
+                if self.index.upsert(entry["product_id"], entry_vector(entry), EmbeddingIndex.entry_tenants(entry)):
+                    inserted += 1
+                else:
+                    updated += 1
+            except Exception as e:
+                errors.append({"product_id": entry.get("product_id"), "message": str(e)})
+        
+        if errors and not (inserted or updated):
+            return {"status": "error", "message": errors[0]["message"], "errors": errors}
+        
+        return {
+            "status": "success",
+            "inserted": inserted,
+            "updated": updated,
+            "errors": errors,
+            "index_size": len(self.index)
+        }
+    
+    def update_tags(self, request):
+        """
+        Replace the tenant tags of indexed products without resending their
+        embeddings (after their owner or stocking shops changed)
+        entries: [{product_id, user_id, shop_name}]
+        """
+        updated = missing = 0
+        errors = []
+        for entry in request.get("entries") or []:
+            try:
+                tenants = EmbeddingIndex.entry_tenants(entry)
+                if entry.get("product_id") is None or tenants is None:
+                    raise ValueError(f"product_id and {' or '.join(TENANT_FIELDS)} are required")
+                if self.index.retag(entry["product_id"], tenants):
+                    updated += 1
+                else:
+                    missing += 1
+            except Exception as e:
+                errors.append({"product_id": entry.get("product_id"), "message": str(e)})
+        
+        return {"status": "success", "updated": updated, "missing": missing, "errors": errors}
+    
+    def remove_embedding(self, request):
+        """Remove one (or many) products from the index"""
+        product_ids = request.get("product_ids")
+        if product_ids is None:
+            product_ids = [request.get("product_id")]
+        
+        try:
+            removed = sum(1 for pid in product_ids if pid is not None and self.index.remove(pid))
+        except Exception as e:
+            return {"status": "error", "message": f"Failed to remove embedding: {str(e)}"}
+        
+        return {"status": "success", "removed": removed, "index_size": len(self.index)}
+    
+    def _search_result(self, request, embedding):
+        """Run a top-K search for an already computed query embedding"""
+        try:
+            matches = self.index.search(
+                embedding,
+                top_k=int(request.get("top_k", 5)),
+                min_score=request.get("min_score"),
+                nprobe=request.get("nprobe"),
+                exact=bool(request.get("exact", False)),
+                filters=request.get("filters")
+            )
+            return {
+                "status": "success",
+                "results": [{"product_id": pid, "similarity": score} for pid, score in matches],
+                "index_size": len(self.index)
+            }
+        except Exception as e:
+            return {
+                "status": "error",
+                "message": f"Failed to search index: {str(e)}",
+                "traceback": traceback.format_exc()
+            }
+    
+    def search(self, request):
+        """Search the catalog with an embedding, image path or base64 image"""
+        if request.get("embedding") is not None or request.get("embedding_b64") is not None:
+            try:
+                embedding = entry_vector(request)
+            except Exception as e:
+                return {"status": "error", "message": f"Invalid query embedding: {str(e)}"}
+            return self._search_result(request, embedding)
+        
+        try:
+            embedding, _, error = self._request_embedding(request)
+            if error:
+                return {"status": "error", "message": error}
+        except Exception as e:
+            return {
+                "status": "error",
+                "message": f"Failed to process search image: {str(e)}",
+                "traceback": traceback.format_exc()
+            }
+        return self._search_result(request, embedding)
+    
+    def handle_request(self, request):
+        """Dispatch a single request; returns None when the service should stop"""
+        action = request.get("action")
+        
+        if action == "process_image":
+            image_path = request.get("image_path")
+            if image_path:
+                return self.process_image_from_path(image_path, request.get("format"), request.get("center_fraction"))
+            return {"status": "error", "message": "No image_path provided"}
+        
+        elif action == "process_base64":
+            base64_data = request.get("base64_data")
+            if base64_data:
+                return self.process_image_from_base64(base64_data, request.get("format"), request.get("center_fraction"))
+            return {"status": "error", "message": "No base64_data provided"}
+        
+        elif action == "process_text":
+            return self.process_text(request)
+        
+        elif action == "search":
+            return self.search(request)
+        
+        elif action in ("enhanced_search", "analyze"):
+            return self.process_crops(request)
+        
+        elif action == "precompute_batch":
+            return self.precompute_batch(request)
+        
+        elif action == "cache_stats":
+            return self.cache_stats(request)
+        
+        elif action == "load_index":
+            return self.load_index(request.get("entries"))
+        
+        elif action == "upsert_embedding":
+            return self.upsert_embedding(request)
+        
+        elif action == "remove_embedding":
+            return self.remove_embedding(request)
+        
+        elif action == "update_tags":
+            return self.update_tags(request)
+        
+        elif action == "index_stats":
+            return self.index_stats(request)
+        
+        elif action == "save_snapshot":
+            return self.save_snapshot(request)
+        
+        elif action == "load_snapshot":
+            return self.load_snapshot(request)
+        
+        elif action == "build_ann":
+            return self.build_ann(request)
+        
+        elif action == "ping":
+            return {"status": "pong", "message": "Service is alive", "backend": self.backend.name,
+                    "agreement": self.backend_agreement,
+                    "preprocessing": "fast" if self.fast_preprocessor else "processor",
+                    "draft_decode": bool(self.fast_preprocessor and self.fast_preprocessor.draft)}
+        
+        elif action == "shutdown":
+            return None
+        
+        return {"status": "error", "message": f"Unknown action: {action}"}
+    
+    def _send(self, result, request_id=None):
+        """Write a response line, tagged with its request_id"""
+        # Add request_id to response if it was provided
+        if request_id:
+            result["request_id"] = request_id
+        
+        line = json.dumps(result)
+        with self._send_lock:
+            print(line, file=self._response_stream or sys.stdout, flush=True)
+    
     def run_service(self):
         """Main service loop - processes requests from stdin"""
+        if self.decode_workers > 0:
+            return self.run_concurrent_service()
+        if self.max_batch_size > 1:
+            return self.run_batched_service()
+        
         print(json.dumps({"status": "service_ready", "message": "CLIP service ready for requests"}), flush=True)
         
         try:
             for line in sys.stdin:
                 try:
                     request = json.loads(line.strip())
-                    request_id = request.get("request_id")
-                    
-                    if request.get("action") == "process_image":
-                        image_path = request.get("image_path")
-                        if image_path:
-                            result = self.process_image_from_path(image_path)
-                        else:
-                            result = {"status": "error", "message": "No image_path provided"}
-                    
-                    elif request.get("action") == "process_base64":
-                        base64_data = request.get("base64_data")
-                        if base64_data:
-                            result = self.process_image_from_base64(base64_data)
-                        else:
-                            result = {"status": "error", "message": "No base64_data provided"}
+                    with self._model_lock:
+                        result = self.handle_request(request)
                     
-                    elif request.get("action") == "ping":
-                        result = {"status": "pong", "message": "Service is alive"}
-                    
-                    elif request.get("action") == "shutdown":
+                    if result is None:
                         print(json.dumps({"status": "shutdown", "message": "Service shutting down"}), flush=True)
                         break
                     
-                    else:
-                        result = {"status": "error", "message": f"Unknown action: {request.get('action')}"}
-                    
-                    # Add request_id to response if it was provided
-                    if request_id:
-                        result["request_id"] = request_id
-                    
-                    print(json.dumps(result), flush=True)
-                    
+                    self._send(result, request.get("request_id"))
+                
                 except json.JSONDecodeError:
                     print(json.dumps({"status": "error", "message": "Invalid JSON request"}), flush=True)
                 except Exception as e:
                     print(json.dumps({"status": "error", "message": f"Request processing error: {str(e)}"}), flush=True)
+        
+        except KeyboardInterrupt:
+            print(json.dumps({"status": "shutdown", "message": "Service interrupted"}), flush=True)
+        except Exception as e:
+            print(json.dumps({"status": "error", "message": f"Service error: {str(e)}"}), flush=True)
+    
+    def _read_stdin(self, pending):
+        """Reader thread - parses stdin lines into the pending queue"""
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            try:
+                pending.put(json.loads(line.strip()))
+            except json.JSONDecodeError:
+                pending.put({"action": "_invalid"})
+        
+        # EOF behaves like a shutdown request
+        pending.put({"action": "shutdown"})
+    
+    def run_batched_service(self):
+        """
+        Batched service loop - collects pending image requests for up to
+        batch_window seconds (or max_batch_size requests) and embeds them
+        with a single forward pass
+        """
+        print(json.dumps({
+            "status": "service_ready",
+            "message": f"CLIP service ready for requests (batching up to {self.max_batch_size} "
+                       f"within {int(self.batch_window * 1000)}ms)"
+        }), flush=True)
+        
+        pending = queue.Queue()
+        reader = threading.Thread(target=self._read_stdin, args=(pending,), daemon=True)
+        reader.start()
+        
+        try:
+            running = True
+            while running:
+                request = pending.get()
+                batch = []
+                deferred = []
+                
+                if is_image_request(request):
+                    batch.append(request)
+                    deadline = time.monotonic() + self.batch_window
+                    
+                    # Keep collecting until the window closes or the batch is full
+                    while len(batch) < self.max_batch_size:
+                        remaining = deadline - time.monotonic()
+                        try:
+                            if remaining > 0:
+                                extra = pending.get(timeout=remaining)
+                            else:
+                                extra = pending.get_nowait()
+                        except queue.Empty:
+                            break
+                        
+                        if is_image_request(extra):
+                            batch.append(extra)
+                        else:
+                            # Control requests are answered right after the batch
+                            deferred.append(extra)
+                            if extra.get("action") == "shutdown":
+                                break
+                else:
+                    deferred.append(request)
+                
+                if batch:
+                    try:
+                        with self._model_lock:
+                            results = self.process_batch(batch)
+                    except Exception as e:
+                        results = [{"status": "error", "message": f"Request processing error: {str(e)}"}] * len(batch)
+                    for req, result in zip(batch, results):
+                        self._send(dict(result), req.get("request_id"))
+                
+                for req in deferred:
+                    if req.get("action") == "_invalid":
+                        print(json.dumps({"status": "error", "message": "Invalid JSON request"}), flush=True)
+                        continue
+                    try:
+                        with self._model_lock:
+                            result = self.handle_request(req)
+                    except Exception as e:
+                        result = {"status": "error", "message": f"Request processing error: {str(e)}"}
                     
+                    if result is None:
+                        print(json.dumps({"status": "shutdown", "message": "Service shutting down"}), flush=True)
+                        running = False
+                        break
+                    
+                    self._send(result, req.get("request_id"))
+        
         except KeyboardInterrupt:
             print(json.dumps({"status": "shutdown", "message": "Service interrupted"}), flush=True)
         except Exception as e:
             print(json.dumps({"status": "error", "message": f"Service error: {str(e)}"}), flush=True)
+    
+    def _decode_request(self, request, ready):
+        """Decode-pool task - load and preprocess one image, then hand it to the inference thread"""
+        try:
+            data, error = self._request_image_data(request)
+            if error:
+                self._send({"status": "error", "message": error}, request.get("request_id"))
+                return
+            
+            key = self._cache_key(request, data)
+            cached = self.cache.get(key) if key else None
+            if cached is not None:
+                with self._model_lock:
+                    result = self._image_result(request, cached)
+                result["cached"] = True
+                self._send(result, request.get("request_id"))
+                return
+            
+            request["_cache_key"] = key
+            # Queued until the inference thread gets to it, so not in the reused buffer
+            ready.put((request, self._preprocess([self._decode_image(data, request)], reuse=False)))
+        except Exception as e:
+            label = "image" if request.get("image_path") else "base64 image"
+            self._send({
+                "status": "error",
+                "message": f"Failed to process {label}: {str(e)}",
+                "traceback": traceback.format_exc()
+            }, request.get("request_id"))
+    
+    def _crop_request(self, request, ready):
+        """
+        Decode-pool task for enhanced_search/analyze - the croppers (seconds of
+        OpenCV work, GrabCut) run here; only the crops' batched forward pass is
+        queued for the inference thread
+        """
+        try:
+            result, prepared = self._prepare_crops(request)
+            if result is None and prepared["inputs"] is None:
+                result = self._crops_result(request, prepared, None)
+        except Exception as e:
+            result = self._crops_error(request, e)
+        
+        if result is not None:
+            self._send(result, request.get("request_id"))
+            return
+        request["_crops"] = prepared
+        ready.put((request, prepared["inputs"]))
+    
+    def _run_crop_pass(self, request, inputs):
+        """One forward pass over the crops of an enhanced_search/analyze request"""
+        try:
+            with self._model_lock:
+                embeddings = self.enhancer.embed_inputs(inputs)
+            result = self._crops_result(request, request.pop("_crops"), embeddings)
+        except Exception as e:
+            result = self._crops_error(request, e)
+        self._send(result, request.get("request_id"))
+    
+    def _run_preprocessed_batch(self, batch):
+        """One forward pass over already preprocessed (request, inputs) pairs"""
+        try:
+            inputs = {
+                key: torch.cat([item_inputs[key] for _, item_inputs in batch])
+                for key in batch[0][1]
+            }
+            with self._model_lock:
+                embeddings = self._forward(inputs)
+        except Exception as e:
+            for request, _ in batch:
+                self._send({
+                    "status": "error",
+                    "message": f"Failed to process batch: {str(e)}",
+                    "traceback": traceback.format_exc()
+                }, request.get("request_id"))
+            return
+        
+        for row, (request, _) in enumerate(batch):
+            if request.get("_cache_key"):
+                self.cache.put(request["_cache_key"], embeddings[row])
+            with self._model_lock:
+                result = self._image_result(request, embeddings[row])
+            result["batch_size"] = len(batch)
+            self._send(result, request.get("request_id"))
+    
+    def _inference_loop(self, ready):
+        """
+        Inference thread - runs forward passes and every other request
+        Preprocessed images that are already waiting share one forward pass
+        (up to max_batch_size); the crops of an enhanced request get a pass of
+        their own. Index reads and writes all happen on this thread
+        """
+        backlog = deque()
+        while True:
+            item = backlog.popleft() if backlog else ready.get()
+            if item is None:
+                return
+            
+            request, inputs = item
+            if inputs is None:
+                try:
+                    with self._model_lock:
+                        result = self.handle_request(request)
+                except Exception as e:
+                    result = {"status": "error", "message": f"Request processing error: {str(e)}"}
+                if result is not None:
+                    self._send(result, request.get("request_id"))
+                continue
+            if "_crops" in request:
+                self._run_crop_pass(request, inputs)
+                continue
+            
+            batch = [item]
+            while len(batch) < self.max_batch_size:
+                try:
+                    extra = ready.get_nowait()
+                except queue.Empty:
+                    break
+                if extra is None or extra[1] is None or "_crops" in extra[0]:
+                    # Keep arrival order for control requests, crop passes and the stop marker
+                    backlog.append(extra)
+                    break
+                batch.append(extra)
+            
+            self._run_preprocessed_batch(batch)
+    
+    def run_concurrent_service(self):
+        """
+        Concurrent service loop - image requests are decoded and preprocessed,
+        and enhanced requests cropped, on a pool of decode_workers threads while
+        a dedicated inference thread runs the forward passes. Responses are
+        written as they complete (tagged with request_id), so a large or slow
+        image no longer delays the requests behind it
+        """
+        print(json.dumps({
+            "status": "service_ready",
+            "message": f"CLIP service ready for requests ({self.decode_workers} decode workers, "
+                       f"up to {self.max_batch_size} images per forward pass)"
+        }), flush=True)
+        
+        # The croppers print progress from the decode threads, where swapping
+        # sys.stdout per request would race: pin the responses to stdout and
+        # send every stray print to stderr for the life of the loop
+        self._response_stream, sys.stdout = sys.stdout, sys.stderr
+        
+        ready = queue.Queue()
+        inference = threading.Thread(target=self._inference_loop, args=(ready,), daemon=True)
+        inference.start()
+        decoders = ThreadPoolExecutor(max_workers=self.decode_workers, thread_name_prefix="clip-decode")
+        
+        try:
+            for line in sys.stdin:
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line.strip())
+                except json.JSONDecodeError:
+                    self._send({"status": "error", "message": "Invalid JSON request"})
+                    continue
+                
+                action = request.get("action")
+                if action == "shutdown":
+                    break
+                if action == "ping":
+                    # Answered right away, even while the inference thread is busy
+                    self._send(self.handle_request(request), request.get("request_id"))
+                elif is_image_request(request):
+                    decoders.submit(self._decode_request, request, ready)
+                elif action in CROP_ACTIONS:
+                    decoders.submit(self._crop_request, request, ready)
+                else:
+                    ready.put((request, None))
+        
+        except KeyboardInterrupt:
+            self._send({"status": "shutdown", "message": "Service interrupted"})
+            sys.stdout, self._response_stream = self._response_stream, None
+            return
+        except Exception as e:
+            self._send({"status": "error", "message": f"Service error: {str(e)}"})
+        
+        # Finish the requests already accepted before reporting the shutdown
+        decoders.shutdown(wait=True)
+        ready.put(None)
+        inference.join()
+        self._send({"status": "shutdown", "message": "Service shutting down"})
+        sys.stdout, self._response_stream = self._response_stream, None
+    
+    def handle_binary_request(self, header, payload):
+        """
+        Answer one binary socket frame; returns (response header, payload bytes)
+        A request payload is the encoded image file and replaces image_path/base64_data.
+        Embeddings come back as raw float32 payload instead of a JSON float list
+        """
+        request = dict(header)
+        if payload:
+            request["image_bytes"] = payload
+        action = request.get("action")
+        
+        if action == "shutdown":
+            return {"status": "error", "message": "shutdown is only accepted on stdin"}, b""
+        
+        try:
+            if is_image_request(request):
+                data, error = self._request_image_data(request)
+                if error:
+                    return {"status": "error", "message": error}, b""
+                
+                key = self._cache_key(request, data)
+                embedding = self.cache.get(key) if key else None
+                cached = embedding is not None
+                if not cached:
+                    # Decode and preprocess outside the lock so connections overlap with inference
+                    inputs = self._preprocess([self._decode_image(data, request)])
+                    with self._model_lock:
+                        embedding = self._forward(inputs)[0]
+                    if key:
+                        self.cache.put(key, embedding)
+                
+                if action == "search":
+                    with self._model_lock:
+                        result = self._search_result(request, embedding)
+                    return result, b""
+                result = {"status": "success", "dtype": "float32", "dimensions": len(embedding)}
+                if cached:
+                    result["cached"] = True
+                return result, embedding_payload(embedding)
+            
+            if action in UNLOCKED_ACTIONS:
+                # Cropping and decoding overlap with other connections; these
+                # take the model lock around their forward passes only
+                result = self.handle_request(request)
+            else:
+                with self._model_lock:
+                    result = self.handle_request(request)
+        except Exception as e:
+            return {
+                "status": "error",
+                "message": f"Failed to process {action} request: {str(e)}",
+                "traceback": traceback.format_exc()
+            }, b""
+        
+        if isinstance(result.get("embedding"), list):
+            embedding = result.pop("embedding")
+            result["dtype"] = "float32"
+            return result, embedding_payload(embedding)
+        return result, b""
+    
+    def serve_socket(self, socket_path):
+        """Answer binary frames on a Unix socket (one thread per connection) next to the stdin loop"""
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        
+        server = socketserver.ThreadingUnixStreamServer(socket_path, BinaryFrameHandler)
+        server.daemon_threads = True
+        server.service = self
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        
+        print(json.dumps({"status": "ready", "message": f"Binary socket listening on {socket_path}"}), flush=True)
+        return server
+
+class BinaryFrameHandler(socketserver.StreamRequestHandler):
+    """One socket connection: frames are answered in order until the client disconnects"""
+    
+    def handle(self):
+        service = self.server.service
+        while True:
+            try:
+                frame = read_frame(self.rfile)
+            except FrameError as e:
+                write_frame(self.wfile, {"status": "error", "message": str(e)})
+                return
+            if frame is None:
+                return
+            
+            header, payload = frame
+            result, body = service.handle_binary_request(header, payload)
+            if header.get("request_id"):
+                result["request_id"] = header["request_id"]
+            write_frame(self.wfile, result, body)
+
+def parse_args(argv=None):
+    """Parse command line options for the service"""
+    parser = argparse.ArgumentParser(description="Persistent CLIP embedding service")
+    parser.add_argument("--batch-window-ms", type=int, default=0,
+                        help="How long to wait for more image requests before running a batch")
+    parser.add_argument("--max-batch-size", type=int, default=1,
+                        help="Maximum images per forward pass (1 disables batching)")
+    parser.add_argument("--snapshot", default=None,
+                        help="Index snapshot directory to memory-map at startup and save to")
+    parser.add_argument("--quantization", choices=["int8"], default=None,
+                        help="Scan a compact copy of the index and re-rank a shortlist in float32")
+    parser.add_argument("--rerank-factor", type=int, default=4,
+                        help="Shortlist size for re-ranking, as a multiple of top_k")
+    parser.add_argument("--ann", choices=["ivf"], default=None,
+                        help="Approximate search once the catalog has enough products")
+    parser.add_argument("--nprobe", type=int, default=8,
+                        help="IVF clusters scanned per query (higher = better recall, slower)")
+    parser.add_argument("--ann-lists", type=int, default=None,
+                        help="IVF cluster count (default ~sqrt(catalog size))")
+    parser.add_argument("--decode-workers", type=int, default=0,
+                        help="Threads decoding/preprocessing images alongside a dedicated inference "
+                             "thread (0 = one request at a time); waiting images share a forward "
+                             "pass up to --max-batch-size")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Service processes forked after the model loads, each pinned to its own "
+                             "core subset; requests go to the least-loaded one")
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="torch intra-op threads per worker process (default: its core count)")
+    parser.add_argument("--cache-size", type=int, default=0,
+                        help="Embeddings kept in an in-memory LRU keyed by image content hash (0 = off)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Optional on-disk cache tier (one .npy per image hash, per model)")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch",
+                        help="Inference backend for the vision tower: eager PyTorch, a traced "
+                             "TorchScript module or an ONNX Runtime session (exports are cached)")
+    parser.add_argument("--int8", action="store_true",
+                        help="Dynamic int8 quantization of the backend's Linear/MatMul weights")
+    parser.add_argument("--backend-dir", default=None,
+                        help="Directory for exported TorchScript/ONNX models (default: clip_models/)")
+    parser.add_argument("--min-agreement", type=float, default=0.98,
+                        help="Minimum cosine similarity with eager PyTorch on the calibration images; "
+                             "below it the service falls back to eager PyTorch")
+    parser.add_argument("--preprocess", choices=["fast", "processor"], default="fast",
+                        help="fast: reduced-scale JPEG decode and NumPy resize/crop/normalize into a "
+                             "reused buffer (checked against CLIPImageProcessor at startup); "
+                             "processor: CLIPImageProcessor on every call")
+    parser.add_argument("--crop-budget", type=float, default=None,
+                        help="Seconds for the cropping stage of enhanced_search/analyze requests; "
+                             "expensive strategies that do not fit are skipped (requests may set "
+                             "their own \"budget\")")
+    parser.add_argument("--socket", default=None,
+                        help="Also answer length-prefixed binary frames (raw image in, raw float32 "
+                             "embedding out) on this Unix socket path")
+    return parser.parse_args(argv)
 
 def main():
     """Main entry point"""
-    service = PersistentCLIPService()
-    service.run_service()
+    args = parse_args()
+    if args.socket and args.workers > 1:
+        sys.exit("--socket cannot be combined with --workers")
+    
+    service = PersistentCLIPService(
+        batch_window_ms=args.batch_window_ms,
+        max_batch_size=args.max_batch_size,
+        snapshot_dir=args.snapshot,
+        quantization=args.quantization,
+        rerank_factor=args.rerank_factor,
+        ann=args.ann,
+        nprobe=args.nprobe,
+        ann_lists=args.ann_lists,
+        decode_workers=args.decode_workers,
+        cache_size=args.cache_size,
+        cache_dir=args.cache_dir,
+        backend=args.backend,
+        backend_int8=args.int8,
+        backend_dir=args.backend_dir,
+        min_agreement=args.min_agreement,
+        preprocess=args.preprocess,
+        crop_budget=args.crop_budget
+    )
+    
+    if args.workers > 1:
+        from clipWorkerPool import CLIPWorkerPool
+        CLIPWorkerPool(service, args.workers, args.threads_per_worker).run()
+        return
+    
+    server = service.serve_socket(args.socket) if args.socket else None
+    try:
+        service.run_service()
+    finally:
+        if server:
+            server.server_close()
+            if os.path.exists(args.socket):
+                os.remove(args.socket)
 
 if __name__ == "__main__":
     main()
@@ -1,13 +1,17 @@
 const { spawn } = require('child_process');
 const path = require('path');
 const EventEmitter = require('events');
+const CLIPSocketClient = require('./clipSocketClient');
 
 /**
  * Manages a persistent Python CLIP service for fast embedding generation
  * Eliminates the overhead of spawning new processes for each request
  */
 class CLIPServiceManager extends EventEmitter {
-  constructor() {
+  /**
+   * @param {Object} options - { autoStart: false } defers the spawn until the first request
+   */
+  constructor({ autoStart = true } = {}) {
     super();
     this.process = null;
     this.isReady = false;
@@ -15,9 +19,93 @@ class CLIPServiceManager extends EventEmitter {
     this.currentRequestId = 0;
     this.pendingRequests = new Map();
     this.serviceStarting = false;
+    // Binary Unix socket client for image payloads (null = JSON lines only)
+    this.socketClient = null;
     
     // Start the service immediately
-    this.startService();
+    if (autoStart) {
+      this.startService();
+    }
+  }
+  
+  /**
+   * Python interpreter and arguments for the service process
+   * Subclasses override this to run a different service script
+   * @returns {{pythonPath: string, args: Array<string>, socketPath: (string|undefined)}}
+   */
+  getServiceCommand() {
+    const servicePath = path.join(__dirname, 'clipService.py');
+    
+    // Spawn the Python service using the clip_env environment
+    const pythonPath = path.join(__dirname, '..', 'clip_env', 'bin', 'python3');
+    
+    // Optional batching: several concurrent scans share one forward pass
+    const serviceArgs = [servicePath];
+    if (process.env.CLIP_MAX_BATCH_SIZE) {
+      serviceArgs.push('--max-batch-size', process.env.CLIP_MAX_BATCH_SIZE);
+      serviceArgs.push('--batch-window-ms', process.env.CLIP_BATCH_WINDOW_MS || '20');
+    }
+    
+    // Optional decode/preprocess thread pool next to a dedicated inference thread
+    if (process.env.CLIP_DECODE_WORKERS) {
+      serviceArgs.push('--decode-workers', process.env.CLIP_DECODE_WORKERS);
+    }
+    
+    // Optional supervisor mode: several forked worker processes behind the same pipe
+    if (process.env.CLIP_WORKERS) {
+      serviceArgs.push('--workers', process.env.CLIP_WORKERS);
+      if (process.env.CLIP_THREADS_PER_WORKER) {
+        serviceArgs.push('--threads-per-worker', process.env.CLIP_THREADS_PER_WORKER);
+      }
+    }
+    
+    // Optional TorchScript/ONNX Runtime inference backend (checked against eager PyTorch at startup)
+    if (process.env.CLIP_BACKEND) {
+      serviceArgs.push('--backend', process.env.CLIP_BACKEND);
+    }
+    if (process.env.CLIP_BACKEND_INT8 === 'true') {
+      serviceArgs.push('--int8');
+    }
+    
+    // Image preprocessing: fast NumPy path (default) or CLIPImageProcessor on every call
+    if (process.env.CLIP_PREPROCESS) {
+      serviceArgs.push('--preprocess', process.env.CLIP_PREPROCESS);
+    }
+    
+    // Optional time budget (seconds) for the cropping stage of enhanced requests
+    if (process.env.CLIP_CROP_BUDGET) {
+      serviceArgs.push('--crop-budget', process.env.CLIP_CROP_BUDGET);
+    }
+    
+    // Optional embedding cache keyed by image content hash (memory LRU + disk tier)
+    if (process.env.CLIP_CACHE_SIZE) {
+      serviceArgs.push('--cache-size', process.env.CLIP_CACHE_SIZE);
+    }
+    if (process.env.CLIP_CACHE_DIR) {
+      serviceArgs.push('--cache-dir', process.env.CLIP_CACHE_DIR);
+    }
+    
+    // Memory-mapped catalog snapshot for near-instant index startup
+    serviceArgs.push('--snapshot', process.env.CLIP_INDEX_SNAPSHOT_DIR || path.join(__dirname, '..', 'clip_index'));
+    
+    // Optional compact (int8) index scan with float32 re-ranking
+    if (process.env.CLIP_INDEX_QUANTIZATION) {
+      serviceArgs.push('--quantization', process.env.CLIP_INDEX_QUANTIZATION);
+    }
+    
+    // Optional IVF approximate search for large (100k+) catalogs
+    if (process.env.CLIP_INDEX_ANN) {
+      serviceArgs.push('--ann', process.env.CLIP_INDEX_ANN);
+      serviceArgs.push('--nprobe', process.env.CLIP_INDEX_NPROBE || '8');
+    }
+    
+    // Optional binary socket: raw image bytes in, raw float32 out (one process only)
+    const socketPath = process.env.CLIP_WORKERS ? undefined : process.env.CLIP_SOCKET_PATH;
+    if (socketPath) {
+      serviceArgs.push('--socket', socketPath);
+    }
+    
+    return { pythonPath, args: serviceArgs, socketPath };
   }
   
   async startService() {
@@ -29,24 +117,28 @@ class CLIPServiceManager extends EventEmitter {
     console.log('🚀 Starting persistent CLIP service...');
     
     try {
-      const servicePath = path.join(__dirname, 'clipService.py');
+      const { pythonPath, args: serviceArgs, socketPath } = this.getServiceCommand();
+      this.socketClient = socketPath ? new CLIPSocketClient(socketPath) : null;
       
-      // Spawn the Python service using the clip_env environment
-      const pythonPath = path.join(__dirname, '..', 'clip_env', 'bin', 'python3');
-      this.process = spawn(pythonPath, [servicePath], {
+      this.process = spawn(pythonPath, serviceArgs, {
         stdio: ['pipe', 'pipe', 'pipe']
       });
       
       // Handle stdout (responses from Python service)
+      // One response is one line, but a long line (e.g. a precompute batch)
+      // arrives in several chunks: keep the unfinished tail until its newline
+      let pending = '';
+      this.process.stdout.setEncoding('utf8');
       this.process.stdout.on('data', (data) => {
-        const lines = data.toString().split('\n').filter(line => line.trim());
+        const lines = (pending + data).split('\n');
+        pending = lines.pop();
         
-        for (const line of lines) {
+        for (const line of lines.filter(line => line.trim())) {
           try {
             const response = JSON.parse(line);
             this.handleServiceResponse(response);
           } catch (e) {
-            console.error('❌ Failed to parse CLIP service response:', line);
+            console.error('❌ Failed to parse CLIP service response:', line.slice(0, 200));
           }
         }
       });
@@ -59,8 +151,12 @@ class CLIPServiceManager extends EventEmitter {
       // Handle process exit
       this.process.on('exit', (code) => {
         console.log(`📤 CLIP service exited with code ${code}`);
+        this.process = null;
         this.isReady = false;
         this.serviceStarting = false;
+        if (this.socketClient) {
+          this.socketClient.close();
+        }
         
         // Reject all pending requests
         for (const [requestId, { reject }] of this.pendingRequests) {
@@ -99,6 +195,10 @@ class CLIPServiceManager extends EventEmitter {
         console.log(`✅ CLIP service: ${message}`);
         break;
         
+      case 'warning':
+        console.warn(`⚠️ CLIP service: ${message}`);
+        break;
+        
       case 'service_ready':
         console.log(`🎯 ${message}`);
         this.isReady = true;
@@ -146,6 +246,10 @@ class CLIPServiceManager extends EventEmitter {
   sendRequest(request) {
     if (!this.process || !this.isReady) {
       this.requestQueue.push(request);
+      if (!this.process && !this.serviceStarting) {
+        // Lazily started (or exited) service: spawn it for the queued request
+        this.startService();
+      }
       return;
     }
     
@@ -167,17 +271,20 @@ class CLIPServiceManager extends EventEmitter {
   /**
    * Process an image file and get CLIP embedding
    * @param {string} imagePath - Path to the image file
+   * @param {Object} options - { format: 'json' | 'float32' | 'float16', centerFraction }
    * @returns {Promise<Array>} - CLIP embedding array
    */
-  async processImage(imagePath) {
+  async processImage(imagePath, options = {}) {
     return new Promise((resolve, reject) => {
       const requestId = `req_${++this.currentRequestId}`;
       
       const request = {
         action: 'process_image',
         image_path: imagePath,
+        format: options.format,
         request_id: requestId
       };
+      if (options.centerFraction) request.center_fraction = options.centerFraction;
       
       // Store the promise resolvers
       this.pendingRequests.set(requestId, { resolve, reject });
@@ -198,17 +305,20 @@ class CLIPServiceManager extends EventEmitter {
   /**
    * Process a base64 image and get CLIP embedding
    * @param {string} base64Data - Base64 encoded image data
+   * @param {Object} options - { format: 'json' | 'float32' | 'float16', centerFraction }
    * @returns {Promise<Array>} - CLIP embedding array
    */
-  async processBase64Image(base64Data) {
+  async processBase64Image(base64Data, options = {}) {
     return new Promise((resolve, reject) => {
       const requestId = `req_${++this.currentRequestId}`;
       
       const request = {
         action: 'process_base64',
         base64_data: base64Data,
+        format: options.format,
         request_id: requestId
       };
+      if (options.centerFraction) request.center_fraction = options.centerFraction;
       
       // Store the promise resolvers
       this.pendingRequests.set(requestId, { resolve, reject });
@@ -226,6 +336,194 @@ class CLIPServiceManager extends EventEmitter {
     });
   }
   
+  /**
+   * Send an arbitrary action to the service and wait for its response
+   * @param {string} action - Service action name
+   * @param {Object} payload - Extra request fields
+   * @param {number} timeout - Timeout in milliseconds
+   * @returns {Promise<Object>} - Service response
+   */
+  async sendAction(action, payload = {}, timeout = 10000) {
+    return new Promise((resolve, reject) => {
+      const requestId = `req_${++this.currentRequestId}`;
+      
+      const request = {
+        ...payload,
+        action,
+        request_id: requestId
+      };
+      
+      this.pendingRequests.set(requestId, { resolve, reject });
+      this.sendRequest(request);
+      
+      setTimeout(() => {
+        if (this.pendingRequests.has(requestId)) {
+          this.pendingRequests.delete(requestId);
+          reject(new Error(`CLIP ${action} timeout`));
+        }
+      }, timeout);
+    });
+  }
+  
+  /**
+   * Replace the in-process catalog index
+   * @param {Array<{product_id: number, embedding: (Array|string)}>} entries - Product embeddings
+   * @returns {Promise<Object>} - Loaded/skipped counts
+   */
+  async loadIndex(entries) {
+    return this.sendAction('load_index', { entries }, 60000);
+  }
+  
+  /**
+   * Top-K similarity search against the in-process catalog index
+   * @param {Object} query - { base64Data | imageBuffer | imagePath | embedding, topK, minScore, nprobe, exact, filters }
+   *   filters: { user_id, shop_name } (value or array) restricts the scan to that tenant's products
+   * @returns {Promise<Object>} - { results: [{ product_id, similarity }] }
+   */
+  async searchIndex({ base64Data, imageBuffer, imagePath, embedding, topK = 5, minScore, nprobe, exact, filters } = {}) {
+    const payload = { top_k: topK };
+    if (minScore !== undefined) payload.min_score = minScore;
+    if (nprobe !== undefined) payload.nprobe = nprobe;
+    if (exact) payload.exact = true;
+    if (filters) payload.filters = filters;
+    
+    if (imageBuffer && this.useSocket()) {
+      // Raw image bytes over the binary socket: no base64 on either side
+      const { header } = await this.socketClient.request({ ...payload, action: 'search' }, imageBuffer);
+      return header;
+    }
+    
+    if (embedding) payload.embedding = embedding;
+    else if (imagePath) payload.image_path = imagePath;
+    else if (imageBuffer) payload.base64_data = imageBuffer.toString('base64');
+    else payload.base64_data = base64Data;
+    
+    return this.sendAction('search', payload);
+  }
+  
+  /**
+   * True when image payloads can go over the binary socket
+   * @returns {boolean}
+   */
+  useSocket() {
+    return Boolean(this.socketClient && this.isReady);
+  }
+  
+  /**
+   * CLIP embedding of an encoded image held in memory
+   * Uses the binary socket when configured (CLIP_SOCKET_PATH), base64 JSON otherwise
+   * @param {Buffer} imageBuffer - Encoded image file bytes (JPEG/PNG/...)
+   * @param {Object} options - { centerFraction }
+   * @returns {Promise<Object>} - { status, embedding, dimensions }
+   */
+  async embedImageBuffer(imageBuffer, options = {}) {
+    if (!this.useSocket()) {
+      return this.processBase64Image(imageBuffer.toString('base64'), options);
+    }
+    
+    const header = { action: 'process_image' };
+    if (options.centerFraction) header.center_fraction = options.centerFraction;
+    
+    const response = await this.socketClient.request(header, imageBuffer);
+    return {
+      ...response.header,
+      embedding: Array.from(CLIPSocketClient.toFloat32(response.payload))
+    };
+  }
+  
+  /**
+   * Insert or replace product embeddings in the catalog index without a reload
+   * @param {Array<{product_id: number, embedding: (Array|string)}>} entries - Product embeddings
+   * @returns {Promise<Object>} - Inserted/updated counts
+   */
+  async upsertEmbeddings(entries) {
+    return this.sendAction('upsert_embedding', { entries }, 30000);
+  }
+  
+  /**
+   * Replace the tenant tags of indexed products, keeping their embeddings
+   * @param {Array<{product_id: number, user_id, shop_name: Array<string>}>} entries - Current owner and stocking shops
+   * @returns {Promise<Object>} - Updated/missing counts
+   */
+  async updateTenantTags(entries) {
+    return this.sendAction('update_tags', { entries }, 30000);
+  }
+  
+  /**
+   * Remove products from the catalog index
+   * @param {Array<number>} productIds - Products to drop
+   * @returns {Promise<Object>} - Removed count
+   */
+  async removeEmbeddings(productIds) {
+    return this.sendAction('remove_embedding', { product_ids: productIds });
+  }
+  
+  /**
+   * Size and memory usage of the catalog index
+   * @param {Object} options - { includeIds: true } to also return the indexed product ids
+   * @returns {Promise<Object>} - Includes snapshot metadata when opened from a snapshot
+   */
+  async indexStats({ includeIds = false } = {}) {
+    return this.sendAction('index_stats', { include_ids: includeIds });
+  }
+  
+  /**
+   * Embed a text query in the image embedding space (the service loads its text tower on first use)
+   * @param {string} text - Query text
+   * @returns {Promise<Array>} - CLIP embedding array
+   */
+  async processText(text) {
+    const response = await this.sendAction('process_text', { text }, 60000);
+    return response.embedding;
+  }
+  
+  /**
+   * Hit/miss counters of the embedding cache
+   * @returns {Promise<Object>} - { enabled, entries, hits, misses, hit_rate, ... }
+   */
+  async cacheStats() {
+    return this.sendAction('cache_stats');
+  }
+  
+  /**
+   * Embed catalog images for the precompute scripts (chunked forward passes in the service)
+   * @param {Array<{product_id: number, imagePath: string, base64Data: string}>} items - One image source per product
+   * Embeddings come back as base64 float32 (~2.7 KB per vector instead of ~10 KB
+   * of float text) and are decoded here
+   * @param {Object} options - { timeout }
+   * @returns {Promise<Array>} - Per item { product_id, status, embedding, embeddingBlob | message }, in order
+   *   embeddingBlob: the raw little-endian float32 bytes, ready for product_embeddings.embedding_blob
+   */
+  async precomputeBatch(items, options = {}) {
+    const payload = {
+      items: items.map(({ product_id, imagePath, base64Data }) => (
+        imagePath ? { product_id, image_path: imagePath } : { product_id, base64_data: base64Data }
+      )),
+      format: 'float32'
+    };
+    
+    const response = await this.sendAction('precompute_batch', payload, options.timeout || 120000);
+    return response.results.map(result => {
+      if (result.status !== 'success' || !result.embedding_b64) {
+        return result;
+      }
+      const { embedding_b64, dtype, dimensions, ...rest } = result;
+      const embeddingBlob = Buffer.from(embedding_b64, 'base64');
+      // Copy first: a small Buffer can sit at an unaligned offset of Node's shared pool
+      const values = new Float32Array(Uint8Array.from(embeddingBlob).buffer);
+      return { ...rest, embedding: Array.from(values), embeddingBlob };
+    });
+  }
+  
+  /**
+   * Persist the catalog index to the snapshot directory
+   * @param {string|null} watermark - Newest product_embeddings.created_at covered by the index
+   * @returns {Promise<Object>} - Snapshot metadata
+   */
+  async saveIndexSnapshot(watermark) {
+    return this.sendAction('save_snapshot', { watermark }, 30000);
+  }
+  
   /**
    * Health check for the service
    * @returns {Promise<boolean>} - True if service is responsive
@@ -263,9 +561,12 @@ class CLIPServiceManager extends EventEmitter {
     if (this.process) {
       console.log('🛑 Shutting down CLIP service...');
       
+      // The exit handler clears this.process, so keep our own reference
+      const child = this.process;
+      
       // Send shutdown command
       try {
-        this.process.stdin.write(JSON.stringify({ action: 'shutdown' }) + '\n');
+        child.stdin.write(JSON.stringify({ action: 'shutdown' }) + '\n');
       } catch (e) {
         // Ignore write errors during shutdown
       }
@@ -274,8 +575,8 @@ class CLIPServiceManager extends EventEmitter {
       await new Promise(resolve => setTimeout(resolve, 1000));
       
       // Force kill if still running
-      if (!this.process.killed) {
-        this.process.kill('SIGTERM');
+      if (child.exitCode === null && !child.killed) {
+        child.kill('SIGTERM');
       }
       
       this.process = null;
@@ -334,3 +635,4 @@ process.on('SIGTERM', async () => {
 });
 
 module.exports = clipServiceManager;
+module.exports.CLIPServiceManager = CLIPServiceManager;
@@ -0,0 +1,151 @@
+const net = require('net');
+
+// 8-byte frame prefix: big-endian uint32 header length + uint32 payload length
+const PREFIX_BYTES = 8;
+
+/**
+ * Client for the CLIP service's binary Unix socket (clipService.py --socket)
+ * Frames are a JSON header plus raw bytes: the encoded image goes in as-is and
+ * embeddings come back as raw float32, so neither side base64-encodes images
+ * or formats floats as JSON text
+ */
+class CLIPSocketClient {
+  /**
+   * @param {string} socketPath - Unix socket the service listens on
+   */
+  constructor(socketPath) {
+    this.socketPath = socketPath;
+    this.socket = null;
+    this.connecting = null;
+    this.buffer = Buffer.alloc(0);
+    this.currentRequestId = 0;
+    this.pendingRequests = new Map();
+  }
+  
+  /**
+   * Open the connection (once; concurrent callers share the attempt)
+   * @returns {Promise<void>}
+   */
+  connect() {
+    if (this.socket) {
+      return Promise.resolve();
+    }
+    if (this.connecting) {
+      return this.connecting;
+    }
+    
+    this.connecting = new Promise((resolve, reject) => {
+      const socket = net.createConnection(this.socketPath);
+      
+      socket.once('connect', () => {
+        this.socket = socket;
+        this.connecting = null;
+        resolve();
+      });
+      
+      socket.on('data', (data) => this.handleData(data));
+      
+      socket.on('error', (error) => {
+        if (!this.socket) {
+          this.connecting = null;
+          reject(error);
+        }
+      });
+      
+      socket.on('close', () => {
+        this.socket = null;
+        this.buffer = Buffer.alloc(0);
+        
+        // Reject everything still waiting on this connection
+        for (const [, { reject: rejectRequest }] of this.pendingRequests) {
+          rejectRequest(new Error('CLIP socket closed'));
+        }
+        this.pendingRequests.clear();
+      });
+    });
+    
+    return this.connecting;
+  }
+  
+  /**
+   * Split the byte stream into frames and resolve their requests
+   * @param {Buffer} data - Bytes received from the service
+   */
+  handleData(data) {
+    this.buffer = this.buffer.length ? Buffer.concat([this.buffer, data]) : data;
+    
+    while (this.buffer.length >= PREFIX_BYTES) {
+      const headerLength = this.buffer.readUInt32BE(0);
+      const payloadLength = this.buffer.readUInt32BE(4);
+      const frameLength = PREFIX_BYTES + headerLength + payloadLength;
+      if (this.buffer.length < frameLength) {
+        break;
+      }
+      
+      const header = JSON.parse(this.buffer.toString('utf8', PREFIX_BYTES, PREFIX_BYTES + headerLength));
+      const payload = this.buffer.subarray(PREFIX_BYTES + headerLength, frameLength);
+      this.buffer = this.buffer.subarray(frameLength);
+      
+      const pending = this.pendingRequests.get(header.request_id);
+      if (!pending) {
+        continue;
+      }
+      this.pendingRequests.delete(header.request_id);
+      
+      if (header.status === 'success') {
+        pending.resolve({ header, payload });
+      } else {
+        pending.reject(new Error(header.message || 'CLIP processing failed'));
+      }
+    }
+  }
+  
+  /**
+   * Send one frame and wait for its response frame
+   * @param {Object} header - Request fields (action, top_k, ...)
+   * @param {Buffer} payload - Raw image bytes (may be empty)
+   * @param {number} timeout - Timeout in milliseconds
+   * @returns {Promise<{header: Object, payload: Buffer}>}
+   */
+  async request(header, payload = Buffer.alloc(0), timeout = 10000) {
+    await this.connect();
+    
+    return new Promise((resolve, reject) => {
+      const requestId = `bin_${++this.currentRequestId}`;
+      const headerBytes = Buffer.from(JSON.stringify({ ...header, request_id: requestId }), 'utf8');
+      
+      const prefix = Buffer.alloc(PREFIX_BYTES);
+      prefix.writeUInt32BE(headerBytes.length, 0);
+      prefix.writeUInt32BE(payload.length, 4);
+      
+      this.pendingRequests.set(requestId, { resolve, reject });
+      this.socket.write(Buffer.concat([prefix, headerBytes, payload]));
+      
+      setTimeout(() => {
+        if (this.pendingRequests.has(requestId)) {
+          this.pendingRequests.delete(requestId);
+          reject(new Error(`CLIP ${header.action} timeout`));
+        }
+      }, timeout);
+    });
+  }
+  
+  /**
+   * Embedding payload as a Float32Array (copied, so it does not pin the receive buffer)
+   * @param {Buffer} payload - Raw little-endian float32 bytes
+   * @returns {Float32Array}
+   */
+  static toFloat32(payload) {
+    const bytes = new Uint8Array(payload);
+    return new Float32Array(bytes.buffer, bytes.byteOffset, bytes.length / 4);
+  }
+  
+  close() {
+    if (this.socket) {
+      this.socket.end();
+      this.socket = null;
+    }
+  }
+}
+
+module.exports = CLIPSocketClient;
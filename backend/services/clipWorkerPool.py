@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+Multi-Process CLIP Worker Pool
+Forks N copies of an already loaded PersistentCLIPService (the model weights
+are shared copy-on-write), pins each to its own core subset with a bounded
+torch thread count, routes requests to the least-loaded worker and replaces
+crashed workers without losing the requests they held
+"""
+
+import gc
+import json
+import os
+import queue
+import sys
+import threading
+from embeddingIndex import TENANT_FIELDS
+
+# Index actions every worker must apply so their catalog copies stay identical
+BROADCAST_ACTIONS = ("load_index", "upsert_embedding", "remove_embedding", "update_tags", "load_snapshot", "build_ann")
+
+# Broadcast actions that replace the whole index (earlier replay history is dropped)
+RESET_ACTIONS = ("load_index", "load_snapshot")
+
+# How often a request is re-dispatched after the worker running it crashed
+MAX_REQUEST_RETRIES = 1
+
+def core_subsets(workers):
+    """Split the CPUs this process may use into `workers` contiguous subsets"""
+    if hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    
+    if len(cores) < workers:
+        # More workers than cores: share the whole set
+        return [cores] * workers
+    
+    size, extra = divmod(len(cores), workers)
+    subsets = []
+    start = 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        subsets.append(cores[start:end])
+        start = end
+    return subsets
+
+class Worker:
+    """Bookkeeping for one forked service process"""
+    
+    def __init__(self, index, cores):
+        self.index = index
+        self.cores = cores
+        self.pid = None
+        self.ready = False
+        self.alive = False
+        self.restarts = 0
+        self.dispatched = 0
+        # Supervisor request id -> request, for everything sent and not yet answered
+        self.inflight = {}
+        # Lines waiting to be written to the worker (None stops the writer thread)
+        self.outbox = queue.Queue()
+        self.request_fd = None
+        self.response_fd = None
+        self.reader = None
+
+class CLIPWorkerPool:
+    def __init__(self, service, workers, threads_per_worker=None):
+        """
+        service: a PersistentCLIPService with the model (and snapshot) loaded
+        workers: number of worker processes to fork
+        threads_per_worker: torch intra-op threads per worker (default: its core count)
+        """
+        self.service = service
+        self.threads_per_worker = threads_per_worker
+        self.workers = [Worker(i, cores) for i, cores in enumerate(core_subsets(max(1, workers)))]
+        
+        self.lock = threading.Lock()
+        self.stdout_lock = threading.Lock()
+        self.stopping = False
+        self.sequence = 0
+        # Requests accepted while no worker was ready, in arrival order
+        self.waiting = []
+        # Broadcast id -> {"request_id", "remaining": set of worker indexes, "response"}
+        self.broadcasts = {}
+        # Index state replayed into replacement workers: the last full load,
+        # the latest update of each product since then and the last build_ann
+        self.replay_log = []
+        self.replay_products = {}
+        self.replay_ann = None
+        self.all_ready = threading.Event()
+    
+    def _emit(self, result, request_id=None):
+        """Write a response line to the supervisor's stdout"""
+        if request_id:
+            result["request_id"] = request_id
+        line = json.dumps(result)
+        with self.stdout_lock:
+            print(line, flush=True)
+    
+    def _next_id(self, prefix):
+        self.sequence += 1
+        return f"{prefix}{self.sequence}"
+    
+    def _spawn(self, worker):
+        """Fork one worker from the loaded service (caller holds self.lock after startup)"""
+        request_r, request_w = os.pipe()
+        response_r, response_w = os.pipe()
+        
+        # Nothing allocated so far needs to be tracked by the collector; frozen
+        # objects keep their pages shared with the children
+        gc.freeze()
+        pid = os.fork()
+        
+        if pid == 0:
+            self._run_worker(worker, request_r, response_w, (request_w, response_r))
+        
+        os.close(request_r)
+        os.close(response_w)
+        worker.pid = pid
+        worker.alive = True
+        worker.ready = False
+        worker.request_fd = request_w
+        worker.response_fd = response_r
+        worker.outbox = queue.Queue()
+        
+        threading.Thread(target=self._write_loop, args=(worker, worker.outbox, request_w), daemon=True).start()
+        worker.reader = threading.Thread(target=self._read_loop, args=(worker, response_r, pid), daemon=True)
+        worker.reader.start()
+    
+    def _run_worker(self, worker, request_fd, response_fd, own_parent_fds):
+        """Child process: serve requests from the supervisor pipe, never returns"""
+        try:
+            # Only this worker's own pipe ends stay open, so a crash is seen as EOF
+            for fd in own_parent_fds:
+                os.close(fd)
+            for other in self.workers:
+                if other is not worker and other.alive:
+                    for fd in (other.request_fd, other.response_fd):
+                        try:
+                            os.close(fd)
+                        except OSError:
+                            pass
+            
+            os.dup2(request_fd, 0)
+            os.dup2(response_fd, 1)
+            os.close(request_fd)
+            os.close(response_fd)
+            sys.stdin = os.fdopen(0, "r")
+            sys.stdout = os.fdopen(1, "w")
+            
+            if hasattr(os, "sched_setaffinity"):
+                os.sched_setaffinity(0, worker.cores)
+            self.service.backend.set_num_threads(self.threads_per_worker or max(1, len(worker.cores)))
+            
+            # A lock copied mid-write from the supervisor could stay held forever
+            self.service._send_lock = threading.Lock()
+            self.service.run_service()
+        except BaseException as e:
+            print(f"CLIP worker {worker.index} failed: {e}", file=sys.stderr, flush=True)
+        finally:
+            os._exit(0)
+    
+    def _write_loop(self, worker, outbox, fd):
+        """Writer thread - a full pipe only blocks this worker's writer"""
+        with os.fdopen(fd, "w") as pipe:
+            while True:
+                line = outbox.get()
+                if line is None:
+                    return
+                try:
+                    pipe.write(line + "\n")
+                    pipe.flush()
+                except (BrokenPipeError, OSError):
+                    # The reader thread notices the exit and re-dispatches
+                    return
+    
+    def _read_loop(self, worker, fd, pid):
+        """Reader thread - forwards responses and handles the worker's exit"""
+        with os.fdopen(fd, "r") as pipe:
+            for line in pipe:
+                if not line.strip():
+                    continue
+                try:
+                    response = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self._on_response(worker, response)
+        
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+        self._on_exit(worker)
+    
+    def _on_response(self, worker, response):
+        request_id = response.pop("request_id", None)
+        
+        with self.lock:
+            if response.get("status") == "service_ready":
+                worker.ready = True
+                self._flush_waiting()
+                if all(w.ready for w in self.workers):
+                    self.all_ready.set()
+                return
+            
+            if request_id is None or request_id not in worker.inflight:
+                # Status lines and replayed index updates
+                return
+            
+            request = worker.inflight.pop(request_id)
+            broadcast_id = request.get("_broadcast")
+            if broadcast_id is None:
+                self._emit(response, request.get("_client_id"))
+                return
+            self._finish_part(broadcast_id, worker.index, response)
+    
+    def _finish_part(self, broadcast_id, worker_index, response):
+        """Record one worker's answer to a broadcast; reply once all have answered"""
+        broadcast = self.broadcasts.get(broadcast_id)
+        if broadcast is None:
+            return
+        
+        broadcast["remaining"].discard(worker_index)
+        if response is not None and (broadcast["response"] is None or response.get("status") == "error"):
+            broadcast["response"] = response
+        
+        if not broadcast["remaining"]:
+            del self.broadcasts[broadcast_id]
+            result = broadcast["response"] or {"status": "error", "message": "No CLIP worker answered"}
+            result["workers"] = len(self.workers)
+            self._emit(result, broadcast["request_id"])
+    
+    def _on_exit(self, worker):
+        """Worker exited: replace it and re-dispatch what it was holding"""
+        with self.lock:
+            worker.alive = False
+            worker.ready = False
+            worker.outbox.put(None)
+            orphans = list(worker.inflight.values())
+            worker.inflight = {}
+            
+            if self.stopping:
+                for request in orphans:
+                    if request.get("_broadcast") is not None:
+                        self._finish_part(request["_broadcast"], worker.index, None)
+                return
+            
+            print(f"CLIP worker {worker.index} (pid {worker.pid}) exited, restarting", file=sys.stderr, flush=True)
+            worker.restarts += 1
+            self._spawn(worker)
+            
+            # The replacement is forked from the startup state; bring its index up to date
+            for request in self._replay_requests():
+                worker.outbox.put(json.dumps({**request, "request_id": self._next_id("replay")}))
+            
+            for request in orphans:
+                broadcast_id = request.get("_broadcast")
+                if broadcast_id is not None:
+                    # The replay above already applied it on the replacement
+                    self._finish_part(broadcast_id, worker.index, None)
+                elif request["_retries"] >= MAX_REQUEST_RETRIES:
+                    self._emit({
+                        "status": "error",
+                        "message": "CLIP worker crashed while processing the request"
+                    }, request.get("_client_id"))
+                else:
+                    request["_retries"] += 1
+                    self._dispatch(request)
+    
+    def _least_loaded(self):
+        ready = [w for w in self.workers if w.ready]
+        if not ready:
+            return None
+        return min(ready, key=lambda w: (len(w.inflight), w.dispatched))
+    
+    def _send_to(self, worker, request):
+        """Queue a request on one worker under a fresh supervisor id"""
+        supervisor_id = self._next_id("w")
+        worker.inflight[supervisor_id] = request
+        worker.dispatched += 1
+        payload = {k: v for k, v in request.items() if not k.startswith("_")}
+        payload["request_id"] = supervisor_id
+        worker.outbox.put(json.dumps(payload))
+    
+    def _dispatch(self, request):
+        """Route a request to the least-loaded ready worker (or wait for one)"""
+        worker = self._least_loaded()
+        if worker is None:
+            self.waiting.append(request)
+            return
+        self._send_to(worker, request)
+    
+    def _flush_waiting(self):
+        waiting, self.waiting = self.waiting, []
+        for request in waiting:
+            self._dispatch(request)
+    
+    @staticmethod
+    def _product_key(product_id):
+        """The index stores int ids; "42" and 42 are the same product"""
+        try:
+            return int(product_id)
+        except (TypeError, ValueError):
+            return product_id
+    
+    def _remember(self, replay):
+        """
+        Fold a broadcast into the replay state, so it stays catalog-sized
+        Each product keeps its last upsert ("entry", with later tag updates
+        folded in) or "removed", plus a tag update that preceded its upsert
+        ("tags") when the upsert itself carried no tenant fields
+        """
+        action = replay.get("action")
+        if action in RESET_ACTIONS:
+            self.replay_log = [replay]
+            self.replay_products = {}
+            self.replay_ann = None
+        elif action == "build_ann":
+            self.replay_ann = replay
+        elif action == "upsert_embedding":
+            entries = replay.get("entries")
+            if entries is None:
+                entries = [{k: v for k, v in replay.items() if k != "action"}]
+            for entry in entries:
+                key = self._product_key(entry.get("product_id"))
+                previous = self.replay_products.get(key, {})
+                state = {"entry": entry}
+                if not any(field in entry for field in TENANT_FIELDS):
+                    # An upsert without tenant fields keeps the product's tags
+                    if "tags" in previous:
+                        state["tags"] = previous["tags"]
+                    if "entry" in previous:
+                        state["entry"] = {**entry, **self._tenant_fields(previous["entry"])}
+                    elif "removed" in previous:
+                        # Re-added after a removal: no tags (the base copy may still have some)
+                        state["entry"] = {**entry, **{field: None for field in TENANT_FIELDS}}
+                self.replay_products[key] = state
+        elif action == "remove_embedding":
+            product_ids = replay.get("product_ids")
+            if product_ids is None:
+                product_ids = [replay.get("product_id")]
+            for product_id in product_ids:
+                self.replay_products[self._product_key(product_id)] = {"removed": product_id}
+        elif action == "update_tags":
+            for entry in replay.get("entries") or []:
+                tags = self._tenant_fields(entry)
+                key = self._product_key(entry.get("product_id"))
+                previous = self.replay_products.get(key, {})
+                if not tags or "removed" in previous:
+                    # Rejected, or retagging a product that is gone: no effect
+                    continue
+                if "entry" in previous:
+                    # The new tags replace all earlier ones, the embedding stays
+                    untagged = {k: v for k, v in previous["entry"].items() if k not in TENANT_FIELDS}
+                    self.replay_products[key] = {"entry": {**untagged, **tags}}
+                else:
+                    self.replay_products[key] = {"tags": {"product_id": entry.get("product_id"), **tags}}
+    
+    @staticmethod
+    def _tenant_fields(entry):
+        return {field: entry[field] for field in TENANT_FIELDS if field in entry}
+    
+    def _replay_requests(self):
+        """The requests that bring a freshly forked worker's index up to date"""
+        states = self.replay_products.values()
+        retagged = [state["tags"] for state in states if "tags" in state]
+        upserts = [state["entry"] for state in states if "entry" in state]
+        removed = [state["removed"] for state in states if "removed" in state]
+        
+        requests = list(self.replay_log)
+        if retagged:
+            requests.append({"action": "update_tags", "entries": retagged})
+        if upserts:
+            requests.append({"action": "upsert_embedding", "entries": upserts})
+        if removed:
+            requests.append({"action": "remove_embedding", "product_ids": removed})
+        if self.replay_ann is not None:
+            requests.append(self.replay_ann)
+        return requests
+    
+    def _broadcast(self, request):
+        """Send an index update to every live worker; answered once all applied it"""
+        replay = {k: v for k, v in request.items() if k != "request_id"}
+        self._remember(replay)
+        
+        broadcast_id = self._next_id("b")
+        live = [w for w in self.workers if w.alive]
+        self.broadcasts[broadcast_id] = {
+            "request_id": request.get("request_id"),
+            "remaining": {w.index for w in live},
+            "response": None
+        }
+        for worker in live:
+            # Starting workers apply it after their startup, in order
+            self._send_to(worker, {**replay, "_broadcast": broadcast_id, "_retries": 0})
+    
+    def _stats(self):
+        return [{
+            "worker": w.index,
+            "pid": w.pid,
+            "cores": w.cores,
+            "ready": w.ready,
+            "inflight": len(w.inflight),
+            "dispatched": w.dispatched,
+            "restarts": w.restarts
+        } for w in self.workers]
+    
+    def run(self):
+        """Supervisor loop - reads client requests from stdin and routes them"""
+        with self.lock:
+            for worker in self.workers:
+                self._spawn(worker)
+        self.all_ready.wait()
+        
+        self._emit({
+            "status": "service_ready",
+            "message": f"CLIP service ready for requests ({len(self.workers)} worker processes)"
+        })
+        
+        try:
+            for line in sys.stdin:
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line.strip())
+                except json.JSONDecodeError:
+                    self._emit({"status": "error", "message": "Invalid JSON request"})
+                    continue
+                
+                action = request.get("action")
+                if action == "shutdown":
+                    break
+                
+                with self.lock:
+                    if action == "ping":
+                        self._emit({"status": "pong", "message": "Service is alive", "workers": self._stats()},
+                                   request.get("request_id"))
+                    elif action in BROADCAST_ACTIONS:
+                        self._broadcast(request)
+                    else:
+                        self._dispatch({**request, "_client_id": request.get("request_id"), "_retries": 0})
+        
+        except KeyboardInterrupt:
+            pass
+        
+        self.shutdown()
+    
+    def shutdown(self):
+        """Let the workers finish their queues, then stop them"""
+        with self.lock:
+            self.stopping = True
+            for worker in self.workers:
+                if worker.alive:
+                    worker.outbox.put(json.dumps({"action": "shutdown"}))
+                    worker.outbox.put(None)
+        
+        # Each reader forwards the last responses, then collects its worker
+        for worker in self.workers:
+            worker.reader.join()
+        
+        self._emit({"status": "shutdown", "message": "Service shutting down"})
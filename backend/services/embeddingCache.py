@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Content-Hash Embedding Cache
+Remembers embeddings by the SHA-256 of the encoded image bytes (plus any crop
+settings), so re-uploads, precompute reruns and repeated test runs skip the
+decode and forward pass. A bounded in-memory LRU sits in front of an optional
+on-disk tier of .npy files, one directory per model
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+
+class EmbeddingCache:
+    def __init__(self, model_name, max_entries=2048, disk_dir=None):
+        """
+        model_name: embeddings of different models never share entries
+        max_entries: in-memory LRU capacity (0 keeps only the disk tier)
+        disk_dir: optional directory for the persistent tier
+        """
+        self.model_name = model_name
+        self.max_entries = max(0, int(max_entries))
+        self.disk_dir = None
+        if disk_dir:
+            self.disk_dir = os.path.join(disk_dir, re.sub(r"[^A-Za-z0-9._-]+", "_", model_name))
+            os.makedirs(self.disk_dir, exist_ok=True)
+        
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+    
+    def key(self, data, variant=""):
+        """Cache key for encoded image bytes; variant distinguishes crops of the same image"""
+        digest = hashlib.sha256()
+        digest.update(variant.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(data)
+        return digest.hexdigest()
+    
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.npy")
+    
+    def _remember(self, key, embedding):
+        """Insert into the LRU (caller holds the lock)"""
+        if not self.max_entries:
+            return
+        self.entries[key] = embedding
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    def get(self, key):
+        """Cached embedding (read-only float32 array) or None"""
+        if key is None:
+            return None
+        
+        with self.lock:
+            embedding = self.entries.get(key)
+            if embedding is not None:
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+                return embedding
+        
+        if self.disk_dir:
+            try:
+                embedding = np.load(self._disk_path(key))
+            except (OSError, ValueError):
+                embedding = None
+            if embedding is not None:
+                embedding = np.asarray(embedding, dtype=np.float32)
+                embedding.setflags(write=False)
+                with self.lock:
+                    self._remember(key, embedding)
+                    self.disk_hits += 1
+                return embedding
+        
+        with self.lock:
+            self.misses += 1
+        return None
+    
+    def put(self, key, embedding):
+        """Store an embedding in memory and, when configured, on disk"""
+        if key is None:
+            return
+        
+        embedding = np.array(embedding, dtype=np.float32).reshape(-1)
+        embedding.setflags(write=False)
+        with self.lock:
+            self._remember(key, embedding)
+        
+        if self.disk_dir:
+            path = self._disk_path(key)
+            if os.path.exists(path):
+                return
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Write then rename, so a reader never sees a partial file
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    np.save(f, embedding)
+                os.replace(temp_path, path)
+            except OSError:
+                # The disk tier is best-effort; the memory tier already has it
+                pass
+    
+    def clear(self):
+        """Drop the in-memory entries (the disk tier is kept)"""
+        with self.lock:
+            self.entries.clear()
+    
+    def stats(self):
+        with self.lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "model": self.model_name,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "memory_bytes": int(sum(e.nbytes for e in self.entries.values())),
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "disk_dir": self.disk_dir
+            }
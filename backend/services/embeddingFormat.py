@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Compact Binary Embedding Format
+Encodes CLIP embeddings as base64 of raw little-endian float32/float16 bytes
+instead of JSON float text (~10 KB -> ~2.7 KB / ~1.4 KB per 512-d vector)
+"""
+
+import base64
+import json
+import numpy as np
+
+# Wire/storage dtypes, always little-endian
+SUPPORTED_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2")
+}
+
+# Response formats accepted by the service ("json" keeps the legacy float list)
+OUTPUT_FORMATS = ("json",) + tuple(SUPPORTED_DTYPES)
+
+def _wire_dtype(dtype):
+    """Resolve a dtype name, raising a clear error for unsupported ones"""
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype} (expected one of {', '.join(SUPPORTED_DTYPES)})")
+    return SUPPORTED_DTYPES[dtype]
+
+def encode_embedding(vector, dtype="float32"):
+    """Encode a 1-D vector as {"embedding_b64", "dtype", "dimensions"}"""
+    array = np.asarray(vector).reshape(-1).astype(_wire_dtype(dtype), copy=False)
+    return {
+        "embedding_b64": base64.b64encode(array.tobytes()).decode("ascii"),
+        "dtype": dtype,
+        "dimensions": int(array.size)
+    }
+
+def decode_embedding(embedding_b64, dtype="float32", dimensions=None):
+    """Decode one base64 blob into a float32 vector"""
+    raw = base64.b64decode(embedding_b64)
+    vector = np.frombuffer(raw, dtype=_wire_dtype(dtype))
+    if dimensions is not None and vector.size != int(dimensions):
+        raise ValueError(f"Embedding blob has {vector.size} values, expected {dimensions}")
+    return vector.astype(np.float32)
+
+def load_embedding_matrix(blobs, dtype="float32", dimensions=512):
+    """
+    Read many base64 blobs straight into an (N, dimensions) float32 matrix
+    All blobs are decoded, joined and converted with a single frombuffer call
+    """
+    wire = _wire_dtype(dtype)
+    raw = [base64.b64decode(blob) for blob in blobs]
+    
+    expected = wire.itemsize * dimensions
+    for i, chunk in enumerate(raw):
+        if len(chunk) != expected:
+            raise ValueError(f"Blob {i} has {len(chunk)} bytes, expected {expected}")
+    
+    if not raw:
+        return np.zeros((0, dimensions), dtype=np.float32)
+    
+    matrix = np.frombuffer(b"".join(raw), dtype=wire).reshape(len(raw), dimensions)
+    return matrix.astype(np.float32)
+
+def entry_vector(entry):
+    """
+    Extract the embedding from an index entry
+    Supports {"embedding_b64", "dtype"} blobs as well as JSON lists/text
+    """
+    if entry.get("embedding_b64") is not None:
+        return decode_embedding(entry["embedding_b64"], entry.get("dtype", "float32"), entry.get("dimensions"))
+    
+    embedding = entry["embedding"]
+    if isinstance(embedding, str):
+        embedding = json.loads(embedding)
+    return np.asarray(embedding, dtype=np.float32)
@@ -0,0 +1,791 @@
+#!/usr/bin/env python3
+"""
+In-memory Vector Index for CLIP Product Embeddings
+Keeps the catalog as one contiguous float32 matrix so a search is a single
+matrix-vector product instead of per-row parsing and JS loops
+"""
+
+import ctypes
+import json
+import mmap
+import os
+import tempfile
+import time
+import numpy as np
+from embeddingFormat import decode_embedding, entry_vector, load_embedding_matrix
+from ivfIndex import IVFIndex
+
+# Smallest matrix allocation; capacity doubles/halves from here
+MIN_CAPACITY = 16
+
+# Snapshot layout: a float32 .npy matrix, a sidecar id array and metadata
+SNAPSHOT_MATRIX = "embeddings.npy"
+SNAPSHOT_IDS = "product_ids.npy"
+SNAPSHOT_META = "meta.json"
+SNAPSHOT_ANN = "ivf.npz"
+SNAPSHOT_TENANTS = "tenants.json"
+
+# Compact storage modes for the coarse scan (None keeps float32 only)
+# (no float16: NumPy converts it to float32 in software, which made its scan
+# ~9x slower than plain float32)
+QUANTIZATION_MODES = (None, "int8")
+
+# Rows converted to float32 at a time during a quantized scan (~1 MB, stays in cache)
+SCAN_BLOCK_ROWS = 512
+
+# Quantized mode: full-precision rows written or re-ranked before their
+# pages are dropped from memory again (bounds them to a few MB)
+RELEASE_AFTER_ROWS = 1024
+
+# Approximate search modes (None = always exact)
+ANN_MODES = (None, "ivf")
+
+# Below this size an exact scan is already sub-millisecond, so no ANN is built
+ANN_MIN_SIZE = 10000
+
+# Entry fields that place a product in a tenant partition (a product can be in several shops)
+TENANT_FIELDS = ("user_id", "shop_name")
+
+def quantize_rows(rows, mode="int8"):
+    """
+    Convert float32 rows to their compact int8 form with symmetric
+    per-vector scales: row ~= codes * scale
+    Returns (codes, scales)
+    """
+    max_abs = np.abs(rows).max(axis=1) if len(rows) else np.zeros(0, dtype=np.float32)
+    scales = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+    codes = np.clip(np.rint(rows / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+_libc = ctypes.CDLL(None, use_errno=True) if os.name == "posix" else None
+
+def resident_bytes(array):
+    """
+    Bytes of a memory-mapped array that are currently in RAM (mincore)
+    Falls back to the full size where that cannot be asked
+    """
+    if array.nbytes == 0 or _libc is None or not hasattr(_libc, "mincore"):
+        return int(array.nbytes)
+    
+    start = array.ctypes.data
+    aligned = start - start % mmap.PAGESIZE
+    length = start + array.nbytes - aligned
+    pages = (ctypes.c_ubyte * ((length + mmap.PAGESIZE - 1) // mmap.PAGESIZE))()
+    if _libc.mincore(ctypes.c_void_p(aligned), ctypes.c_size_t(length), pages) != 0:
+        return int(array.nbytes)
+    resident = int(np.count_nonzero(np.frombuffer(pages, dtype=np.uint8) & 1))
+    return min(int(array.nbytes), resident * mmap.PAGESIZE)
+
+class EmbeddingIndex:
+    def __init__(self, dimensions=512, quantization=None, rerank_factor=4, ann=None, nprobe=8, n_lists=None,
+                 spill_dir=None):
+        """
+        Create an empty index for vectors of the given size
+        quantization: None or "int8" - the coarse top-K scan runs on the compact
+                      copy and a shortlist of rerank_factor * top_k rows is
+                      re-ranked with the full-precision vectors, which then live
+                      in a file mapping and are paged in only for that shortlist
+        ann: None or "ivf" - once the index holds ANN_MIN_SIZE products, searches
+             only scan the nprobe closest of n_lists k-means clusters
+        spill_dir: directory of that file (default: the system temp directory,
+                   which should not be a tmpfs)
+        """
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode: {quantization}")
+        if ann not in ANN_MODES:
+            raise ValueError(f"Unknown ANN mode: {ann}")
+        
+        self.dimensions = dimensions
+        self.quantization = quantization
+        self.rerank_factor = max(1, int(rerank_factor))
+        self.ann_mode = ann
+        self.nprobe = max(1, int(nprobe))
+        self.n_lists = n_lists
+        self.spill_dir = spill_dir
+        self.ann = None
+        self._reset(0)
+    
+    def _allocate(self, capacity):
+        """
+        Zeroed float32 matrix for capacity rows: in memory, or when quantized in
+        a shared mapping of an unlinked temp file whose pages can be dropped
+        (see _release_full_precision). Returns (matrix, spill_file or None)
+        """
+        if self.quantization is None or capacity == 0:
+            return np.zeros((capacity, self.dimensions), dtype=np.float32), None
+        
+        spill_file = tempfile.TemporaryFile(dir=self.spill_dir)
+        nbytes = capacity * self.dimensions * np.dtype(np.float32).itemsize
+        spill_file.truncate(nbytes)
+        buffer = mmap.mmap(spill_file.fileno(), nbytes)
+        if hasattr(mmap, "MADV_RANDOM"):
+            # Re-rank reads are scattered rows; readahead would page the whole file back in
+            buffer.madvise(mmap.MADV_RANDOM)
+        return np.ndarray((capacity, self.dimensions), dtype=np.float32, buffer=buffer), spill_file
+    
+    def _use_matrix(self, matrix, spill_file=None):
+        self.matrix = matrix
+        self._spill_file = spill_file
+        self._touched_rows = 0
+    
+    def _place(self, rows):
+        """Make rows the full-precision matrix (copied into a spill file when quantized)"""
+        matrix, spill_file = self._allocate(len(rows))
+        if spill_file is None:
+            self._use_matrix(rows)
+            return
+        
+        for start in range(0, len(rows), SCAN_BLOCK_ROWS):
+            matrix[start:start + SCAN_BLOCK_ROWS] = rows[start:start + SCAN_BLOCK_ROWS]
+        self._use_matrix(matrix, spill_file)
+    
+    def _release_full_precision(self):
+        """
+        Quantized mode: write the spilled float32 rows back to their file and
+        drop them from memory; the re-rank pages its shortlist back in
+        """
+        if self._spill_file is None:
+            return
+        
+        buffer = self.matrix.base
+        buffer.flush()
+        if hasattr(mmap, "MADV_DONTNEED"):
+            buffer.madvise(mmap.MADV_DONTNEED)
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self._spill_file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        self._touched_rows = 0
+    
+    def _touch(self, rows):
+        """Count full-precision rows paged in, releasing them every RELEASE_AFTER_ROWS"""
+        self._touched_rows += rows
+        if self._spill_file is not None and self._touched_rows >= RELEASE_AFTER_ROWS:
+            self._release_full_precision()
+    
+    def _reset(self, capacity):
+        """Drop all contents and allocate an empty matrix"""
+        self._use_matrix(*self._allocate(capacity))
+        # product id stored in each row, -1 for free slots
+        self.slot_ids = np.full(capacity, -1, dtype=np.int64)
+        self.id_to_slot = {}
+        self.free_slots = []
+        # Rows [0, size) have been handed out at least once
+        self.size = 0
+        # Metadata of the snapshot the index was opened from, if any
+        self.snapshot = None
+        # field -> value -> set of slots, and the tenant tags of each slot
+        self.partitions = {field: {} for field in TENANT_FIELDS}
+        self.slot_tenants = {}
+        self._partition_rows = {}
+        self._rebuild_codes()
+    
+    def _rebuild_codes(self):
+        """Recompute the compact copy of the whole matrix (block by block)"""
+        self.codes = None
+        self.scales = None
+        if self.quantization is None:
+            return
+        
+        self.codes = np.zeros((self.capacity, self.dimensions), dtype=np.int8)
+        self.scales = np.ones(self.capacity, dtype=np.float32)
+        
+        for start in range(0, self.size, SCAN_BLOCK_ROWS):
+            end = min(start + SCAN_BLOCK_ROWS, self.size)
+            self.codes[start:end], self.scales[start:end] = quantize_rows(
+                np.asarray(self.matrix[start:end]), self.quantization)
+        self._release_full_precision()
+    
+    def _set_codes(self, slot, vector):
+        """Keep the compact copy of one row in sync"""
+        if self.quantization is None:
+            return
+        
+        codes, scales = quantize_rows(vector[None, :], self.quantization)
+        self.codes[slot] = codes[0]
+        self.scales[slot] = scales[0]
+        self._touch(1)
+    
+    def set_quantization(self, quantization, rerank_factor=None):
+        """Switch the coarse-scan storage mode, rebuilding the compact copy"""
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode: {quantization}")
+        
+        self.quantization = quantization
+        if rerank_factor is not None:
+            self.rerank_factor = max(1, int(rerank_factor))
+        if quantization is not None:
+            self._place(self.matrix)
+        elif self._spill_file is not None:
+            # The full-precision scan needs the vectors back in memory
+            self._use_matrix(np.array(self.matrix))
+        self._rebuild_codes()
+    
+    def __len__(self):
+        return len(self.id_to_slot)
+    
+    @property
+    def capacity(self):
+        return self.matrix.shape[0]
+    
+    @property
+    def product_ids(self):
+        """Product ids of the active rows, in row order"""
+        used = self.slot_ids[:self.size]
+        return used[used >= 0]
+    
+    @staticmethod
+    def parse_embedding(embedding):
+        """Accept a list of floats or the JSON text stored in product_embeddings"""
+        if isinstance(embedding, str):
+            embedding = json.loads(embedding)
+        return np.asarray(embedding, dtype=np.float32)
+    
+    @staticmethod
+    def normalize_rows(matrix):
+        """L2-normalize rows in place; returns a mask of rows that are usable"""
+        norms = np.linalg.norm(matrix, axis=1)
+        valid = np.isfinite(norms) & (norms > 0)
+        matrix[valid] /= norms[valid, None]
+        return valid
+    
+    @staticmethod
+    def entry_tenants(entry):
+        """
+        Tenant tags of an index entry as (field, value) pairs
+        Returns None when the entry carries no tenant fields (keep existing tags)
+        """
+        tenants = []
+        present = False
+        for field in TENANT_FIELDS:
+            if field not in entry:
+                continue
+            present = True
+            values = entry[field]
+            if values is None:
+                continue
+            for value in values if isinstance(values, (list, tuple)) else [values]:
+                if value is not None and value != "":
+                    tenants.append((field, str(value)))
+        return tuple(dict.fromkeys(tenants)) if present else None
+    
+    def _tag(self, slot, tenants):
+        """Replace the tenant partitions a slot belongs to"""
+        self._untag(slot)
+        if not tenants:
+            return
+        self.slot_tenants[slot] = tenants
+        for field, value in tenants:
+            self.partitions[field].setdefault(value, set()).add(slot)
+            self._partition_rows.pop((field, value), None)
+    
+    def _untag(self, slot):
+        for field, value in self.slot_tenants.pop(slot, ()):
+            members = self.partitions[field].get(value)
+            if members is not None:
+                members.discard(slot)
+                if not members:
+                    del self.partitions[field][value]
+            self._partition_rows.pop((field, value), None)
+    
+    def _retag_all(self, slot_tenants):
+        """Rebuild every partition from a slot -> tenants mapping"""
+        self.partitions = {field: {} for field in TENANT_FIELDS}
+        self.slot_tenants = {}
+        self._partition_rows = {}
+        for slot, tenants in slot_tenants.items():
+            self._tag(slot, tenants)
+    
+    def _partition(self, field, value):
+        """Sorted slot array of one partition (cached until it changes)"""
+        key = (field, str(value))
+        rows = self._partition_rows.get(key)
+        if rows is None:
+            rows = np.array(sorted(self.partitions[field].get(key[1], ())), dtype=np.int64)
+            self._partition_rows[key] = rows
+        return rows
+    
+    def filter_rows(self, filters):
+        """
+        Slots matching a tenant filter such as {"user_id": 5} or {"shop_name": ["A", "B"]}
+        A list of values matches any of them; several fields must all match
+        """
+        rows = None
+        for field, values in filters.items():
+            if field not in TENANT_FIELDS:
+                raise ValueError(f"Unknown filter field: {field} (expected one of {', '.join(TENANT_FIELDS)})")
+            values = values if isinstance(values, (list, tuple)) else [values]
+            matched = [self._partition(field, value) for value in values] or [np.zeros(0, dtype=np.int64)]
+            matched = np.unique(np.concatenate(matched)) if len(matched) > 1 else matched[0]
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+        return rows
+    
+    def _prepare_vector(self, embedding):
+        """Parse, validate and L2-normalize a single embedding"""
+        vector = self.parse_embedding(embedding)
+        if vector.shape != (self.dimensions,):
+            raise ValueError(f"Embedding has {vector.size} dimensions, index expects {self.dimensions}")
+        
+        norm = np.linalg.norm(vector)
+        if not np.isfinite(norm) or norm == 0:
+            raise ValueError("Invalid embedding - zero or non-finite norm")
+        return vector / norm
+    
+    def load(self, entries):
+        """
+        Replace the index contents
+        entries: iterable of {"product_id": int, "embedding": list | JSON string}
+                 or {"product_id": int, "embedding_b64": str, "dtype": "float32" | "float16"}
+                 optionally with "user_id" / "shop_name" (value or list) tenant tags
+        Rows with the wrong dimension, zero norm or non-finite values are skipped
+        """
+        entries = list(entries)
+        matrix = np.zeros((len(entries), self.dimensions), dtype=np.float32)
+        ids = np.full(len(entries), -1, dtype=np.int64)
+        parsed = np.zeros(len(entries), dtype=bool)
+        blob_groups = {}
+        
+        for pos, entry in enumerate(entries):
+            try:
+                ids[pos] = int(entry["product_id"])
+                if entry.get("embedding_b64") is not None:
+                    # Binary blobs are decoded together below
+                    blob_groups.setdefault(entry.get("dtype", "float32"), []).append(pos)
+                    continue
+                vector = entry_vector(entry)
+            except (KeyError, TypeError, ValueError):
+                continue
+            
+            if vector.shape == (self.dimensions,):
+                matrix[pos] = vector
+                parsed[pos] = True
+        
+        for dtype, positions in blob_groups.items():
+            try:
+                matrix[positions] = load_embedding_matrix(
+                    [entries[pos]["embedding_b64"] for pos in positions], dtype, self.dimensions
+                )
+                parsed[positions] = True
+            except ValueError:
+                # A malformed blob in the group; fall back to one at a time
+                for pos in positions:
+                    try:
+                        matrix[pos] = decode_embedding(entries[pos]["embedding_b64"], dtype, self.dimensions)
+                        parsed[pos] = True
+                    except ValueError:
+                        continue
+        
+        rows = matrix[parsed]
+        valid = parsed.copy()
+        valid[parsed] = self.normalize_rows(rows)
+        matrix[parsed] = rows
+        positions = np.flatnonzero(valid)
+        ids = ids[valid]
+        matrix = matrix[valid]
+        
+        # Later duplicates win, matching upsert semantics
+        _, last = np.unique(ids[::-1], return_index=True)
+        keep = np.sort(len(ids) - 1 - last)
+        
+        self._reset(0)
+        self._place(np.ascontiguousarray(matrix[keep]))
+        self.slot_ids = ids[keep].copy()
+        self.size = len(keep)
+        self.id_to_slot = {int(pid): slot for slot, pid in enumerate(self.slot_ids)}
+        for slot, pos in enumerate(positions[keep]):
+            tenants = self.entry_tenants(entries[pos])
+            if tenants:
+                self._tag(slot, tenants)
+        self._rebuild_codes()
+        self._refresh_ann(retrain=True)
+        
+        return {"loaded": len(self), "skipped": len(entries) - len(self)}
+    
+    def _grow(self):
+        """Double the matrix capacity (amortized O(1) per insert)"""
+        new_capacity = max(MIN_CAPACITY, self.capacity * 2)
+        matrix, spill_file = self._allocate(new_capacity)
+        matrix[:self.size] = self.matrix[:self.size]
+        slot_ids = np.full(new_capacity, -1, dtype=np.int64)
+        slot_ids[:self.size] = self.slot_ids[:self.size]
+        
+        if self.quantization is not None:
+            codes = np.zeros((new_capacity, self.dimensions), dtype=self.codes.dtype)
+            codes[:self.size] = self.codes[:self.size]
+            scales = np.ones(new_capacity, dtype=np.float32)
+            scales[:self.size] = self.scales[:self.size]
+            self.codes = codes
+            self.scales = scales
+        
+        self._use_matrix(matrix, spill_file)
+        self._release_full_precision()
+        self.slot_ids = slot_ids
+        if self.ann is not None:
+            self.ann.grow(new_capacity)
+    
+    def _maybe_shrink(self):
+        """Compact active rows and halve capacity once the matrix is a quarter full"""
+        if self.capacity <= MIN_CAPACITY or len(self) > self.capacity // 4:
+            return
+        
+        active = np.flatnonzero(self.slot_ids[:self.size] >= 0)
+        new_capacity = max(MIN_CAPACITY, self.capacity // 2)
+        matrix, spill_file = self._allocate(new_capacity)
+        matrix[:len(active)] = self.matrix[active]
+        slot_ids = np.full(new_capacity, -1, dtype=np.int64)
+        slot_ids[:len(active)] = self.slot_ids[active]
+        
+        if self.quantization is not None:
+            codes = np.zeros((new_capacity, self.dimensions), dtype=self.codes.dtype)
+            codes[:len(active)] = self.codes[active]
+            scales = np.ones(new_capacity, dtype=np.float32)
+            scales[:len(active)] = self.scales[active]
+            self.codes = codes
+            self.scales = scales
+        
+        self._use_matrix(matrix, spill_file)
+        self._release_full_precision()
+        self.slot_ids = slot_ids
+        self.size = len(active)
+        self.free_slots = []
+        self.id_to_slot = {int(pid): slot for slot, pid in enumerate(slot_ids[:self.size])}
+        new_slot = {int(old): new for new, old in enumerate(active)}
+        self._retag_all({new_slot[slot]: tenants for slot, tenants in self.slot_tenants.items()})
+        # Rows were renumbered; keep the centroids but reassign every slot
+        self._refresh_ann()
+    
+    def _active_mask(self):
+        """Bool mask over the whole matrix of slots holding a product"""
+        return self.slot_ids >= 0
+    
+    def build_ann(self, n_lists=None, nprobe=None):
+        """Train the IVF centroids on the current rows and group them into inverted lists"""
+        if len(self) == 0:
+            raise ValueError("Cannot build an ANN index over an empty index")
+        
+        if n_lists is not None:
+            self.n_lists = n_lists
+        if nprobe is not None:
+            self.nprobe = max(1, int(nprobe))
+        self.ann_mode = self.ann_mode or "ivf"
+        
+        active = self._active_mask()
+        self.ann = IVFIndex(self.dimensions, n_lists=self.n_lists, nprobe=self.nprobe)
+        self.ann.train(self.matrix[np.flatnonzero(active)])
+        self.ann.rebuild(self.matrix, active)
+        self._release_full_precision()
+        return self.ann.stats()
+    
+    def drop_ann(self):
+        """Go back to exact search"""
+        self.ann = None
+        self.ann_mode = None
+    
+    def _refresh_ann(self, retrain=False):
+        """
+        Keep the ANN structure consistent after the rows were replaced or renumbered
+        Builds it once the catalog crosses ANN_MIN_SIZE; a full reload retrains the centroids
+        """
+        if self.ann_mode is None:
+            return
+        if self.ann is None or retrain:
+            self.ann = None
+            if len(self) >= ANN_MIN_SIZE:
+                self.build_ann()
+            return
+        self.ann.rebuild(self.matrix, self._active_mask())
+        self._release_full_precision()
+    
+    def upsert(self, product_id, embedding, tenants=None):
+        """
+        Insert or replace a product's embedding
+        tenants: (field, value) pairs from entry_tenants(); None keeps the current tags
+        Returns True when the product was new to the index
+        """
+        product_id = int(product_id)
+        vector = self._prepare_vector(embedding)
+        
+        slot = self.id_to_slot.get(product_id)
+        if slot is not None:
+            self.matrix[slot] = vector
+            self._set_codes(slot, vector)
+            if tenants is not None:
+                self._tag(slot, tenants)
+            if self.ann is not None:
+                self.ann.assign(slot, vector)
+            return False
+        
+        # Reuse a freed row before appending
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            if self.size == self.capacity:
+                self._grow()
+            slot = self.size
+            self.size += 1
+        
+        self.matrix[slot] = vector
+        self._set_codes(slot, vector)
+        self.slot_ids[slot] = product_id
+        self.id_to_slot[product_id] = slot
+        if tenants:
+            self._tag(slot, tenants)
+        if self.ann is not None:
+            self.ann.assign(slot, vector)
+        elif self.ann_mode is not None and len(self) >= ANN_MIN_SIZE:
+            self.build_ann()
+        return True
+    
+    def retag(self, product_id, tenants):
+        """
+        Replace a product's tenant tags, keeping its vector
+        tenants: (field, value) pairs from entry_tenants() (empty = no partition)
+        Returns False if the product is not indexed
+        """
+        slot = self.id_to_slot.get(int(product_id))
+        if slot is None:
+            return False
+        self._tag(slot, tenants or ())
+        return True
+    
+    def remove(self, product_id):
+        """Remove a product's embedding; returns False if it was not indexed"""
+        slot = self.id_to_slot.pop(int(product_id), None)
+        if slot is None:
+            return False
+        
+        self.matrix[slot] = 0.0
+        if self.quantization is not None:
+            self.codes[slot] = 0
+            self._touch(1)
+        self.slot_ids[slot] = -1
+        self.free_slots.append(slot)
+        self._untag(slot)
+        if self.ann is not None:
+            self.ann.unassign(slot)
+        self._maybe_shrink()
+        return True
+    
+    def search(self, query, top_k=5, min_score=None, nprobe=None, exact=False, filters=None):
+        """
+        Return the top_k most similar products as (product_id, score) pairs
+        Scores are cosine similarities, highest first
+        nprobe: clusters to scan when an ANN index is built (default: the index setting)
+        exact: force a full scan even when an ANN index is built
+        filters: tenant filter (see filter_rows); only that partition's rows are scored
+        """
+        if len(self) == 0 or top_k <= 0:
+            return []
+        
+        query = self.parse_embedding(query)
+        if query.shape != (self.dimensions,):
+            raise ValueError(f"Query has {query.size} dimensions, index expects {self.dimensions}")
+        
+        norm = np.linalg.norm(query)
+        if not np.isfinite(norm) or norm == 0:
+            raise ValueError("Invalid query embedding - zero norm")
+        query = query / norm
+        
+        if filters:
+            # Exact scan of the tenant's rows only - cost follows the shop's catalog size
+            rows = self.filter_rows(filters)
+            scores = self._coarse_scores(query, rows)
+            available = len(rows)
+        elif self.ann is not None and not exact:
+            # Only the rows in the probed clusters (all active) are scored
+            rows = self.ann.candidates(query, nprobe)
+            scores = self._coarse_scores(query, rows)
+            available = len(rows)
+        else:
+            rows = None
+            scores = self._coarse_scores(query)
+            if self.free_slots:
+                scores[self.slot_ids[:self.size] < 0] = -np.inf
+            available = len(self)
+        
+        k = min(top_k, available)
+        if k == 0:
+            return []
+        
+        if self.quantization is not None:
+            # Shortlist on the compact scores, then re-rank with full precision
+            # (sorted rows keep memory-mapped reads sequential)
+            shortlist = np.sort(self._top_rows(scores, min(available, k * self.rerank_factor)))
+            matrix_rows = shortlist if rows is None else rows[shortlist]
+            rescored = np.asarray(self.matrix[matrix_rows]) @ query
+            self._touch(len(matrix_rows))
+            scores = np.full(len(scores), -np.inf, dtype=np.float32)
+            scores[shortlist] = rescored
+        
+        top = self._top_rows(scores, k)
+        
+        results = []
+        for pos in top:
+            score = float(scores[pos])
+            if min_score is not None and score < min_score:
+                break
+            row = pos if rows is None else rows[pos]
+            results.append((int(self.slot_ids[row]), score))
+        
+        return results
+    
+    def _coarse_scores(self, query, rows=None):
+        """
+        Similarity of every row (or only the given rows)
+        A single BLAS call unless quantized
+        """
+        if rows is not None:
+            if self.quantization is None:
+                return np.asarray(self.matrix[rows]) @ query
+            return (self.codes[rows].astype(np.float32) @ query) * self.scales[rows]
+        
+        if self.quantization is None:
+            return self.matrix[:self.size] @ query
+        
+        # Bounded float32 temporaries: convert the compact rows block by block
+        scores = np.empty(self.size, dtype=np.float32)
+        for start in range(0, self.size, SCAN_BLOCK_ROWS):
+            end = min(start + SCAN_BLOCK_ROWS, self.size)
+            scores[start:end] = self.codes[start:end].astype(np.float32) @ query
+        scores *= self.scales[:self.size]
+        return scores
+    
+    @staticmethod
+    def _top_rows(scores, k):
+        """Row numbers of the k highest scores, best first"""
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        return top[np.argsort(-scores[top])]
+    
+    def save_snapshot(self, directory, model_name, watermark=None):
+        """
+        Write the active rows to a snapshot directory
+        watermark: caller's "changed since" marker (e.g. max product_embeddings.created_at)
+        Files are written to temporary names and renamed so readers never see a partial snapshot
+        """
+        os.makedirs(directory, exist_ok=True)
+        active = np.flatnonzero(self.slot_ids[:self.size] >= 0)
+        matrix = np.ascontiguousarray(self.matrix[active], dtype=np.float32)
+        product_ids = self.slot_ids[active].copy()
+        self._release_full_precision()
+        
+        meta = {
+            "model": model_name,
+            "dimensions": self.dimensions,
+            "count": int(len(product_ids)),
+            "saved_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "watermark": watermark
+        }
+        
+        for name, array in ((SNAPSHOT_MATRIX, matrix), (SNAPSHOT_IDS, product_ids)):
+            tmp_path = os.path.join(directory, name + ".tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, os.path.join(directory, name))
+        
+        # Centroids + assignments keyed by product id, so reopening skips k-means
+        ann_path = os.path.join(directory, SNAPSHOT_ANN)
+        if self.ann is not None:
+            self.ann.save(ann_path + ".tmp", self.slot_ids)
+            os.replace(ann_path + ".tmp", ann_path)
+        elif os.path.exists(ann_path):
+            os.remove(ann_path)
+        
+        # Partitions keyed by product id: {field: {value: [product ids]}}
+        tenants = {
+            field: {value: sorted(int(self.slot_ids[slot]) for slot in slots) for value, slots in values.items()}
+            for field, values in self.partitions.items()
+        }
+        tmp_path = os.path.join(directory, SNAPSHOT_TENANTS + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(tenants, f)
+        os.replace(tmp_path, os.path.join(directory, SNAPSHOT_TENANTS))
+        
+        tmp_path = os.path.join(directory, SNAPSHOT_META + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(directory, SNAPSHOT_META))
+        
+        self.snapshot = meta
+        return meta
+    
+    def load_snapshot(self, directory, model_name):
+        """
+        Open a snapshot with np.memmap (copy-on-write)
+        Startup cost is independent of catalog size and the pages are shared
+        through the page cache by every process that opens the same snapshot;
+        only rows that are later upserted/removed become private copies
+        """
+        with open(os.path.join(directory, SNAPSHOT_META)) as f:
+            meta = json.load(f)
+        
+        if meta.get("model") != model_name:
+            raise ValueError(f"Snapshot was built with {meta.get('model')}, service uses {model_name}")
+        if meta.get("dimensions") != self.dimensions:
+            raise ValueError(f"Snapshot has {meta.get('dimensions')} dimensions, index expects {self.dimensions}")
+        
+        matrix = np.load(os.path.join(directory, SNAPSHOT_MATRIX), mmap_mode="c")
+        product_ids = np.load(os.path.join(directory, SNAPSHOT_IDS))
+        if matrix.shape != (len(product_ids), self.dimensions) or matrix.dtype != np.float32:
+            raise ValueError("Snapshot matrix does not match its id array")
+        
+        self._reset(0)
+        # Quantized: copied into a private spill file, since dropping pages of
+        # the copy-on-write snapshot mapping would discard upserted rows
+        self._place(matrix)
+        self.slot_ids = product_ids.astype(np.int64)
+        self.size = len(product_ids)
+        self.id_to_slot = {int(pid): slot for slot, pid in enumerate(self.slot_ids)}
+        self._rebuild_codes()
+        self.snapshot = meta
+        
+        tenants_path = os.path.join(directory, SNAPSHOT_TENANTS)
+        if os.path.exists(tenants_path):
+            with open(tenants_path) as f:
+                tenants = json.load(f)
+            slot_tenants = {}
+            for field, values in tenants.items():
+                if field not in TENANT_FIELDS:
+                    continue
+                for value, product_ids in values.items():
+                    for pid in product_ids:
+                        slot = self.id_to_slot.get(pid)
+                        if slot is not None:
+                            slot_tenants.setdefault(slot, []).append((field, value))
+            self._retag_all({slot: tuple(pairs) for slot, pairs in slot_tenants.items()})
+        
+        ann_path = os.path.join(directory, SNAPSHOT_ANN)
+        if self.ann_mode is not None and os.path.exists(ann_path):
+            self.ann = IVFIndex(self.dimensions, nprobe=self.nprobe)
+            self.ann.load(ann_path, self.id_to_slot, self.matrix, self._active_mask())
+        else:
+            self._refresh_ann(retrain=True)
+        return meta
+    
+    def stats(self):
+        """
+        Summary used by the index_stats action
+        memory_bytes is what the index holds in RAM right now: the compact copy
+        and ids plus the resident pages of the float32 matrix (all of it unless
+        memory-mapped). scan_bytes is what a full scan reads
+        """
+        full_bytes = int(self.matrix.nbytes)
+        mapped = self._spill_file is not None or isinstance(self.matrix, np.memmap)
+        full_resident = resident_bytes(self.matrix) if mapped else full_bytes
+        compact_bytes = int(self.codes.nbytes + self.scales.nbytes) if self.quantization else 0
+        return {
+            "size": len(self),
+            "capacity": self.capacity,
+            "free_slots": len(self.free_slots),
+            "dimensions": self.dimensions,
+            "quantization": self.quantization,
+            "rerank_factor": self.rerank_factor if self.quantization else None,
+            "memory_bytes": full_resident + compact_bytes + int(self.slot_ids.nbytes),
+            "scan_bytes": compact_bytes or full_bytes,
+            "full_precision_bytes": full_bytes,
+            "full_precision_resident_bytes": full_resident,
+            "memory_mapped": mapped,
+            "snapshot": self.snapshot,
+            "partitions": {field: len(values) for field, values in self.partitions.items()},
+            "ann": self.ann.stats() if self.ann is not None else None
+        }
@@ -0,0 +1,53 @@
+const clipServiceManager = require('./clipServiceManager');
+
+/**
+ * Multi-crop (enhanced) CLIP requests for the enhanced routes
+ * Served by the shared persistent CLIP service, so the enhanced routes reuse
+ * the model already loaded for the optimized routes instead of a second copy
+ */
+const enhancedClipServiceManager = {
+  /**
+   * Weighted multi-crop embedding for an image
+   * @param {string} imagePath - Path to the image file
+   * @param {Array<string>} strategies - SmartCropper strategies
+   * @param {Object} options - { budget } seconds for the cropping stage (service default when omitted)
+   * @returns {Promise<Array>} - Weighted average CLIP embedding
+   */
+  async enhancedSearch(imagePath, strategies, options = {}) {
+    const payload = { image_path: imagePath, strategies };
+    if (options.budget !== undefined) {
+      payload.budget = options.budget;
+    }
+    const response = await clipServiceManager.sendAction('enhanced_search', payload, 60000);
+    return response.embedding;
+  },
+  
+  /**
+   * Compare each crop strategy against the original image
+   * @param {string} imagePath - Path to the image file
+   * @param {Array<string>} strategies - SmartCropper strategies (service default when omitted)
+   * @param {Object} options - { budget } seconds for the cropping stage (service default when omitted)
+   * @returns {Promise<Array>} - Strategies ranked by effectiveness score
+   */
+  async analyzeCropping(imagePath, strategies, options = {}) {
+    const payload = { image_path: imagePath, strategies };
+    if (options.budget !== undefined) {
+      payload.budget = options.budget;
+    }
+    const response = await clipServiceManager.sendAction('analyze', payload, 60000);
+    return response.analysis;
+  },
+  
+  /**
+   * Plain CLIP embedding of an image
+   * @param {string} imagePath - Path to the image file
+   * @param {Object} options - { centerFraction } embeds a centered square crop instead
+   * @returns {Promise<Array>} - Normalized CLIP embedding
+   */
+  async embedImage(imagePath, options = {}) {
+    const response = await clipServiceManager.processImage(imagePath, options);
+    return response.embedding;
+  }
+};
+
+module.exports = enhancedClipServiceManager;
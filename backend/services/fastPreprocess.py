@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Fast CLIP Image Preprocessing
+Does what CLIPImageProcessor does (shortest-edge bicubic resize, center crop,
+rescale, normalize) with one PIL resize, a NumPy slice and a fused
+scale/offset written straight into a reusable float32 batch buffer.
+JPEGs can also be decoded at a reduced DCT scale (PIL draft mode), so large
+photos are never fully decoded just to be shrunk to 224 pixels
+"""
+
+import io
+import math
+import threading
+import numpy as np
+import torch
+from PIL import Image
+
+class FastPreprocessor:
+    def __init__(self, processor):
+        """
+        processor: the CLIPImageProcessor whose configuration is reproduced
+        Raises ValueError for configurations this fast path does not cover
+        """
+        size = getattr(processor, "size", None) or {}
+        crop_size = getattr(processor, "crop_size", None) or {}
+        if "shortest_edge" not in size or "height" not in crop_size or "width" not in crop_size:
+            raise ValueError(f"Unsupported image processor sizes: size={size}, crop_size={crop_size}")
+        if not (processor.do_resize and processor.do_center_crop and processor.do_rescale and processor.do_normalize):
+            raise ValueError("Image processor skips a resize/crop/rescale/normalize step")
+        
+        self.shortest_edge = int(size["shortest_edge"])
+        self.crop_height = int(crop_size["height"])
+        self.crop_width = int(crop_size["width"])
+        self.resample = int(processor.resample)
+        
+        # (x * rescale - mean) / std folded into a single multiply-add per channel
+        mean = np.asarray(processor.image_mean, dtype=np.float32)
+        std = np.asarray(processor.image_std, dtype=np.float32)
+        self.scale = (np.float32(processor.rescale_factor) / std).reshape(3, 1, 1)
+        self.offset = (mean / std).reshape(3, 1, 1)
+        
+        # Reduced-scale JPEG decoding; switched off when it drifts from a full decode
+        self.draft = True
+        
+        # One growing batch buffer per thread (decode threads preprocess concurrently)
+        self._local = threading.local()
+    
+    def decode(self, data, center_fraction=None):
+        """
+        RGB PIL image from encoded bytes; JPEGs are decoded at the smallest DCT
+        scale that still leaves the (center-cropped) shortest edge above the target
+        """
+        image = Image.open(io.BytesIO(data))
+        if self.draft and image.format == "JPEG":
+            needed = math.ceil(self.shortest_edge / float(center_fraction or 1.0))
+            image.draft("RGB", (needed, needed))
+        return image.convert("RGB")
+    
+    def _resized(self, image):
+        """Resize so the shortest edge matches, then center-crop (uint8 HWC array)"""
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        
+        width, height = image.size
+        short, long = (width, height) if width <= height else (height, width)
+        new_short, new_long = self.shortest_edge, int(self.shortest_edge * long / short)
+        new_size = (new_short, new_long) if width <= height else (new_long, new_short)
+        if new_size != image.size:
+            image = image.resize(new_size, resample=self.resample)
+        
+        pixels = np.asarray(image)
+        top = (pixels.shape[0] - self.crop_height) // 2
+        left = (pixels.shape[1] - self.crop_width) // 2
+        if top < 0 or left < 0:
+            # Smaller than the crop (extreme aspect ratios): pad with zeros like the processor
+            padded = np.zeros((max(pixels.shape[0], self.crop_height), max(pixels.shape[1], self.crop_width), 3),
+                              dtype=np.uint8)
+            pad_top = (padded.shape[0] - pixels.shape[0]) // 2
+            pad_left = (padded.shape[1] - pixels.shape[1]) // 2
+            padded[pad_top:pad_top + pixels.shape[0], pad_left:pad_left + pixels.shape[1]] = pixels
+            pixels = padded
+            top = (pixels.shape[0] - self.crop_height) // 2
+            left = (pixels.shape[1] - self.crop_width) // 2
+        return pixels[top:top + self.crop_height, left:left + self.crop_width]
+    
+    def _batch_buffer(self, count, reuse):
+        shape = (count, 3, self.crop_height, self.crop_width)
+        if not reuse:
+            return np.empty(shape, dtype=np.float32)
+        
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None or buffer.shape[0] < count:
+            buffer = np.empty(shape, dtype=np.float32)
+            self._local.buffer = buffer
+        return buffer[:count]
+    
+    def __call__(self, images, reuse=True):
+        """
+        (N, 3, H, W) float32 pixel tensor for a list of PIL images
+        reuse=True writes into this thread's buffer, which the next call overwrites;
+        pass reuse=False when the tensor is kept past the next call
+        """
+        batch = self._batch_buffer(len(images), reuse)
+        for i, image in enumerate(images):
+            pixels = self._resized(image).transpose(2, 0, 1)
+            np.multiply(pixels, self.scale, out=batch[i])
+            batch[i] -= self.offset
+        return torch.from_numpy(batch)
+
+def compare_with_processor(fast, processor, images):
+    """Largest absolute pixel difference between the fast path and CLIPImageProcessor"""
+    expected = processor(images=images, return_tensors="pt")["pixel_values"].cpu().numpy()
+    actual = fast(images, reuse=False).numpy()
+    if expected.shape != actual.shape:
+        return float("inf")
+    return float(np.abs(expected - actual).max())
+
+def compare_decode_with_processor(fast, processor, images, quality=95):
+    """
+    Mean absolute pixel difference between fast.decode + the fast path and
+    CLIPImageProcessor on the fully decoded image, for the same JPEG bytes
+    Images are enlarged first so the reduced-scale decode actually kicks in
+    """
+    encoded = []
+    for image in images:
+        width, height = image.size
+        factor = 4.0 * fast.shortest_edge / min(width, height)
+        if factor > 1:
+            image = image.resize((round(width * factor), round(height * factor)), resample=Image.BICUBIC)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality)
+        encoded.append(buffer.getvalue())
+    
+    full = [Image.open(io.BytesIO(data)).convert("RGB") for data in encoded]
+    expected = processor(images=full, return_tensors="pt")["pixel_values"].cpu().numpy()
+    actual = fast([fast.decode(data) for data in encoded], reuse=False).numpy()
+    if expected.shape != actual.shape:
+        return float("inf")
+    return float(np.abs(expected - actual).mean())
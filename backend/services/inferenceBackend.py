@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Pluggable CPU Inference Backends for the CLIP Vision Tower
+All backends wrap CLIPVisionModelWithProjection and expose
+get_image_features(pixel_values=...) like CLIPModel, so the service and the
+multi-crop pipeline can use any of them unchanged:
+- torch: the eager PyTorch model (optionally dynamic int8 Linear layers)
+- torchscript: the vision tower traced, frozen and optimized for inference
+- onnx: the vision tower exported to ONNX and run by ONNX Runtime with full
+  graph optimizations (optionally dynamic int8 weights)
+Exports are written once per model to an export directory and reused
+"""
+
+import os
+import re
+import sys
+import numpy as np
+import torch
+
+BACKENDS = ("torch", "torchscript", "onnx")
+
+# Input resolution of the CLIP ViT vision tower (used for the export example)
+IMAGE_SIZE = 224
+
+# ONNX opset for the export
+ONNX_OPSET = 17
+
+def image_features(model, pixel_values):
+    """Projected image features (image_embeds) of a CLIPVisionModelWithProjection"""
+    # Tuple output keeps the model traceable for TorchScript/ONNX
+    return model(pixel_values=pixel_values, return_dict=False)[0]
+
+class VisionFeatures(torch.nn.Module):
+    """The vision tower as a module with a single tensor output: pixel_values -> image features"""
+    
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+    
+    def forward(self, pixel_values):
+        return image_features(self.model, pixel_values)
+
+def _export_path(export_dir, model_name, suffix):
+    os.makedirs(export_dir, exist_ok=True)
+    return os.path.join(export_dir, re.sub(r"[^A-Za-z0-9._-]+", "_", model_name) + suffix)
+
+def _example_input(batch_size=2):
+    return torch.zeros(batch_size, 3, IMAGE_SIZE, IMAGE_SIZE)
+
+def _log(message):
+    # stdout carries service responses
+    print(message, file=sys.stderr, flush=True)
+
+class EagerBackend:
+    """The PyTorch model as loaded, optionally with dynamic int8 Linear layers"""
+    
+    def __init__(self, model, int8=False):
+        self.name = "torch-int8" if int8 else "torch"
+        if int8:
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+    
+    def get_image_features(self, pixel_values, **kwargs):
+        with torch.no_grad():
+            return image_features(self.model, pixel_values)
+    
+    def set_num_threads(self, threads):
+        torch.set_num_threads(threads)
+
+class TorchScriptBackend:
+    """Traced and frozen vision tower (saved as <model>-vision[.int8].pt)"""
+    
+    def __init__(self, model, model_name, export_dir, int8=False):
+        self.name = "torchscript-int8" if int8 else "torchscript"
+        path = _export_path(export_dir, model_name, "-vision.int8.pt" if int8 else "-vision.pt")
+        
+        if not os.path.exists(path):
+            _log(f"Tracing CLIP vision tower to {path}")
+            module = VisionFeatures(model).eval()
+            if int8:
+                module = torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+            with torch.no_grad():
+                traced = torch.jit.trace(module, _example_input(), check_trace=False)
+            temp_path = path + ".tmp"
+            torch.jit.save(traced, temp_path)
+            os.replace(temp_path, path)
+        
+        self.module = torch.jit.optimize_for_inference(torch.jit.freeze(torch.jit.load(path).eval()))
+    
+    def get_image_features(self, pixel_values, **kwargs):
+        with torch.no_grad():
+            return self.module(pixel_values)
+    
+    def set_num_threads(self, threads):
+        torch.set_num_threads(threads)
+
+class ONNXBackend:
+    """Vision tower exported to ONNX and run on ONNX Runtime's CPU provider"""
+    
+    def __init__(self, model, model_name, export_dir, int8=False, threads=None):
+        # Imported here: onnxruntime is only needed when this backend is selected
+        import onnxruntime
+        
+        self.ort = onnxruntime
+        self.name = "onnx-int8" if int8 else "onnx"
+        
+        path = _export_path(export_dir, model_name, "-vision.onnx")
+        if not os.path.exists(path):
+            _log(f"Exporting CLIP vision tower to {path}")
+            temp_path = path + ".tmp"
+            with torch.no_grad():
+                torch.onnx.export(
+                    VisionFeatures(model).eval(),
+                    (_example_input(),),
+                    temp_path,
+                    input_names=["pixel_values"],
+                    output_names=["image_embeds"],
+                    dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+                    opset_version=ONNX_OPSET,
+                    do_constant_folding=True
+                )
+            os.replace(temp_path, path)
+        
+        if int8:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            
+            int8_path = _export_path(export_dir, model_name, "-vision.int8.onnx")
+            if not os.path.exists(int8_path):
+                _log(f"Quantizing {path} to int8")
+                temp_path = int8_path + ".tmp"
+                quantize_dynamic(path, temp_path, weight_type=QuantType.QInt8)
+                os.replace(temp_path, int8_path)
+            path = int8_path
+        
+        self.path = path
+        self.session = self._session(threads)
+    
+    def _session(self, threads):
+        options = self.ort.SessionOptions()
+        options.graph_optimization_level = self.ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = threads or 0
+        return self.ort.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+    
+    def get_image_features(self, pixel_values, **kwargs):
+        pixels = np.ascontiguousarray(pixel_values.detach().cpu().numpy(), dtype=np.float32)
+        features = self.session.run(None, {"pixel_values": pixels})[0]
+        return torch.from_numpy(features)
+    
+    def set_num_threads(self, threads):
+        # ONNX Runtime fixes its thread pool when the session is created
+        self.session = self._session(threads)
+
+def create_backend(name, model, model_name, export_dir, int8=False):
+    """Build the named backend around an eval-mode CLIPVisionModelWithProjection"""
+    if name == "torch":
+        return EagerBackend(model, int8)
+    if name == "torchscript":
+        return TorchScriptBackend(model, model_name, export_dir, int8)
+    if name == "onnx":
+        return ONNXBackend(model, model_name, export_dir, int8)
+    raise ValueError(f"Unknown inference backend: {name}")
+
+def cosine_agreement(reference, candidate, pixel_values):
+    """
+    Per-image cosine similarity between two backends' features on the same inputs
+    Returns (min, mean)
+    """
+    expected = reference.get_image_features(pixel_values=pixel_values).detach().cpu().numpy()
+    actual = candidate.get_image_features(pixel_values=pixel_values).detach().cpu().numpy()
+    expected = expected / np.linalg.norm(expected, axis=1, keepdims=True)
+    actual = actual / np.linalg.norm(actual, axis=1, keepdims=True)
+    cosines = np.sum(expected * actual, axis=1)
+    return float(cosines.min()), float(cosines.mean())
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+IVF Approximate Nearest Neighbour Index for CLIP Embeddings
+Clusters the catalog with spherical k-means and only scans the nprobe
+closest clusters per query, so search cost grows with cluster size
+instead of the whole catalog
+"""
+
+import numpy as np
+
+# Rows assigned to centroids per matrix product during build/reassignment
+ASSIGN_BLOCK_ROWS = 8192
+
+# Training sample per centroid (k-means cost grows with sample * n_lists)
+TRAIN_POINTS_PER_LIST = 64
+
+# Inverted lists are regrouped once this share of slots was assigned incrementally
+PENDING_REBUILD_RATIO = 0.1
+
+class IVFIndex:
+    def __init__(self, dimensions=512, n_lists=None, nprobe=8, iterations=10, seed=0):
+        """
+        n_lists: number of clusters (default ~sqrt(N) at build time)
+        nprobe: clusters scanned per query; higher = better recall, slower
+        """
+        self.dimensions = dimensions
+        self.n_lists = n_lists
+        self.nprobe = max(1, int(nprobe))
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None
+        # Cluster of every index slot (-1 = unassigned / free)
+        self.assignments = np.full(0, -1, dtype=np.int32)
+        self.lists = []
+        # Slots assigned since the lists were last rebuilt, per cluster
+        self.pending = {}
+        self.pending_count = 0
+    
+    @property
+    def trained(self):
+        return self.centroids is not None
+    
+    def _assign(self, rows):
+        """Nearest centroid (max cosine) for each row, computed in blocks"""
+        labels = np.empty(len(rows), dtype=np.int32)
+        for start in range(0, len(rows), ASSIGN_BLOCK_ROWS):
+            block = np.asarray(rows[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+            labels[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return labels
+    
+    def train(self, rows):
+        """Spherical k-means on (a sample of) the L2-normalized rows"""
+        rng = np.random.default_rng(self.seed)
+        n_lists = self.n_lists or int(np.sqrt(len(rows)))
+        n_lists = int(max(1, min(n_lists, len(rows))))
+        
+        # A few dozen points per centroid is enough to place it
+        sample_size = min(len(rows), n_lists * TRAIN_POINTS_PER_LIST)
+        sample = np.asarray(rows[np.sort(rng.choice(len(rows), sample_size, replace=False))], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        
+        for _ in range(self.iterations):
+            self.centroids = centroids
+            labels = self._assign(sample)
+            
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=n_lists)
+            
+            # Re-seed empty clusters with random sample points
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+            
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.maximum(norms, 1e-12)
+        
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.n_lists = n_lists
+    
+    def rebuild(self, rows, active):
+        """
+        Assign every slot to a cluster and rebuild the inverted lists
+        rows: (capacity, D) matrix, active: bool mask of used slots
+        """
+        self.assignments = np.full(len(rows), -1, dtype=np.int32)
+        used = np.flatnonzero(active)
+        if len(used):
+            self.assignments[used] = self._assign(rows[used])
+        self._build_lists()
+    
+    def _build_lists(self):
+        """Group slots by cluster (CSR-style: one argsort over assignments)"""
+        used = np.flatnonzero(self.assignments >= 0)
+        order = used[np.argsort(self.assignments[used], kind="stable")]
+        bounds = np.searchsorted(self.assignments[order], np.arange(self.n_lists + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(self.n_lists)]
+        self.pending = {}
+        self.pending_count = 0
+    
+    def grow(self, capacity):
+        """Extend the per-slot assignment array after the index grows"""
+        assignments = np.full(capacity, -1, dtype=np.int32)
+        assignments[:len(self.assignments)] = self.assignments
+        self.assignments = assignments
+    
+    def assign(self, slot, vector):
+        """Place a new or updated slot into its nearest cluster"""
+        label = int(np.argmax(self.centroids @ vector))
+        if self.assignments[slot] == label:
+            return
+        self.assignments[slot] = label
+        self.pending.setdefault(label, []).append(slot)
+        self.pending_count += 1
+        if self.pending_count > max(1024, PENDING_REBUILD_RATIO * len(self.assignments)):
+            self._build_lists()
+    
+    def unassign(self, slot):
+        """Drop a removed slot (stale list entries are filtered at search time)"""
+        self.assignments[slot] = -1
+    
+    def candidates(self, query, nprobe=None):
+        """Slots in the nprobe clusters closest to the (normalized) query"""
+        nprobe = min(self.n_lists, max(1, int(nprobe or self.nprobe)))
+        centroid_scores = self.centroids @ query
+        if nprobe < self.n_lists:
+            probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probes = np.arange(self.n_lists)
+        
+        parts = []
+        for label in probes:
+            parts.append(self.lists[label])
+            if label in self.pending:
+                parts.append(np.asarray(self.pending[label], dtype=np.int64))
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        
+        slots = np.concatenate(parts)
+        if self.pending:
+            # A slot moved away and back can sit in both its list and the pending list
+            slots = np.unique(slots)
+        
+        # Skip slots that were removed or moved to another cluster since the last rebuild
+        # (the extra last entry is what unassigned slots, label -1, index into)
+        probed = np.zeros(self.n_lists + 1, dtype=bool)
+        probed[probes] = True
+        return slots[probed[self.assignments[slots]]]
+    
+    def save(self, path, slot_ids):
+        """Persist centroids and assignments keyed by product id"""
+        used = np.flatnonzero((self.assignments >= 0) & (slot_ids[:len(self.assignments)] >= 0))
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                product_ids=slot_ids[used],
+                labels=self.assignments[used]
+            )
+    
+    def load(self, path, id_to_slot, rows, active):
+        """
+        Restore centroids and assignments saved by save()
+        Products the file does not know about are assigned to their nearest centroid
+        """
+        with np.load(path) as data:
+            self.centroids = np.ascontiguousarray(data["centroids"], dtype=np.float32)
+            self.n_lists = len(self.centroids)
+            product_ids = data["product_ids"]
+            labels = data["labels"]
+        
+        if self.centroids.shape[1] != self.dimensions:
+            raise ValueError(f"IVF centroids have {self.centroids.shape[1]} dimensions, index expects {self.dimensions}")
+        
+        self.assignments = np.full(len(rows), -1, dtype=np.int32)
+        for pid, label in zip(product_ids.tolist(), labels.tolist()):
+            slot = id_to_slot.get(pid)
+            if slot is not None:
+                self.assignments[slot] = label
+        
+        missing = np.flatnonzero(active & (self.assignments < 0))
+        if len(missing):
+            self.assignments[missing] = self._assign(rows[missing])
+        self._build_lists()
+    
+    def stats(self):
+        sizes = [len(lst) for lst in self.lists]
+        return {
+            "type": "ivf",
+            "n_lists": self.n_lists,
+            "nprobe": self.nprobe,
+            "mean_list_size": float(np.mean(sizes)) if sizes else 0.0,
+            "max_list_size": int(max(sizes)) if sizes else 0,
+            "pending": self.pending_count
+        }
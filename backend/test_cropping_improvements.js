@@ -141,21 +141,21 @@ function testOriginalCLIP(imagePath) {
 import torch
 import numpy as np
 from PIL import Image
-from transformers import CLIPProcessor, CLIPModel
+from transformers import CLIPImageProcessor, CLIPVisionModelWithProjection
 import json
 import sys
 
 try:
-    # Load CLIP model
-    model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-    processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+    # Load the CLIP vision tower only (no text tower or tokenizer)
+    model = CLIPVisionModelWithProjection.from_pretrained("openai/clip-vit-base-patch32")
+    processor = CLIPImageProcessor.from_pretrained("openai/clip-vit-base-patch32")
     
     # Process image normally (no cropping)
     image = Image.open("${imagePath}").convert('RGB')
     inputs = processor(images=image, return_tensors="pt")
     
     with torch.no_grad():
-        features = model.get_image_features(**inputs)
+        features = model(**inputs).image_embeds
         features = features / features.norm(dim=-1, keepdim=True)
         embedding = features.cpu().numpy().flatten().tolist()
     
@@ -3,6 +3,7 @@ const { spawn } = require('child_process');
 const path = require('path');
 const fs = require('fs');
 const db = require('./config/db');
+const { embeddingTextColumns, embeddingFromRow } = require('./utils/embeddingBlob');
 const https = require('https');
 
 async function testRealCroppingImprovement() {
@@ -172,18 +173,18 @@ except Exception as e:
 import torch
 import numpy as np
 from PIL import Image
-from transformers import CLIPProcessor, CLIPModel
+from transformers import CLIPImageProcessor, CLIPVisionModelWithProjection
 import json
 
 try:
-    model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-    processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+    model = CLIPVisionModelWithProjection.from_pretrained("openai/clip-vit-base-patch32")
+    processor = CLIPImageProcessor.from_pretrained("openai/clip-vit-base-patch32")
     
     image = Image.open("${imagePath}").convert('RGB')
     inputs = processor(images=image, return_tensors="pt")
     
     with torch.no_grad():
-        features = model.get_image_features(**inputs)
+        features = model(**inputs).image_embeds
         features = features / features.norm(dim=-1, keepdim=True)
         embedding = features.cpu().numpy().flatten().tolist()
     
@@ -246,7 +247,7 @@ async function searchSimilarProductsReal(queryEmbedding, topK = 10) {
     const [embeddings] = await db.query(`
       SELECT 
         pe.product_id,
-        CAST(pe.embedding AS CHAR(100000)) as embedding_text,
+        ${await embeddingTextColumns()},
         p.product_name,
         IFNULL(p.brand, '') as brand,
         IFNULL(p.variety, '') as variety,
@@ -260,13 +261,11 @@ async function searchSimilarProductsReal(queryEmbedding, topK = 10) {
     
     for (const row of embeddings) {
       try {
-        let embeddingText = row.embedding_text.trim();
-        if (embeddingText.endsWith('...')) {
+        const productEmbedding = embeddingFromRow(row);
+        if (!productEmbedding) {
           continue;
         }
         
-        const productEmbedding = JSON.parse(embeddingText);
-        
         if (productEmbedding.length !== queryEmbedding.length) {
           continue;
         }
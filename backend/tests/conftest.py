@@ -0,0 +1,14 @@
+"""
+The Python services and cropping utilities are run as scripts from their own
+directories and import their siblings by module name; make both importable
+"""
+
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for subdir in ("services", "utils"):
+    path = os.path.join(BACKEND_DIR, subdir)
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,160 @@
+"""Tests for the replay state of the multi-process worker pool (services/clipWorkerPool.py)"""
+
+import numpy as np
+import pytest
+
+from clipWorkerPool import CLIPWorkerPool
+from embeddingIndex import EmbeddingIndex, TENANT_FIELDS
+
+DIMENSIONS = 8
+MODEL = "test-model"
+
+def apply(index, request):
+    """Apply an index broadcast the way PersistentCLIPService's handlers do"""
+    action = request["action"]
+    if action == "load_index":
+        index.load(request.get("entries") or [])
+    elif action == "load_snapshot":
+        index.load_snapshot(request["directory"], MODEL)
+    elif action == "upsert_embedding":
+        entries = request.get("entries")
+        if entries is None:
+            entries = [{"product_id": request.get("product_id"), "embedding": request.get("embedding"),
+                        **{field: request[field] for field in TENANT_FIELDS if field in request}}]
+        for entry in entries:
+            index.upsert(entry["product_id"], entry["embedding"], EmbeddingIndex.entry_tenants(entry))
+    elif action == "remove_embedding":
+        product_ids = request.get("product_ids")
+        if product_ids is None:
+            product_ids = [request.get("product_id")]
+        for product_id in product_ids:
+            index.remove(product_id)
+    elif action == "update_tags":
+        for entry in request.get("entries") or []:
+            tenants = EmbeddingIndex.entry_tenants(entry)
+            if tenants is not None:
+                index.retag(entry["product_id"], tenants)
+
+def index_state(index):
+    """Product id -> (vector, set of tenant tags)"""
+    state = {}
+    for product_id, slot in index.id_to_slot.items():
+        state[product_id] = (np.asarray(index.matrix[slot]).copy(), set(index.slot_tenants.get(slot, ())))
+    return state
+
+def random_tags(rng):
+    tags = {}
+    if rng.random() < 0.7:
+        tags["user_id"] = int(rng.integers(1, 4))
+    if rng.random() < 0.7:
+        tags["shop_name"] = [f"shop{s}" for s in rng.choice(4, size=int(rng.integers(0, 3)), replace=False)]
+    return tags
+
+def random_request(rng, snapshot_dir):
+    """One broadcast over a small id range, so products are hit repeatedly"""
+    roll = rng.random()
+    product_id = int(rng.integers(1, 12))
+    # Ids arrive as ints or as the strings the routes sometimes send
+    pid = str(product_id) if rng.random() < 0.2 else product_id
+    vector = rng.normal(size=DIMENSIONS).tolist()
+    if roll < 0.35:
+        # Single upsert, with or without tenant fields
+        return {"action": "upsert_embedding", "product_id": pid, "embedding": vector, **random_tags(rng)}
+    if roll < 0.5:
+        entries = [{"product_id": int(rng.integers(1, 12)), "embedding": rng.normal(size=DIMENSIONS).tolist(),
+                    **random_tags(rng)} for _ in range(int(rng.integers(1, 4)))]
+        return {"action": "upsert_embedding", "entries": entries}
+    if roll < 0.7:
+        if rng.random() < 0.5:
+            return {"action": "remove_embedding", "product_id": pid}
+        return {"action": "remove_embedding", "product_ids": [int(p) for p in rng.integers(1, 12, size=2)]}
+    if roll < 0.93:
+        entries = [{"product_id": int(rng.integers(1, 12)), **random_tags(rng)} for _ in range(int(rng.integers(1, 3)))]
+        return {"action": "update_tags", "entries": entries}
+    if roll < 0.97:
+        entries = [{"product_id": p, "embedding": rng.normal(size=DIMENSIONS).tolist(), **random_tags(rng)}
+                   for p in range(1, 6)]
+        return {"action": "load_index", "entries": entries}
+    return {"action": "load_snapshot", "directory": snapshot_dir}
+
+def startup_index(rng, snapshot_dir):
+    """The index workers are forked with: a tagged catalog, also saved as a snapshot"""
+    index = EmbeddingIndex(dimensions=DIMENSIONS)
+    index.load([{"product_id": p, "embedding": rng.normal(size=DIMENSIONS).tolist(),
+                 "user_id": p % 3, "shop_name": [f"shop{p % 4}"]} for p in range(1, 9)])
+    index.save_snapshot(snapshot_dir, MODEL)
+    return index
+
+def assert_same_index(replayed, direct, rng):
+    expected, actual = index_state(direct), index_state(replayed)
+    assert sorted(actual) == sorted(expected)
+    for product_id, (vector, tags) in expected.items():
+        np.testing.assert_allclose(actual[product_id][0], vector, atol=1e-6)
+        assert actual[product_id][1] == tags, product_id
+    
+    for _ in range(3):
+        query = rng.normal(size=DIMENSIONS).tolist()
+        for filters in (None, {"user_id": 1}, {"shop_name": ["shop0", "shop2"]}):
+            found = replayed.search(query, top_k=20, filters=filters)
+            wanted = direct.search(query, top_k=20, filters=filters)
+            assert [pid for pid, _ in found] == [pid for pid, _ in wanted]
+            np.testing.assert_allclose([s for _, s in found], [s for _, s in wanted], atol=1e-6)
+
+def replay_into_fresh_worker(pool, snapshot_dir):
+    # A replacement worker is forked from the startup state, then replayed into
+    worker_index = EmbeddingIndex(dimensions=DIMENSIONS)
+    worker_index.load_snapshot(snapshot_dir, MODEL)
+    for request in pool._replay_requests():
+        apply(worker_index, request)
+    return worker_index
+
+@pytest.mark.parametrize("seed", range(40))
+def test_replay_matches_applying_every_broadcast(seed, tmp_path):
+    rng = np.random.default_rng(seed)
+    snapshot_dir = str(tmp_path / "snapshot")
+    direct = startup_index(rng, snapshot_dir)
+    pool = CLIPWorkerPool(service=None, workers=1)
+    
+    for step in range(60):
+        request = random_request(rng, snapshot_dir)
+        apply(direct, request)
+        pool._remember(request)
+        if step % 10 == 9:
+            assert_same_index(replay_into_fresh_worker(pool, snapshot_dir), direct, rng)
+    assert_same_index(replay_into_fresh_worker(pool, snapshot_dir), direct, rng)
+
+def test_replay_edge_cases(tmp_path):
+    rng = np.random.default_rng(100)
+    snapshot_dir = str(tmp_path / "snapshot")
+    direct = startup_index(rng, snapshot_dir)
+    pool = CLIPWorkerPool(service=None, workers=1)
+    vector = lambda: rng.normal(size=DIMENSIONS).tolist()
+    
+    sequence = [
+        # Retag, then an upsert without tenant fields keeps the new tags
+        {"action": "update_tags", "entries": [{"product_id": 1, "user_id": 7, "shop_name": ["late"]}]},
+        {"action": "upsert_embedding", "product_id": 1, "embedding": vector()},
+        # Tags for a product that only arrives afterwards, untagged
+        {"action": "update_tags", "entries": [{"product_id": 20, "user_id": 5}]},
+        {"action": "upsert_embedding", "product_id": 20, "embedding": vector()},
+        # Removed and re-added without tenant fields: no tags, even though the startup copy had some
+        {"action": "remove_embedding", "product_id": 2},
+        {"action": "upsert_embedding", "product_id": "2", "embedding": vector()},
+        # Removed for good
+        {"action": "remove_embedding", "product_ids": [3, 4]},
+        {"action": "upsert_embedding", "entries": [{"product_id": 4, "embedding": vector(), "shop_name": "back"}]},
+    ]
+    for request in sequence:
+        apply(direct, request)
+        pool._remember(request)
+    assert_same_index(replay_into_fresh_worker(pool, snapshot_dir), direct, rng)
+    
+    # A full load resets the history; later updates are replayed on top of it
+    for request in [
+        {"action": "load_index", "entries": [{"product_id": 1, "embedding": vector(), "user_id": 1}]},
+        {"action": "upsert_embedding", "product_id": 9, "embedding": vector(), "shop_name": ["x"]},
+    ]:
+        apply(direct, request)
+        pool._remember(request)
+    assert [request["action"] for request in pool._replay_requests()] == ["load_index", "upsert_embedding"]
+    assert_same_index(replay_into_fresh_worker(pool, snapshot_dir), direct, rng)
@@ -0,0 +1,138 @@
+"""Tests for the in-memory catalog index (services/embeddingIndex.py)"""
+
+import json
+
+import numpy as np
+import pytest
+
+from embeddingIndex import EmbeddingIndex
+
+DIMENSIONS = 8
+
+def random_entries(rng, count, start_id=1):
+    return [{"product_id": start_id + i, "embedding": rng.normal(size=DIMENSIONS).tolist()}
+            for i in range(count)]
+
+def brute_force(entries, query, top_k, min_score=None):
+    """Reference top-K by cosine similarity over the raw entries"""
+    query = np.asarray(query, dtype=np.float64)
+    query = query / np.linalg.norm(query)
+    scored = []
+    for entry in entries:
+        vector = np.asarray(entry["embedding"], dtype=np.float64)
+        scored.append((entry["product_id"], float(vector @ query / np.linalg.norm(vector))))
+    scored.sort(key=lambda pair: -pair[1])
+    if min_score is not None:
+        scored = [pair for pair in scored if pair[1] >= min_score]
+    return scored[:top_k]
+
+def test_load_normalizes_rows():
+    rng = np.random.default_rng(0)
+    index = EmbeddingIndex(dimensions=DIMENSIONS)
+    entries = random_entries(rng, 5)
+    entries[0]["embedding"] = [v * 100 for v in entries[0]["embedding"]]
+    entries[1]["embedding"] = json.dumps(entries[1]["embedding"])
+
+    assert index.load(entries) == {"loaded": 5, "skipped": 0}
+    norms = np.linalg.norm(index.matrix[:index.size], axis=1)
+    np.testing.assert_allclose(norms, 1.0, rtol=1e-5)
+
+    # Scores are cosines, so a row matches its own direction with ~1.0
+    product_id, score = index.search(entries[0]["embedding"], top_k=1)[0]
+    assert product_id == 1
+    assert score == pytest.approx(1.0, abs=1e-5)
+
+def test_load_skips_wrong_dimension_and_zero_norm():
+    rng = np.random.default_rng(1)
+    index = EmbeddingIndex(dimensions=DIMENSIONS)
+    entries = random_entries(rng, 4)
+    entries[1]["embedding"] = entries[1]["embedding"][:-1]
+    entries[2]["embedding"] = [0.0] * DIMENSIONS
+    entries[3]["embedding"] = [float("nan")] + entries[3]["embedding"][1:]
+
+    assert index.load(entries) == {"loaded": 1, "skipped": 3}
+    assert index.product_ids.tolist() == [1]
+
+def test_search_matches_brute_force():
+    rng = np.random.default_rng(2)
+    index = EmbeddingIndex(dimensions=DIMENSIONS)
+    entries = random_entries(rng, 200)
+    index.load(entries)
+
+    for _ in range(20):
+        query = rng.normal(size=DIMENSIONS).tolist()
+        expected = brute_force(entries, query, top_k=10)
+        results = index.search(query, top_k=10)
+        assert [pid for pid, _ in results] == [pid for pid, _ in expected]
+        np.testing.assert_allclose([s for _, s in results], [s for _, s in expected], atol=1e-5)
+
+def test_search_min_score():
+    rng = np.random.default_rng(3)
+    index = EmbeddingIndex(dimensions=DIMENSIONS)
+    entries = random_entries(rng, 100)
+    index.load(entries)
+
+    query = rng.normal(size=DIMENSIONS).tolist()
+    expected = brute_force(entries, query, top_k=50, min_score=0.3)
+    results = index.search(query, top_k=50, min_score=0.3)
+    assert [pid for pid, _ in results] == [pid for pid, _ in expected]
+    assert all(score >= 0.3 for _, score in results)
+    assert index.search(query, top_k=50, min_score=1.01) == []
+
+def test_empty_index():
+    index = EmbeddingIndex(dimensions=DIMENSIONS)
+    assert index.search([1.0] * DIMENSIONS, top_k=5) == []
+
+    assert index.load([]) == {"loaded": 0, "skipped": 0}
+    assert len(index) == 0
+    assert index.product_ids.tolist() == []
+    assert index.search([1.0] * DIMENSIONS, top_k=5) == []
+
+@pytest.mark.parametrize("quantization", [None, "int8"])
+def test_interleaved_upserts_and_removes_match_reference(quantization):
+    rng = np.random.default_rng(4)
+    # A re-rank shortlist covering every row keeps int8 results exact
+    index = EmbeddingIndex(dimensions=DIMENSIONS, quantization=quantization, rerank_factor=1000)
+    reference = {}
+    shops = {}
+    capacities = set()
+
+    for step in range(1500):
+        # Grow to ~150 products, then shrink back down so the matrix halves
+        grow = step < 700
+        if reference and rng.random() < (0.3 if grow else 0.75):
+            product_id = int(rng.choice(list(reference)))
+            assert index.remove(product_id)
+            del reference[product_id]
+            del shops[product_id]
+        else:
+            product_id = int(rng.integers(1, 400))
+            vector = rng.normal(size=DIMENSIONS)
+            shop = f"shop{rng.integers(3)}"
+            is_new = index.upsert(product_id, vector.tolist(), tenants=(("shop_name", shop),))
+            assert is_new == (product_id not in reference)
+            reference[product_id] = vector / np.linalg.norm(vector)
+            shops[product_id] = shop
+        capacities.add(index.capacity)
+
+        assert sorted(index.product_ids.tolist()) == sorted(reference)
+        assert len(index) == len(reference)
+        assert {int(pid): slot for slot, pid in enumerate(index.slot_ids[:index.size]) if pid >= 0} == index.id_to_slot
+
+        if step % 10 == 0 and reference:
+            query = rng.normal(size=DIMENSIONS)
+            query /= np.linalg.norm(query)
+            ids = np.array(list(reference))
+            scores = np.array([reference[pid] @ query for pid in ids])
+            expected = ids[np.argsort(-scores)][:5].tolist()
+            assert [pid for pid, _ in index.search(query.tolist(), top_k=5)] == expected
+
+            # Partitions follow the slots through compaction
+            for shop in ("shop0", "shop1", "shop2"):
+                members = [pid for pid in reference if shops[pid] == shop]
+                found = index.search(query.tolist(), top_k=len(reference), filters={"shop_name": shop})
+                assert sorted(pid for pid, _ in found) == sorted(members)
+
+    # Capacity doubled past MIN_CAPACITY and was halved again on the way down
+    assert max(capacities) >= 128
+    assert index.capacity < max(capacities)
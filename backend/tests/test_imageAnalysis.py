@@ -0,0 +1,27 @@
+"""Tests for the shared per-image analysis (utils/imageAnalysis.py)"""
+
+import cv2
+import numpy as np
+
+from imageAnalysis import ImageAnalysis, union_box
+
+def test_mser_boxes_match_region_bounding_rects():
+    rng = np.random.default_rng(0)
+    # Upsampled noise: smooth blobs of every size, a few hundred MSER regions
+    noise = cv2.cvtColor(rng.integers(0, 256, (20, 30), dtype=np.uint8), cv2.COLOR_GRAY2BGR)
+    image = cv2.resize(noise, (300, 200), interpolation=cv2.INTER_CUBIC)
+    analysis = ImageAnalysis(image)
+    
+    for map_name, source in (('gray', analysis.gray), ('gradient', analysis.gradient())):
+        regions, _ = cv2.MSER_create().detectRegions(source)
+        assert len(regions)
+        
+        # The per-region loop the text strategies used before
+        rects = [cv2.boundingRect(region.reshape(-1, 1, 2)) for region in regions]
+        boxes = analysis.mser_boxes(map_name)
+        np.testing.assert_array_equal(boxes, np.array(rects, dtype=np.int32))
+        
+        kept = [(x, y, x + w, y + h) for x, y, w, h in rects if 10 < w < 150 and 10 < h < 100]
+        mask = (10 < boxes[:, 2]) & (boxes[:, 2] < 150) & (10 < boxes[:, 3]) & (boxes[:, 3] < 100)
+        assert union_box(boxes[mask]) == (min(b[0] for b in kept), min(b[1] for b in kept),
+                                          max(b[2] for b in kept), max(b[3] for b in kept))
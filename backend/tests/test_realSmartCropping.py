@@ -0,0 +1,67 @@
+"""Tests for the product-specific cropper (utils/realSmartCropping.py)"""
+
+import cv2
+import numpy as np
+import pytest
+
+from imageAnalysis import ImageAnalysis
+from realSmartCropping import ProductSmartCropper
+from workingResolution import make_proxy
+
+def label_photo(side):
+    """Square photo with a row of 20 dark marks 1% of the image tall (printed text)"""
+    image = np.full((side, side, 3), 230, dtype=np.uint8)
+    top = side // 2
+    for i in range(20):
+        left = side // 10 + i * side // 25
+        cv2.rectangle(image, (left, top), (left + side // 100, top + side // 100), (20, 20, 20), -1)
+    return image
+
+@pytest.mark.parametrize("working_size", [1024, 512, None])
+def test_product_type_does_not_follow_camera_resolution(working_size):
+    cropper = ProductSmartCropper()
+    types = set()
+    for side in (700, 1024, 2048, 4096):
+        proxy, scale = make_proxy(label_photo(side), working_size)
+        types.add(cropper.detect_product_type(ImageAnalysis(proxy, scale)))
+    # The marks are ~10 px at the reference size, shorter than the 15 px vertical-line kernel
+    assert types == {'pharmaceutical'}
+
+def loop_merge_text_regions(regions):
+    """The pairwise Python loop merge_text_regions replaced (reference)"""
+    if not regions:
+        return []
+    
+    merged = []
+    sorted_regions = sorted(regions, key=lambda r: r[0])
+    
+    current = sorted_regions[0]
+    
+    for next_region in sorted_regions[1:]:
+        if (current[2] >= next_region[0] - 10):
+            current = (
+                min(current[0], next_region[0]),
+                min(current[1], next_region[1]),
+                max(current[2], next_region[2]),
+                max(current[3], next_region[3])
+            )
+        else:
+            merged.append(current)
+            current = next_region
+    
+    merged.append(current)
+    return merged
+
+def test_merge_text_regions_matches_loop():
+    rng = np.random.default_rng(0)
+    cropper = ProductSmartCropper()
+    for _ in range(3000):
+        # Narrow spans over a small canvas give touching, nested and separate boxes
+        count = int(rng.integers(0, 30))
+        x1 = rng.integers(0, 300, count)
+        y1 = rng.integers(0, 300, count)
+        boxes = [(int(a), int(b), int(a + w), int(b + h)) for a, b, w, h in
+                 zip(x1, y1, rng.integers(0, 40, count), rng.integers(0, 40, count))]
+        
+        expected = np.array(loop_merge_text_regions(boxes)).reshape(-1, 4)
+        np.testing.assert_array_equal(cropper.merge_text_regions(boxes), expected)
@@ -0,0 +1,29 @@
+"""Tests for the time-budgeted strategy selection (utils/strategyBudget.py)"""
+
+import time
+
+import pytest
+
+from strategyBudget import StrategyCostModel
+from strategyRunner import StrategyCancelled
+
+def slow(seconds, error=None):
+    def function():
+        time.sleep(seconds)
+        if error is not None:
+            raise error
+        return 'crop'
+    return function
+
+def test_timed_records_a_completed_run():
+    model = StrategyCostModel(priors={}, smoothing=0.5)
+    assert model.timed('saliency_crop', 2.0, slow(0.05))() == 'crop'
+    assert model.costs['saliency_crop'] == pytest.approx(0.025, abs=0.02)
+
+@pytest.mark.parametrize("error", [StrategyCancelled("cancelled"), ValueError("no contours")])
+def test_timed_records_runs_that_raise(error):
+    model = StrategyCostModel(priors={'product_isolation': 0.01}, smoothing=1.0)
+    with pytest.raises(type(error)):
+        model.timed('product_isolation', 1.0, slow(0.1, error))()
+    # The slow run still raised the estimate
+    assert model.estimate('product_isolation', 1.0) >= 0.1
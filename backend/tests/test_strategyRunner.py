@@ -0,0 +1,66 @@
+"""Tests for the concurrent strategy runner (utils/strategyRunner.py)"""
+
+import threading
+import time
+
+import pytest
+
+from strategyRunner import run_strategies, check_cancelled, BUDGET_SKIPPED, BUDGET_ABORTED
+
+def sleeper(seconds, value):
+    def function():
+        time.sleep(seconds)
+        return value
+    return function
+
+def failing():
+    raise ValueError("no contours")
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_results_keep_task_order(workers):
+    # Later tasks finish first on the pool
+    tasks = [(f"s{i}", sleeper(0.05 * (4 - i), i)) for i in range(4)] + [("bad", failing)]
+    results = run_strategies(tasks, workers=workers)
+    assert [name for name, _, _ in results] == ["s0", "s1", "s2", "s3", "bad"]
+    assert [result for _, result, _ in results] == [0, 1, 2, 3, None]
+    assert results[-1][2] == "no contours"
+
+def test_empty_task_list():
+    assert run_strategies([], workers=2) == []
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_timeout_reports_and_cancels_slow_strategy(workers):
+    stopped = threading.Event()
+    
+    def slow():
+        # Like GrabCut between iterations
+        for _ in range(100):
+            check_cancelled()
+            time.sleep(0.02)
+        return "done"
+    
+    def watched():
+        try:
+            return slow()
+        finally:
+            stopped.set()
+    
+    started = time.monotonic()
+    results = run_strategies([("slow", watched), ("fast", sleeper(0.01, "ok"))], workers=workers, timeout=0.2)
+    assert time.monotonic() - started < 1.5
+    assert results[0] == ("slow", None, "timed out after 0.2s")
+    assert results[1] == ("fast", "ok", None)
+    # The abandoned strategy stops at its next check instead of running on
+    assert stopped.wait(1.0)
+
+def test_timeout_counts_from_start_not_from_queueing():
+    # With one thread the second task waits 0.15 s in the queue, then runs 0.1 s
+    tasks = [("first", sleeper(0.15, 1)), ("second", sleeper(0.1, 2))]
+    assert run_strategies(tasks, workers=1, timeout=0.2) == [("first", 1, None), ("second", 2, None)]
+
+def test_deadline_skips_unstarted_and_aborts_running():
+    deadline = time.monotonic() + 0.2
+    tasks = [("running", sleeper(0.6, 1)), ("queued", sleeper(0.01, 2))]
+    results = run_strategies(tasks, workers=1, deadline=deadline)
+    assert results == [("running", None, BUDGET_ABORTED), ("queued", None, BUDGET_SKIPPED)]
+    assert time.monotonic() - deadline < 0.3
@@ -0,0 +1,32 @@
+"""Tests for the working-resolution box helpers (utils/workingResolution.py)"""
+
+import numpy as np
+
+from workingResolution import pad_box, pad_rect
+
+def original_padding(x, y, w, h, padding_x, padding_y, height, width):
+    """The clamping the strategies used before they found boxes on a proxy"""
+    x = max(0, x - padding_x)
+    y = max(0, y - padding_y)
+    w = min(width - x, w + 2 * padding_x)
+    h = min(height - y, h + 2 * padding_y)
+    return (x, y, x + w, y + h)
+
+def test_pad_rect_keeps_the_original_clamping():
+    rng = np.random.default_rng(0)
+    height, width = 300, 400
+    for _ in range(2000):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        w, h = int(rng.integers(1, width - x + 1)), int(rng.integers(1, height - y + 1))
+        padding_x, padding_y = int(rng.integers(0, 60)), int(rng.integers(0, 60))
+        assert pad_rect(x, y, w, h, padding_x, (height, width), padding_y) == \
+            original_padding(x, y, w, h, padding_x, padding_y, height, width)
+
+def test_pad_rect_widens_at_the_left_and_top_edges():
+    # 10 px from the left edge with 30 px padding: the box keeps its full
+    # 2 * 30 px of extra width, unlike pad_box which loses 20 px of it
+    assert pad_rect(10, 10, 100, 50, 30, (300, 400)) == (0, 0, 160, 110)
+    assert pad_box(10, 10, 110, 60, 30, (300, 400)) == (0, 0, 140, 90)
+    
+    # Away from the edges both grow the box by the padding on every side
+    assert pad_rect(100, 100, 50, 50, 20, (300, 400)) == pad_box(100, 100, 150, 150, 20, (300, 400))
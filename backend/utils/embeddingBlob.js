@@ -0,0 +1,217 @@
+const db = require('../config/db');
+
+// Bytes per value for each supported storage dtype
+const DTYPE_SIZES = { float32: 4, float16: 2 };
+
+let storagePromise = null;
+
+/**
+ * Checks (once per process) how product_embeddings stores vectors
+ * @returns {Promise<{blob: boolean, jsonOptional: boolean}>} - blob: the binary
+ *   columns added by add_embedding_blob_column.sql exist; jsonOptional: the
+ *   JSON column accepts NULL, so a row can hold the blob alone
+ */
+function embeddingStorage() {
+  if (!storagePromise) {
+    storagePromise = db.query(`
+      SELECT COLUMN_NAME as name, IS_NULLABLE as nullable
+      FROM INFORMATION_SCHEMA.COLUMNS
+      WHERE TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME = 'product_embeddings'
+        AND COLUMN_NAME IN ('embedding', 'embedding_blob')
+    `).then(([rows]) => {
+      const columns = new Map(rows.map(row => [row.name, row.nullable]));
+      const blob = columns.has('embedding_blob');
+      return { blob, jsonOptional: blob && columns.get('embedding') === 'YES' };
+    }).catch(error => {
+      console.error('Error checking for embedding_blob column:', error);
+      storagePromise = null;
+      return { blob: false, jsonOptional: false };
+    });
+  }
+  
+  return storagePromise;
+}
+
+/**
+ * Checks (once per process) whether product_embeddings has the binary columns
+ * added by add_embedding_blob_column.sql
+ * @returns {Promise<boolean>} - True if embedding_blob/embedding_dtype exist
+ */
+async function hasEmbeddingBlobColumn() {
+  return (await embeddingStorage()).blob;
+}
+
+/**
+ * SQL condition for rows that hold an embedding in either column
+ * @param {string} alias - Table alias of product_embeddings
+ * @returns {Promise<string>}
+ */
+async function storedEmbeddingCondition(alias = 'pe') {
+  return (await hasEmbeddingBlobColumn())
+    ? `(${alias}.embedding IS NOT NULL OR ${alias}.embedding_blob IS NOT NULL)`
+    : `${alias}.embedding IS NOT NULL`;
+}
+
+/**
+ * Columns for readers that decode rows with embeddingFromRow: the JSON text
+ * plus, when the columns exist, the binary blob and its dtype
+ * @param {string} alias - Table alias of product_embeddings
+ * @returns {Promise<string>}
+ */
+async function embeddingTextColumns(alias = 'pe') {
+  const text = `CAST(${alias}.embedding AS CHAR(100000)) as embedding_text`;
+  return (await hasEmbeddingBlobColumn())
+    ? `${text}, ${alias}.embedding_blob, ${alias}.embedding_dtype`
+    : text;
+}
+
+/**
+ * Converts an embedding array into raw little-endian float32 bytes
+ * @param {Array<number>} embedding - Embedding values
+ * @returns {Buffer} - Raw bytes for the embedding_blob column
+ */
+function toEmbeddingBlob(embedding) {
+  const buffer = Buffer.alloc(embedding.length * DTYPE_SIZES.float32);
+  embedding.forEach((value, i) => buffer.writeFloatLE(value, i * DTYPE_SIZES.float32));
+  return buffer;
+}
+
+/**
+ * Converts one IEEE 754 half-precision value to a number
+ * @param {number} bits - The 16 raw bits
+ * @returns {number}
+ */
+function halfToFloat(bits) {
+  const sign = bits & 0x8000 ? -1 : 1;
+  const exponent = (bits >> 10) & 0x1f;
+  const fraction = bits & 0x3ff;
+  if (exponent === 0) return sign * fraction * 2 ** -24;
+  if (exponent === 0x1f) return fraction ? NaN : sign * Infinity;
+  return sign * (1 + fraction / 1024) * 2 ** (exponent - 15);
+}
+
+/**
+ * Converts embedding_blob bytes back into an embedding array
+ * @param {Buffer} blob - Raw little-endian bytes
+ * @param {string} dtype - 'float32' or 'float16'
+ * @returns {Array<number>}
+ */
+function fromEmbeddingBlob(blob, dtype = 'float32') {
+  const size = DTYPE_SIZES[dtype];
+  if (!size) {
+    throw new Error(`Unknown embedding dtype: ${dtype}`);
+  }
+  
+  const values = new Array(Math.floor(blob.length / size));
+  for (let i = 0; i < values.length; i++) {
+    values[i] = size === 4 ? blob.readFloatLE(i * size) : halfToFloat(blob.readUInt16LE(i * size));
+  }
+  return values;
+}
+
+/**
+ * Embedding of a product_embeddings row read with embeddingTextColumns (or the
+ * raw embedding column): the blob when present, otherwise the JSON text
+ * @param {Object} row - Row with embedding_blob/embedding_dtype and/or embedding_text/embedding
+ * @returns {Array<number>|null} - null for a missing or truncated embedding
+ */
+function embeddingFromRow(row) {
+  if (row.embedding_blob) {
+    return fromEmbeddingBlob(Buffer.from(row.embedding_blob), row.embedding_dtype || 'float32');
+  }
+  
+  const text = row.embedding_text !== undefined ? row.embedding_text : row.embedding;
+  if (Array.isArray(text)) {
+    return text;
+  }
+  if (!text || text.trim().endsWith('...')) {
+    return null;
+  }
+  return JSON.parse(text);
+}
+
+/**
+ * Stores one product's embedding in a single statement, so readers (and the
+ * index sync, which keys on created_at) never see the row half written.
+ * With the binary columns the blob is stored, and the JSON column is left
+ * NULL once add_embedding_blob_column.sql has made it optional
+ * @param {number} productId - Product the embedding belongs to
+ * @param {Array<number>} embedding - Embedding values
+ * @param {Buffer} [embeddingBlob] - The same values as raw float32 bytes, when already at hand
+ */
+async function saveProductEmbedding(productId, embedding, embeddingBlob) {
+  const { blob, jsonOptional } = await embeddingStorage();
+  
+  if (!blob) {
+    await db.query(`
+      INSERT INTO product_embeddings (product_id, embedding, embedding_model, created_at)
+      VALUES (?, ?, 'clip-vit-base-patch32', NOW())
+      ON DUPLICATE KEY UPDATE 
+        embedding = VALUES(embedding),
+        created_at = NOW()
+    `, [productId, JSON.stringify(embedding)]);
+    return;
+  }
+  
+  await db.query(`
+    INSERT INTO product_embeddings (product_id, embedding, embedding_blob, embedding_dtype, embedding_model, created_at)
+    VALUES (?, ?, ?, 'float32', 'clip-vit-base-patch32', NOW())
+    ON DUPLICATE KEY UPDATE 
+      embedding = VALUES(embedding),
+      embedding_blob = VALUES(embedding_blob),
+      embedding_dtype = VALUES(embedding_dtype),
+      created_at = NOW()
+  `, [productId, jsonOptional ? null : JSON.stringify(embedding), embeddingBlob || toEmbeddingBlob(embedding)]);
+}
+
+/**
+ * Tenant tags (owner and stocking shops) for filtered search in the CLIP service
+ * @param {Object} row - Row with optional user_id and newline separated shop_names
+ * @returns {Object} - { user_id, shop_name } for the fields present on the row
+ */
+function tenantFields(row) {
+  const fields = {};
+  if (row.user_id !== undefined) fields.user_id = row.user_id;
+  if (row.shop_names !== undefined) fields.shop_name = row.shop_names ? row.shop_names.split('\n') : [];
+  return fields;
+}
+
+/**
+ * Builds a CLIP service index entry from a product_embeddings row
+ * Prefers the binary blob (sent as base64, decoded with frombuffer in Python)
+ * and falls back to the JSON text column
+ * @param {Object} row - Row with product_id, embedding and optionally embedding_blob/embedding_dtype, user_id, shop_names
+ * @returns {Object} - Entry for load_index / upsert_embedding
+ */
+function toIndexEntry(row) {
+  const dtype = row.embedding_dtype || 'float32';
+  
+  if (row.embedding_blob && DTYPE_SIZES[dtype]) {
+    return {
+      product_id: row.product_id,
+      embedding_b64: Buffer.from(row.embedding_blob).toString('base64'),
+      dtype,
+      ...tenantFields(row)
+    };
+  }
+  
+  return {
+    product_id: row.product_id,
+    embedding: typeof row.embedding === 'string' ? row.embedding : JSON.stringify(row.embedding),
+    ...tenantFields(row)
+  };
+}
+
+module.exports = {
+  embeddingStorage,
+  hasEmbeddingBlobColumn,
+  storedEmbeddingCondition,
+  embeddingTextColumns,
+  toEmbeddingBlob,
+  fromEmbeddingBlob,
+  embeddingFromRow,
+  saveProductEmbedding,
+  tenantFields,
+  toIndexEntry
+};
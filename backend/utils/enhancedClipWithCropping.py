@@ -7,24 +7,35 @@ Combines multiple cropping strategies with CLIP analysis for improved accuracy
 import torch
 import numpy as np
 from PIL import Image
-from transformers import CLIPProcessor, CLIPModel
+from transformers import CLIPImageProcessor, CLIPVisionModelWithProjection
 import json
 import sys
 import cv2
 import os
 import tempfile
 from smartCropping import SmartCropper
+from strategyBudget import STRATEGY_WEIGHTS, DEFAULT_WEIGHT
+from strategyRunner import BUDGET_ERRORS
 
 class EnhancedCLIPWithCropping:
-    def __init__(self, model_name="openai/clip-vit-base-patch32"):
-        """Initialize the enhanced CLIP system with cropping"""
+    def __init__(self, model_name="openai/clip-vit-base-patch32", model=None, processor=None, device=None):
+        """
+        Initialize the enhanced CLIP system with cropping
+        model/processor/device: an already loaded CLIP model to share (e.g. the
+        one hosted by services/clipService.py) instead of loading another copy
+        """
         print("🚀 Loading Enhanced CLIP with Smart Cropping...")
         
-        # Load CLIP model
-        self.model = CLIPModel.from_pretrained(model_name)
-        self.processor = CLIPProcessor.from_pretrained(model_name)
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model.to(self.device)
+        if model is not None and processor is not None:
+            self.model = model
+            self.processor = processor
+            self.device = device or "cpu"
+        else:
+            # Load the CLIP vision tower only (no text tower or tokenizer)
+            self.model = CLIPVisionModelWithProjection.from_pretrained(model_name)
+            self.processor = CLIPImageProcessor.from_pretrained(model_name)
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+            self.model.to(self.device)
         
         # Initialize smart cropper
         self.cropper = SmartCropper()
@@ -34,50 +45,132 @@ class EnhancedCLIPWithCropping:
     
     def get_embedding_from_pil(self, pil_image):
         """Get CLIP embedding from PIL image"""
+        embeddings = self.get_embeddings_from_pil([pil_image])
+        if embeddings is None:
+            return None
+        return embeddings[0].tolist()
+    
+    def get_embeddings_from_pil(self, pil_images):
+        """
+        Get CLIP embeddings for several PIL images with one processor call
+        and one batched forward pass
+        Returns an (N, D) float32 array of normalized embeddings, or None on error
+        """
         try:
-            # Ensure RGB format
-            if pil_image.mode != 'RGB':
-                pil_image = pil_image.convert('RGB')
-            
-            # Process with CLIP
-            inputs = self.processor(images=pil_image, return_tensors="pt").to(self.device)
-            
-            with torch.no_grad():
-                features = self.model.get_image_features(**inputs)
-                # Normalize for cosine similarity
-                features = features / features.norm(dim=-1, keepdim=True)
-                embedding = features.cpu().numpy().flatten().tolist()
-            
-            return embedding
+            return self.embed_inputs(self.crop_inputs(pil_images))
         except Exception as e:
-            print(f"❌ Error getting embedding: {e}")
+            print(f"❌ Error getting embeddings: {e}")
             return None
     
-    def process_multiple_crops(self, image_path, crop_strategies=['center_crop', 'object_detection', 'multi_region']):
+    def embed_images(self, strategies, pil_images):
+        """
+        Embed images in one batch; if the batch fails, embed them one at a time
+        so a bad crop only loses itself and not the original or the other crops
+        Returns (strategies, (N, D) embeddings) of the images that worked (None if none did)
+        """
+        batch = self.get_embeddings_from_pil(pil_images)
+        if batch is not None or len(pil_images) <= 1:
+            return strategies, batch
+        
+        kept, rows = [], []
+        for strategy, image in zip(strategies, pil_images):
+            embedding = self.get_embeddings_from_pil([image])
+            if embedding is None:
+                print(f"   ❌ {strategy}: failed to generate embedding")
+                continue
+            kept.append(strategy)
+            rows.append(embedding[0])
+        return kept, (np.stack(rows) if rows else None)
+    
+    def crop_inputs(self, pil_images):
+        """Processor tensors for several PIL images (no model involved)"""
+        # Ensure RGB format
+        pil_images = [image if image.mode == 'RGB' else image.convert('RGB') for image in pil_images]
+        
+        # Process with CLIP
+        return self.processor(images=pil_images, return_tensors="pt").to(self.device)
+    
+    def prepared_inputs(self, prepared):
+        """
+        crop_inputs for prepare_crops output. Crops the processor rejects are
+        dropped from prepared (strategies and images), so one bad crop cannot
+        fail the whole batch; None when no image is left
+        """
+        try:
+            return self.crop_inputs(prepared['images']) if prepared['images'] else None
+        except Exception:
+            pass
+        
+        kept = []
+        for strategy, image in zip(prepared['strategies'], prepared['images']):
+            try:
+                self.crop_inputs([image])
+                kept.append((strategy, image))
+            except Exception as e:
+                print(f"   ❌ {strategy}: preprocessing failed - {e}")
+        prepared['strategies'] = [strategy for strategy, _ in kept]
+        prepared['images'] = [image for _, image in kept]
+        return self.crop_inputs(prepared['images']) if kept else None
+    
+    def embed_inputs(self, inputs):
+        """One batched forward pass over crop_inputs output: (N, D) float32 normalized embeddings"""
+        with torch.no_grad():
+            # The service's inference backends expose get_image_features;
+            # the standalone vision tower returns image_embeds
+            if hasattr(self.model, "get_image_features"):
+                features = self.model.get_image_features(**inputs)
+            else:
+                features = self.model(**inputs).image_embeds
+            # Normalize for cosine similarity
+            features = features / features.norm(dim=-1, keepdim=True)
+        
+        return features.cpu().numpy().astype(np.float32)
+    
+    def process_multiple_crops(self, image_path, crop_strategies=['center_crop', 'object_detection', 'multi_region'], budget=None):
         """
         Process multiple crops of an image and return all embeddings
         """
+        crops = self.embed_crops(image_path, crop_strategies, budget)
+        
+        return [
+            {'strategy': strategy, 'embedding': embedding.tolist(), 'weight': float(weight)}
+            for strategy, embedding, weight in zip(crops['strategies'], crops['embeddings'], crops['weights'])
+        ]
+    
+    def embed_crops(self, image_path, crop_strategies=['center_crop', 'object_detection', 'multi_region'], budget=None):
+        """
+        Embed the original image plus its crops
+        budget: seconds for the cropping stage (strategies that do not fit are skipped)
+        Returns {'strategies': [N], 'embeddings': (N, D) array, 'weights': (N,) array,
+        'skipped': strategies dropped by the budget}
+        """
+        return self.embed_prepared(self.prepare_crops(image_path, crop_strategies, budget))
+    
+    def prepare_crops(self, image_path, crop_strategies=['center_crop', 'object_detection', 'multi_region'], budget=None):
+        """
+        The original image plus its crops as PIL images, before any embedding
+        (the cropping stage of embed_crops, which needs no model)
+        Returns {'strategies': [N], 'images': [N], 'skipped': strategies dropped by the budget}
+        """
         print(f"🔍 Processing with cropping strategies: {crop_strategies}")
         
         # Get crops using smart cropping
-        crop_results = self.cropper.process_image(image_path, crop_strategies)
+        crop_results = self.cropper.process_image(image_path, crop_strategies, budget=budget)
+        skipped = [crop['strategy'] for crop in crop_results['crops']
+                   if not crop['success'] and crop['error'] in BUDGET_ERRORS]
+        if skipped:
+            print(f"⏱️ Skipped over the time budget: {skipped}")
         
-        embeddings = []
+        # Collect the original plus every crop, then embed them in one batch
+        strategies = []
+        images = []
         
-        # Process original image first
         try:
-            original_image = Image.open(image_path).convert('RGB')
-            original_embedding = self.get_embedding_from_pil(original_image)
-            if original_embedding:
-                embeddings.append({
-                    'strategy': 'original',
-                    'embedding': original_embedding,
-                    'weight': 1.0
-                })
+            images.append(Image.open(image_path).convert('RGB'))
+            strategies.append('original')
         except Exception as e:
             print(f"⚠️ Error processing original image: {e}")
         
-        # Process each crop
         for crop_result in crop_results['crops']:
             if not crop_result['success']:
                 continue
@@ -85,152 +178,159 @@ class EnhancedCLIPWithCropping:
             try:
                 # Convert OpenCV image to PIL
                 crop_image_cv = crop_result['image']
-                crop_image_pil = Image.fromarray(cv2.cvtColor(crop_image_cv, cv2.COLOR_BGR2RGB))
-                
-                # Get embedding
-                embedding = self.get_embedding_from_pil(crop_image_pil)
-                
-                if embedding:
-                    # Assign weights based on strategy effectiveness
-                    weight = self.get_strategy_weight(crop_result['strategy'])
-                    
-                    embeddings.append({
-                        'strategy': crop_result['strategy'],
-                        'embedding': embedding,
-                        'weight': weight
-                    })
-                    
-                    print(f"   ✅ {crop_result['strategy']}: embedding generated (weight: {weight})")
-                else:
-                    print(f"   ❌ {crop_result['strategy']}: failed to generate embedding")
-                    
+                images.append(Image.fromarray(cv2.cvtColor(crop_image_cv, cv2.COLOR_BGR2RGB)))
+                strategies.append(crop_result['strategy'])
             except Exception as e:
                 print(f"   ❌ {crop_result['strategy']}: error - {e}")
         
-        return embeddings
+        return {'strategies': strategies, 'images': images, 'skipped': skipped}
+    
+    def embed_prepared(self, prepared, embeddings=None):
+        """
+        embed_crops output for prepare_crops output
+        embeddings: the images' (N, D) embeddings when they were computed elsewhere
+        (e.g. the service's inference thread); otherwise they are embedded here
+        """
+        strategies = prepared['strategies']
+        skipped = prepared['skipped']
+        batch = embeddings
+        if batch is None and prepared['images']:
+            strategies, batch = self.embed_images(strategies, prepared['images'])
+        if batch is None:
+            for strategy in strategies:
+                print(f"   ❌ {strategy}: failed to generate embedding")
+            return {'strategies': [], 'embeddings': np.zeros((0, 0), dtype=np.float32), 'weights': np.zeros(0),
+                    'skipped': skipped}
+        
+        # Assign weights based on strategy effectiveness
+        weights = np.array([self.get_strategy_weight(strategy) for strategy in strategies])
+        for strategy, weight in zip(strategies, weights):
+            if strategy != 'original':
+                print(f"   ✅ {strategy}: embedding generated (weight: {weight:g})")
+        
+        return {'strategies': strategies, 'embeddings': batch, 'weights': weights, 'skipped': skipped}
     
     def get_strategy_weight(self, strategy):
         """
         Assign weights to different cropping strategies based on their effectiveness
         """
-        weights = {
-            'original': 1.0,
-            'center_crop': 0.8,
-            'object_detection': 0.9,
-            'edge_detection': 0.7,
-            'saliency_crop': 0.8,
-            'text_aware': 0.85,
-            'multi_region_center_80': 0.75,
-            'multi_region_center_60': 0.7,
-            'multi_region_upper_region': 0.6,
-            'multi_region_center_square': 0.65
-        }
-        return weights.get(strategy, 0.5)
+        # Shared with the croppers' time-budget planning (utils/strategyBudget.py)
+        return STRATEGY_WEIGHTS.get(strategy, DEFAULT_WEIGHT)
+    
+    @staticmethod
+    def crop_matrix(query_embeddings, weights=None):
+        """
+        Crop embeddings as an (N, D) float32 array plus an (N,) weight vector
+        Accepts the list of {'embedding', 'weight'} dicts from process_multiple_crops
+        or an array of embeddings with a separate weights argument
+        """
+        if weights is None:
+            embeddings = np.array([emb['embedding'] for emb in query_embeddings], dtype=np.float32)
+            weights = np.array([emb['weight'] for emb in query_embeddings], dtype=np.float32)
+        else:
+            embeddings = np.asarray(query_embeddings, dtype=np.float32)
+            weights = np.asarray(weights, dtype=np.float32)
+        return embeddings.reshape(len(weights), -1), weights
     
-    def compute_weighted_similarity(self, query_embeddings, target_embedding):
+    @staticmethod
+    def weighted_query_vector(embeddings, weights):
+        """
+        Fold the crops into one vector p so that, for any target t,
+        p . t / |t| equals the weighted mean cosine similarity of the crops to t
+        Crops with a zero norm are ignored; returns None if none are usable
+        """
+        norms = np.linalg.norm(embeddings, axis=1)
+        valid = norms > 0
+        total_weight = weights[valid].sum()
+        if total_weight <= 0:
+            return None
+        
+        unit = embeddings[valid] / norms[valid, None]
+        return (weights[valid] @ unit) / total_weight
+    
+    def compute_weighted_similarity(self, query_embeddings, target_embedding, weights=None):
         """
         Compute weighted similarity between multiple query embeddings and a target
+        target_embedding may be a single (D,) vector or an (M, D) catalog matrix;
+        for a matrix all M weighted similarities come from one matrix-vector product
         """
-        if not query_embeddings:
-            return 0.0
+        targets = np.asarray(target_embedding, dtype=np.float32)
+        single = targets.ndim == 1
+        targets = targets.reshape(1, -1) if single else targets
         
-        similarities = []
-        total_weight = 0.0
+        similarities = np.zeros(len(targets), dtype=np.float32)
+        if len(query_embeddings):
+            embeddings, weights = self.crop_matrix(query_embeddings, weights)
+            pooled = self.weighted_query_vector(embeddings, weights)
+            if pooled is not None:
+                target_norms = np.linalg.norm(targets, axis=1)
+                np.divide(targets @ pooled, target_norms, out=similarities, where=target_norms > 0)
         
-        for query_emb in query_embeddings:
-            try:
-                embedding = query_emb['embedding']
-                weight = query_emb['weight']
-                
-                # Compute cosine similarity
-                dot_product = np.dot(embedding, target_embedding)
-                query_norm = np.linalg.norm(embedding)
-                target_norm = np.linalg.norm(target_embedding)
-                
-                if query_norm > 0 and target_norm > 0:
-                    similarity = dot_product / (query_norm * target_norm)
-                    similarities.append(similarity * weight)
-                    total_weight += weight
-                
-            except Exception as e:
-                print(f"⚠️ Error computing similarity: {e}")
-                continue
-        
-        if total_weight > 0:
-            weighted_similarity = sum(similarities) / total_weight
-            return weighted_similarity
-        else:
-            return 0.0
+        return float(similarities[0]) if single else similarities
     
-    def enhanced_search(self, image_path, crop_strategies=['center_crop', 'object_detection', 'multi_region']):
+    def enhanced_search(self, image_path, crop_strategies=['center_crop', 'object_detection', 'multi_region'], budget=None):
         """
         Perform enhanced search using multiple cropping strategies
         """
         print(f"🎯 Enhanced CLIP search for: {os.path.basename(image_path)}")
         
         # Get multiple embeddings from different crops
-        query_embeddings = self.process_multiple_crops(image_path, crop_strategies)
-        
-        if not query_embeddings:
+        return self.pooled_embedding(self.embed_crops(image_path, crop_strategies, budget))
+    
+    def pooled_embedding(self, crops):
+        """Weighted average embedding of embed_crops output (None when nothing was embedded)"""
+        if not crops['strategies']:
             print("❌ No valid embeddings generated")
             return None
         
-        print(f"✅ Generated {len(query_embeddings)} embeddings from different crops")
+        print(f"✅ Generated {len(crops['strategies'])} embeddings from different crops")
         
         # For testing, return the weighted average embedding
         # In production, this would be compared against the database
-        if len(query_embeddings) == 1:
-            return query_embeddings[0]['embedding']
-        
-        # Compute weighted average embedding
-        total_weight = sum(emb['weight'] for emb in query_embeddings)
-        weighted_embedding = []
+        weights = crops['weights']
+        weighted_embedding = (weights @ crops['embeddings']) / weights.sum()
         
-        for i in range(len(query_embeddings[0]['embedding'])):
-            weighted_sum = sum(emb['embedding'][i] * emb['weight'] for emb in query_embeddings)
-            weighted_embedding.append(weighted_sum / total_weight)
-        
-        return weighted_embedding
+        return weighted_embedding.tolist()
     
-    def analyze_cropping_effectiveness(self, image_path, strategies=['center_crop', 'object_detection', 'saliency_crop', 'text_aware']):
+    def analyze_cropping_effectiveness(self, image_path, strategies=['center_crop', 'object_detection', 'saliency_crop', 'text_aware'], budget=None):
         """
         Analyze which cropping strategies work best for a given image
         """
         print(f"📊 Analyzing cropping effectiveness for: {os.path.basename(image_path)}")
         
-        embeddings = self.process_multiple_crops(image_path, strategies)
-        
-        if len(embeddings) < 2:
+        return self.analyze_crops(self.embed_crops(image_path, strategies, budget))
+    
+    def analyze_crops(self, crops):
+        """Crop strategies ranked by similarity to the original times weight (embed_crops output)"""
+        if len(crops['strategies']) < 2:
             print("❌ Not enough embeddings to compare")
             return None
         
         # Compare similarity between different crops and original
-        original_embedding = None
-        for emb in embeddings:
-            if emb['strategy'] == 'original':
-                original_embedding = emb['embedding']
-                break
-        
-        if not original_embedding:
+        if 'original' not in crops['strategies']:
             print("❌ No original embedding found")
             return None
         
+        original = crops['strategies'].index('original')
+        embeddings = crops['embeddings']
+        
+        # Similarity of every crop to the original in one product
+        norms = np.linalg.norm(embeddings, axis=1)
+        similarities = (embeddings @ embeddings[original]) / np.maximum(norms * norms[original], 1e-12)
+        
         analysis = []
         
-        for emb in embeddings:
-            if emb['strategy'] == 'original':
+        for i, strategy in enumerate(crops['strategies']):
+            if i == original:
                 continue
             
-            # Compute similarity to original
-            similarity = np.dot(emb['embedding'], original_embedding) / (
-                np.linalg.norm(emb['embedding']) * np.linalg.norm(original_embedding)
-            )
-            
+            similarity = float(similarities[i])
+            weight = float(crops['weights'][i])
             analysis.append({
-                'strategy': emb['strategy'],
+                'strategy': strategy,
                 'similarity_to_original': similarity,
-                'weight': emb['weight'],
-                'effectiveness_score': similarity * emb['weight']
+                'weight': weight,
+                'effectiveness_score': similarity * weight
             })
         
         # Sort by effectiveness
@@ -274,7 +374,7 @@ def main():
             else:
                 print("❌ Failed to generate enhanced embedding")
                 sys.exit(1)
-                
+        
         elif mode == 'analyze':
             # Analyze cropping effectiveness
             analysis = enhancer.analyze_cropping_effectiveness(image_path)
@@ -287,7 +387,7 @@ def main():
         else:
             print(f"❌ Unknown mode: {mode}")
             sys.exit(1)
-            
+    
     except Exception as e:
         print(f"❌ Error: {e}")
         sys.exit(1)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Per-Image Analysis Context for the Cropping Strategies
+Grayscale, blurred, edge, threshold and contour maps are computed on first
+use and memoized, so strategies running on the same photo share one pass
+over the pixels instead of each converting, blurring and edge-detecting again.
+Safe to share between strategy threads: each map is computed once
+"""
+
+import threading
+import cv2
+import numpy as np
+
+class ImageAnalysis:
+    def __init__(self, image, scale=1.0):
+        """
+        image: OpenCV (BGR) image the strategies look at (usually the working-resolution proxy)
+        scale: original pixels per image pixel, for pixel paddings and thresholds
+        """
+        self.image = image
+        self.scale = scale
+        self.shape = image.shape
+        self._maps = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+    
+    @classmethod
+    def of(cls, image, scale=1.0):
+        """The analysis context for an image (an existing context is returned as is)"""
+        return image if isinstance(image, cls) else cls(image, scale)
+    
+    def _memo(self, key, compute):
+        if key in self._maps:
+            return self._maps[key]
+        
+        # One lock per map: a second thread asking for it waits instead of computing it again
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self._maps:
+                self._maps[key] = compute()
+        return self._maps[key]
+    
+    @property
+    def gray(self):
+        return self._memo('gray', lambda: cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY))
+    
+    def blurred(self, ksize=5):
+        """Gaussian-blurred grayscale"""
+        return self._memo(('blurred', ksize), lambda: cv2.GaussianBlur(self.gray, (ksize, ksize), 0))
+    
+    def edges(self, low=50, high=150, blur=None):
+        """Canny edges of the grayscale, or of its blur with kernel size blur"""
+        source = lambda: self.gray if blur is None else self.blurred(blur)
+        return self._memo(('edges', low, high, blur), lambda: cv2.Canny(source(), low, high))
+    
+    def adaptive_edges(self):
+        """Mean adaptive threshold of the bilateral-filtered grayscale"""
+        def compute():
+            # Bilateral filter reduces noise while keeping edges sharp
+            filtered = cv2.bilateralFilter(self.gray, 9, 75, 75)
+            return cv2.adaptiveThreshold(filtered, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                         cv2.THRESH_BINARY, 11, 2)
+        return self._memo('adaptive_edges', compute)
+    
+    def otsu(self, blur=3):
+        """Otsu threshold of the blurred grayscale"""
+        return self._memo(('otsu', blur), lambda: cv2.threshold(
+            self.blurred(blur), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1])
+    
+    def saliency(self):
+        """Otsu threshold of the spectral-residual saliency map, or None when it fails"""
+        def compute():
+            success, saliency_map = cv2.saliency.StaticSaliencySpectralResidual_create().computeSaliency(self.image)
+            if not success:
+                return None
+            saliency_map = (saliency_map * 255).astype(np.uint8)
+            return cv2.threshold(saliency_map, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+        return self._memo('saliency', compute)
+    
+    def gradient(self):
+        """3x3 morphological gradient of the grayscale (outlines of label text)"""
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+        return self._memo('gradient', lambda: cv2.morphologyEx(self.gray, cv2.MORPH_GRADIENT, kernel))
+    
+    def mser_boxes(self, map_name='gray'):
+        """
+        (N, 4) int32 x, y, w, h bounding boxes of the MSER regions of the
+        grayscale or another single-channel map (e.g. 'gradient'); the boxes
+        detectRegions computes anyway, so no per-region boundingRect is needed
+        """
+        def compute():
+            source = self.gray if map_name == 'gray' else getattr(self, map_name)()
+            _, boxes = cv2.MSER_create().detectRegions(source)
+            return np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        return self._memo(('mser', map_name), compute)
+    
+    def contours(self, map_name, *args):
+        """
+        External contours of one of the binary maps above
+        e.g. contours('edges', 50, 150, 5) for the Canny edges of the 5x5 blur
+        """
+        def compute():
+            binary = getattr(self, map_name)(*args)
+            if binary is None:
+                return ()
+            return cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+        return self._memo(('contours', map_name) + args, compute)
+
+def union_box(boxes):
+    """(x1, y1, x2, y2) enclosing an (N, 4) array of x, y, w, h boxes"""
+    return (int(boxes[:, 0].min()), int(boxes[:, 1].min()),
+            int((boxes[:, 0] + boxes[:, 2]).max()), int((boxes[:, 1] + boxes[:, 3]).max()))
@@ -0,0 +1,53 @@
+const axios = require('axios');
+
+/**
+ * Turns a product image reference (S3/HTTP URL, data URI or local path) into
+ * the image source the CLIP service reads
+ * URLs are downloaded here so the model process never blocks on the network
+ * @param {string} imageData - Products.image_s3_url / Products.image value
+ * @returns {Promise<{imagePath: string}|{base64Data: string}>}
+ */
+async function loadImageSource(imageData) {
+  if (!imageData || imageData.trim() === '') {
+    throw new Error('No image URL');
+  }
+  
+  if (imageData.startsWith('http')) {
+    const response = await axios.get(imageData, { responseType: 'arraybuffer', timeout: 15000 });
+    return { base64Data: Buffer.from(response.data).toString('base64') };
+  }
+  
+  if (imageData.startsWith('data:image')) {
+    return { base64Data: imageData };
+  }
+  
+  return { imagePath: imageData };
+}
+
+/**
+ * Resolves the images of a product batch concurrently
+ * @param {Array<{product_id: number, image_data: string}>} products - Batch rows
+ * @returns {Promise<{items: Array, failures: Array<{product_id: number, error: string}>}>}
+ *   items are ready for clipServiceManager.precomputeBatch()
+ */
+async function loadBatchImageSources(products) {
+  const items = [];
+  const failures = [];
+  
+  const sources = await Promise.allSettled(products.map(product => loadImageSource(product.image_data)));
+  sources.forEach((source, i) => {
+    const { product_id } = products[i];
+    if (source.status === 'fulfilled') {
+      items.push({ product_id, ...source.value });
+    } else {
+      failures.push({ product_id, error: `Image loading failed: ${source.reason.message}` });
+    }
+  });
+  
+  return { items, failures };
+}
+
+module.exports = {
+  loadImageSource,
+  loadBatchImageSources
+};
@@ -10,10 +10,32 @@ from PIL import Image, ImageEnhance, ImageFilter
 import json
 import sys
 import os
+import time
+from workingResolution import WORKING_SIZE, make_proxy, pad_box, pad_rect, scale_box, crop_box, limit_size
+from imageAnalysis import ImageAnalysis, union_box
+from strategyBudget import run_within_budget
+from strategyRunner import StrategyCancelled
+from fastGrabCut import grabcut_foreground, foreground_box
+
+# Longest side product-type detection looks at: its kernel and thresholds are
+# pixels of an image this size, so the type does not follow camera resolution
+DETECTION_SIZE = 1024
 
 class ProductSmartCropper:
-    def __init__(self):
-        """Initialize with product-specific cropping strategies"""
+    def __init__(self, working_size=WORKING_SIZE, workers=1, strategy_timeout=None, grabcut_mode='fast'):
+        """
+        Initialize with product-specific cropping strategies
+        working_size: longest side of the proxy the crop boxes are found on
+        (None runs every strategy on the full-resolution photo)
+        workers: threads running the selected strategies concurrently (1 = one after another, 0 = auto)
+        strategy_timeout: seconds a strategy may run before it is reported as failed (with workers=1
+        the strategies then run one at a time on a pool thread)
+        grabcut_mode: 'fast' (proxy GrabCut + boundary refinement) or 'exact' (utils/fastGrabCut.py)
+        """
+        self.working_size = working_size
+        self.workers = workers
+        self.strategy_timeout = strategy_timeout
+        self.grabcut_mode = grabcut_mode
         self.strategies = {
             'beverage_focus': self.beverage_bottle_crop,
             'label_extraction': self.pharmaceutical_label_crop,
@@ -22,15 +44,35 @@ class ProductSmartCropper:
             'background_removal': self.background_removal_crop,
             'multi_scale': self.multi_scale_crop
         }
+        
+        # Box finders behind each strategy: ImageAnalysis -> (box, finishing step or None)
+        self.box_strategies = {
+            'beverage_focus': self.beverage_bottle_box,
+            'label_extraction': self.pharmaceutical_label_box,
+            'product_isolation': self.product_isolation_box,
+            'text_region_focus': self.text_region_box,
+            'background_removal': self.background_removal_box,
+            'multi_scale': self.multi_scale_box
+        }
     
     def detect_product_type(self, image):
-        """Detect if image is beverage bottle, pharmaceutical, or personal care"""
-        height, width = image.shape[:2]
+        """
+        Detect if image is beverage bottle, pharmaceutical, or personal care
+        image: OpenCV image or ImageAnalysis
+        """
+        analysis = ImageAnalysis.of(image)
+        height, width = analysis.shape[:2]
         aspect_ratio = height / width
         
-        # Analyze image characteristics
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, 50, 150)
+        # Analyze image characteristics at the reference size (the default
+        # working-resolution proxy of a large photo already is that size)
+        if max(height, width) == DETECTION_SIZE:
+            edges = analysis.edges(50, 150)
+        else:
+            factor = DETECTION_SIZE / float(max(height, width))
+            width, height = max(1, round(width * factor)), max(1, round(height * factor))
+            interpolation = cv2.INTER_AREA if factor < 1 else cv2.INTER_LINEAR
+            edges = cv2.Canny(cv2.resize(analysis.gray, (width, height), interpolation=interpolation), 50, 150)
         
         # Look for vertical lines (bottle characteristics)
         vertical_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 15))
@@ -45,15 +87,42 @@ class ProductSmartCropper:
         else:
             return 'personal_care'  # Mixed characteristics
     
-    def beverage_bottle_crop(self, image):
-        """Specialized cropping for beverage bottles like Fruiticana smoothie"""
-        height, width = image.shape[:2]
+    def apply_box(self, image, box_result):
+        """Cut a (box, finishing step) result out of the image it was found on"""
+        box, finish = box_result
+        cropped = crop_box(image, box)
+        return finish(cropped) if finish else cropped
+    
+    def label_contrast(self, cropped):
+        """Enhance contrast for better label reading"""
+        pil_image = Image.fromarray(cv2.cvtColor(cropped, cv2.COLOR_BGR2RGB))
+        enhancer = ImageEnhance.Contrast(pil_image)
+        enhanced = enhancer.enhance(1.5)
+        
+        return cv2.cvtColor(np.array(enhanced), cv2.COLOR_RGB2BGR)
+    
+    def text_sharpen(self, cropped):
+        """Enhance for better text recognition"""
+        pil_image = Image.fromarray(cv2.cvtColor(cropped, cv2.COLOR_BGR2RGB))
+        enhancer = ImageEnhance.Sharpness(pil_image)
+        sharpened = enhancer.enhance(2.0)
+        enhancer = ImageEnhance.Contrast(sharpened)
+        enhanced = enhancer.enhance(1.3)
+        
+        return cv2.cvtColor(np.array(enhanced), cv2.COLOR_RGB2BGR)
+    
+    def beverage_bottle_box(self, image, scale=1.0):
+        """Box around the main bottle in the upper 70% of the photo"""
+        analysis = ImageAnalysis.of(image, scale)
+        height, width = analysis.shape[:2]
+        upper_height = int(height*0.7)
         
         # Focus on upper 70% where labels typically are
-        upper_region = image[0:int(height*0.7), :]
+        upper_region = analysis.image[0:upper_height, :]
         
-        # Find the main bottle contour
-        gray = cv2.cvtColor(upper_region, cv2.COLOR_BGR2GRAY)
+        # Find the main bottle contour (the region is blurred on its own, like the
+        # original, so the rows at its lower edge are not mixed with the rest)
+        gray = analysis.gray[0:upper_height, :]
         blurred = cv2.GaussianBlur(gray, (5, 5), 0)
         
         # Use adaptive threshold to handle varying lighting
@@ -72,215 +141,149 @@ class ProductSmartCropper:
             padding_x = int(w * 0.1)
             padding_y = int(h * 0.1)
             
-            x = max(0, x - padding_x)
-            y = max(0, y - padding_y)
-            w = min(width - x, w + 2 * padding_x)
-            h = min(int(height*0.7) - y, h + 2 * padding_y)
-            
-            cropped = upper_region[y:y+h, x:x+w]
-            
-            # Enhance contrast for better label reading
-            pil_image = Image.fromarray(cv2.cvtColor(cropped, cv2.COLOR_BGR2RGB))
-            enhancer = ImageEnhance.Contrast(pil_image)
-            enhanced = enhancer.enhance(1.5)
-            
-            return cv2.cvtColor(np.array(enhanced), cv2.COLOR_RGB2BGR)
+            return pad_rect(x, y, w, h, padding_x, (upper_height, width), padding_y), self.label_contrast
         
         # Fallback: center crop of upper region
-        return self.center_crop_region(upper_region, 0.8)
+        return self.center_box(upper_region, 0.8), None
     
-    def pharmaceutical_label_crop(self, image):
-        """Specialized cropping for pharmaceutical products like Shaltoux syrup"""
-        height, width = image.shape[:2]
-        
-        # Convert to grayscale for text detection
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Apply morphological operations to find text regions
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-        morph = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, kernel)
-        
-        # Use MSER to detect text regions
-        mser = cv2.MSER_create()
-        regions, _ = mser.detectRegions(morph)
-        
-        if regions:
-            # Get bounding boxes of all text regions
-            text_boxes = []
-            for region in regions:
-                x, y, w, h = cv2.boundingRect(region.reshape(-1, 1, 2))
-                # Filter reasonable text box sizes
-                if 10 < w < width/2 and 10 < h < height/3:
-                    text_boxes.append((x, y, x+w, y+h))
+    def beverage_bottle_crop(self, image):
+        """Specialized cropping for beverage bottles like Fruiticana smoothie"""
+        return self.apply_box(image, self.beverage_bottle_box(image))
+    
+    def pharmaceutical_label_box(self, image, scale=1.0):
+        """Box around the MSER text regions of a label"""
+        analysis = ImageAnalysis.of(image, scale)
+        height, width = analysis.shape[:2]
+        scale = analysis.scale
+        
+        # Use MSER on the morphological gradient to detect text regions: (N, 4) x, y, w, h boxes
+        boxes = analysis.mser_boxes('gradient')
+        
+        if len(boxes):
+            # Filter reasonable text box sizes
+            min_side = 10 / scale
+            widths, heights = boxes[:, 2], boxes[:, 3]
+            text_boxes = boxes[(min_side < widths) & (widths < width/2) &
+                               (min_side < heights) & (heights < height/3)]
             
-            if text_boxes:
+            if len(text_boxes):
                 # Find overall bounding box of text regions
-                x1 = min(box[0] for box in text_boxes)
-                y1 = min(box[1] for box in text_boxes)
-                x2 = max(box[2] for box in text_boxes)
-                y2 = max(box[3] for box in text_boxes)
+                x1, y1, x2, y2 = union_box(text_boxes)
                 
                 # Add padding for context
-                padding = 30
-                x1 = max(0, x1 - padding)
-                y1 = max(0, y1 - padding)
-                x2 = min(width, x2 + padding)
-                y2 = min(height, y2 + padding)
-                
-                cropped = image[y1:y2, x1:x2]
-                
-                # Enhance for better text recognition
-                pil_image = Image.fromarray(cv2.cvtColor(cropped, cv2.COLOR_BGR2RGB))
-                enhancer = ImageEnhance.Sharpness(pil_image)
-                sharpened = enhancer.enhance(2.0)
-                enhancer = ImageEnhance.Contrast(sharpened)
-                enhanced = enhancer.enhance(1.3)
-                
-                return cv2.cvtColor(np.array(enhanced), cv2.COLOR_RGB2BGR)
+                return pad_box(x1, y1, x2, y2, int(round(30 / scale)), analysis.shape), self.text_sharpen
         
         # Fallback: focus on center where labels typically are
-        return self.center_crop_region(image, 0.7)
+        return self.center_box(analysis.image, 0.7), None
     
-    def product_isolation_crop(self, image):
-        """Isolate the main product from background (for personal care like Vestline)"""
+    def pharmaceutical_label_crop(self, image):
+        """Specialized cropping for pharmaceutical products like Shaltoux syrup"""
+        return self.apply_box(image, self.pharmaceutical_label_box(image))
+    
+    def product_isolation_box(self, image, scale=1.0):
+        """Box around the GrabCut foreground"""
+        analysis = ImageAnalysis.of(image, scale)
+        image, scale = analysis.image, analysis.scale
         height, width = image.shape[:2]
         
-        # Use GrabCut algorithm for foreground extraction
-        mask = np.zeros((height, width), np.uint8)
-        
         # Define initial rectangle (center 80%)
         margin_x = int(width * 0.1)
         margin_y = int(height * 0.1)
         rect = (margin_x, margin_y, width - 2*margin_x, height - 2*margin_y)
         
-        # Initialize for GrabCut
-        bgd_model = np.zeros((1, 65), np.float64)
-        fgd_model = np.zeros((1, 65), np.float64)
-        
         try:
-            # Apply GrabCut
-            cv2.grabCut(image, mask, rect, bgd_model, fgd_model, 5, cv2.GC_INIT_WITH_RECT)
-            
-            # Extract foreground
-            mask2 = np.where((mask == 2) | (mask == 0), 0, 1).astype('uint8')
+            # Use GrabCut algorithm for foreground extraction
+            foreground = grabcut_foreground(image, rect, self.grabcut_mode)
             
             # Find bounding box of foreground
-            coords = np.where(mask2 == 1)
-            if len(coords[0]) > 0:
-                y_min, y_max = np.min(coords[0]), np.max(coords[0])
-                x_min, x_max = np.min(coords[1]), np.max(coords[1])
+            box = foreground_box(foreground)
+            if box is not None:
+                x_min, y_min, x_max, y_max = box
                 
                 # Add small padding
-                padding = 20
-                y_min = max(0, y_min - padding)
-                x_min = max(0, x_min - padding)
-                y_max = min(height, y_max + padding)
-                x_max = min(width, x_max + padding)
-                
-                cropped = image[y_min:y_max, x_min:x_max]
-                return cropped
+                return pad_box(x_min, y_min, x_max, y_max, int(round(20 / scale)), image.shape), None
+        except StrategyCancelled:
+            raise
         except:
             pass
         
         # Fallback to edge-based detection
-        return self.edge_based_crop(image)
+        return self.edge_based_box(analysis), None
     
-    def text_region_crop(self, image):
-        """Focus on text/label regions for brand recognition"""
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    def product_isolation_crop(self, image):
+        """Isolate the main product from background (for personal care like Vestline)"""
+        return self.apply_box(image, self.product_isolation_box(image))
+    
+    def text_region_box(self, image, scale=1.0):
+        """Box around the largest merged group of text-like Otsu contours"""
+        analysis = ImageAnalysis.of(image, scale)
+        image, scale = analysis.image, analysis.scale
         
         # Use multiple text detection methods
         # Method 1: EAST text detector (if available)
         try:
-            # Apply Gaussian blur and threshold
-            blurred = cv2.GaussianBlur(gray, (3, 3), 0)
-            thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+            # Text contours of the Otsu threshold of the 3x3 Gaussian blur
+            contours = analysis.contours('otsu', 3)
             
-            # Find text contours
-            contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            min_area = 50 / (scale * scale)
+            rects = np.array([cv2.boundingRect(contour) for contour in contours], dtype=np.int64).reshape(-1, 4)
+            areas = np.array([cv2.contourArea(contour) for contour in contours])
             
-            text_regions = []
-            for contour in contours:
-                x, y, w, h = cv2.boundingRect(contour)
-                aspect_ratio = w / h
-                area = cv2.contourArea(contour)
-                
-                # Filter for text-like regions
-                if 0.2 < aspect_ratio < 10 and 50 < area < (image.shape[0] * image.shape[1]) / 4:
-                    text_regions.append((x, y, x+w, y+h))
+            # Filter for text-like regions
+            aspect_ratios = rects[:, 2] / rects[:, 3]
+            text_like = ((0.2 < aspect_ratios) & (aspect_ratios < 10) &
+                         (min_area < areas) & (areas < (image.shape[0] * image.shape[1]) / 4))
+            text_regions = rects[text_like]
+            text_regions[:, 2:] += text_regions[:, :2]
             
-            if text_regions:
+            if len(text_regions):
                 # Merge overlapping regions
-                merged_regions = self.merge_text_regions(text_regions)
+                merged_regions = self.merge_text_regions(text_regions, 10 / scale)
                 
                 # Find the largest merged region
-                largest_region = max(merged_regions, key=lambda r: (r[2]-r[0]) * (r[3]-r[1]))
-                x1, y1, x2, y2 = largest_region
+                areas = (merged_regions[:, 2] - merged_regions[:, 0]) * (merged_regions[:, 3] - merged_regions[:, 1])
+                x1, y1, x2, y2 = (int(v) for v in merged_regions[np.argmax(areas)])
                 
                 # Add context padding
-                padding = 40
-                x1 = max(0, x1 - padding)
-                y1 = max(0, y1 - padding)
-                x2 = min(image.shape[1], x2 + padding)
-                y2 = min(image.shape[0], y2 + padding)
-                
-                return image[y1:y2, x1:x2]
+                return pad_box(x1, y1, x2, y2, int(round(40 / scale)), image.shape), None
         except:
             pass
         
-        return self.center_crop_region(image, 0.6)
+        return self.center_box(image, 0.6), None
     
-    def background_removal_crop(self, image):
-        """Remove background and focus on product"""
+    def text_region_crop(self, image):
+        """Focus on text/label regions for brand recognition"""
+        return self.apply_box(image, self.text_region_box(image))
+    
+    def background_removal_box(self, image, scale=1.0):
+        """Box inside the outer border (assumed background)"""
+        analysis = ImageAnalysis.of(image, scale)
+        image, scale = analysis.image, analysis.scale
         height, width = image.shape[:2]
         
-        # Convert to HSV for better color segmentation
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        
-        # Create mask for background (typically edges)
-        # Assume background is in the outer regions
-        mask = np.ones((height, width), dtype=np.uint8) * 255
-        
         # Remove outer border (likely background)
         border_size = min(width, height) // 10
-        mask[:border_size, :] = 0  # Top
-        mask[-border_size:, :] = 0  # Bottom
-        mask[:, :border_size] = 0  # Left
-        mask[:, -border_size:] = 0  # Right
-        
-        # Find the main object using the mask
-        coords = np.where(mask == 255)
-        if len(coords[0]) > 0:
-            y_min, y_max = np.min(coords[0]), np.max(coords[0])
-            x_min, x_max = np.min(coords[1]), np.max(coords[1])
-            
-            # Expand slightly for context
-            expansion = 20
-            y_min = max(0, y_min - expansion)
-            x_min = max(0, x_min - expansion)
-            y_max = min(height, y_max + expansion)
-            x_max = min(width, x_max + expansion)
-            
-            return image[y_min:y_max, x_min:x_max]
+        if border_size == 0:
+            return self.center_box(image, 0.8), None
         
-        return self.center_crop_region(image, 0.8)
+        # Expand slightly for context
+        return pad_box(border_size, border_size, width - border_size - 1, height - border_size - 1,
+                       int(round(20 / scale)), image.shape), None
+    
+    def background_removal_crop(self, image):
+        """Remove background and focus on product"""
+        return self.apply_box(image, self.background_removal_box(image))
+    
+    def multi_scale_box(self, image, scale=1.0):
+        """The medium (0.8) of the 0.6 / 0.8 / 0.9 center scales"""
+        return self.center_box(ImageAnalysis.of(image).image, 0.8), None
     
     def multi_scale_crop(self, image):
         """Create multiple crops at different scales"""
-        crops = []
-        
-        # Scale factors for different crop sizes
-        scales = [0.6, 0.8, 0.9]
-        
-        for scale in scales:
-            cropped = self.center_crop_region(image, scale)
-            crops.append(cropped)
-        
-        # Return the medium scale (0.8) as the main crop
-        return crops[1] if len(crops) > 1 else crops[0]
+        return self.apply_box(image, self.multi_scale_box(image))
     
-    def center_crop_region(self, image, scale):
-        """Helper function for center cropping"""
+    def center_box(self, image, scale):
+        """Centered box covering scale of each side"""
         height, width = image.shape[:2]
         new_height = int(height * scale)
         new_width = int(width * scale)
@@ -288,15 +291,18 @@ class ProductSmartCropper:
         start_y = (height - new_height) // 2
         start_x = (width - new_width) // 2
         
-        return image[start_y:start_y + new_height, start_x:start_x + new_width]
+        return (start_x, start_y, start_x + new_width, start_y + new_height)
     
-    def edge_based_crop(self, image):
-        """Edge detection based cropping"""
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, 50, 150)
+    def center_crop_region(self, image, scale):
+        """Helper function for center cropping"""
+        return crop_box(image, self.center_box(image, scale))
+    
+    def edge_based_box(self, image, scale=1.0):
+        """Box around every Canny contour"""
+        analysis = ImageAnalysis.of(image, scale)
         
-        # Find contours
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Contours of the Canny edges (shared with detect_product_type)
+        contours = analysis.contours('edges', 50, 150)
         
         if contours:
             # Get overall bounding box
@@ -304,55 +310,61 @@ class ProductSmartCropper:
             x, y, w, h = cv2.boundingRect(all_contours)
             
             # Add padding
-            padding = 30
-            height, width = image.shape[:2]
-            
-            x = max(0, x - padding)
-            y = max(0, y - padding)
-            w = min(width - x, w + 2 * padding)
-            h = min(height - y, h + 2 * padding)
-            
-            return image[y:y+h, x:x+w]
+            return pad_rect(x, y, w, h, int(round(30 / analysis.scale)), analysis.shape)
         
-        return self.center_crop_region(image, 0.7)
+        return self.center_box(analysis.image, 0.7)
     
-    def merge_text_regions(self, regions):
-        """Merge overlapping text regions"""
-        if not regions:
-            return []
-        
-        merged = []
-        sorted_regions = sorted(regions, key=lambda r: r[0])  # Sort by x coordinate
-        
-        current = sorted_regions[0]
-        
-        for next_region in sorted_regions[1:]:
-            # Check if regions overlap or are close
-            if (current[2] >= next_region[0] - 10):  # 10 pixel tolerance
-                # Merge regions
-                current = (
-                    min(current[0], next_region[0]),
-                    min(current[1], next_region[1]),
-                    max(current[2], next_region[2]),
-                    max(current[3], next_region[3])
-                )
-            else:
-                merged.append(current)
-                current = next_region
-        
-        merged.append(current)
-        return merged
+    def edge_based_crop(self, image):
+        """Edge detection based cropping"""
+        return crop_box(image, self.edge_based_box(image))
     
-    def process_image(self, image_path, strategies=['auto']):
-        """Process an image with smart cropping strategies"""
+    def merge_text_regions(self, regions, tolerance=10):
+        """
+        Merge overlapping text regions (tolerance: largest gap in pixels still merged)
+        regions: (x1, y1, x2, y2) boxes; returns the merged ones as an (M, 4) array
+        """
+        regions = np.asarray(regions).reshape(-1, 4)
+        if not len(regions):
+            return regions
+        
+        # Sort by x coordinate
+        regions = regions[np.argsort(regions[:, 0], kind='stable')]
+        
+        # A region starts a new group when it begins more than tolerance to the right
+        # of every region before it (earlier groups all end before this group begins)
+        reach = np.maximum.accumulate(regions[:, 2])
+        starts = np.flatnonzero(np.concatenate(([True], reach[:-1] < regions[1:, 0] - tolerance)))
+        
+        return np.stack([
+            np.minimum.reduceat(regions[:, 0], starts),
+            np.minimum.reduceat(regions[:, 1], starts),
+            np.maximum.reduceat(regions[:, 2], starts),
+            np.maximum.reduceat(regions[:, 3], starts)
+        ], axis=1)
+    
+    def process_image(self, image_path, strategies=['auto'], budget=None):
+        """
+        Process an image with smart cropping strategies
+        Boxes are found on the working-resolution proxy and cut from the original
+        (limited to CROP_OUTPUT_SIZE); each result reports its 'box' in original coordinates
+        budget: seconds for the whole call; strategies that do not fit (by measured
+        cost and effectiveness weight) are skipped or aborted and reported as failed
+        """
+        started = time.monotonic()
+        
         # Load image
         image = cv2.imread(image_path)
         if image is None:
             raise ValueError(f"Could not load image: {image_path}")
         
+        proxy, scale = make_proxy(image, self.working_size)
+        
+        # Grayscale, edge and contour maps shared by product detection and all strategies
+        analysis = ImageAnalysis(proxy, scale)
+        
         # Auto-detect product type if 'auto' is specified
         if 'auto' in strategies:
-            product_type = self.detect_product_type(image)
+            product_type = self.detect_product_type(analysis)
             print(f"🔍 Detected product type: {product_type}")
             
             if product_type == 'beverage':
@@ -362,25 +374,44 @@ class ProductSmartCropper:
             else:  # personal_care
                 strategies = ['product_isolation', 'background_removal', 'text_region_focus']
         
+        def strategy_crop(strategy):
+            """(crop, original box) of one strategy"""
+            box, finish = self.box_strategies[strategy](analysis)
+            original_box = scale_box(box, scale, image.shape)
+            cropped = crop_box(image, original_box)
+            if scale != 1.0:
+                cropped = limit_size(cropped)
+            if finish:
+                cropped = finish(cropped)
+            return cropped, original_box
+        
+        # Strategies run on the thread pool when workers != 1 or under a budget; results keep the strategy order
+        tasks = [(strategy, lambda strategy=strategy: strategy_crop(strategy))
+                 for strategy in strategies if strategy in self.strategies]
+        
+        # Strategy costs scale with the analysed (proxy) image
+        megapixels = analysis.shape[0] * analysis.shape[1] / 1e6
+        
         results = []
         
-        for strategy in strategies:
-            if strategy in self.strategies:
-                try:
-                    cropped = self.strategies[strategy](image)
-                    results.append({
-                        'strategy': strategy,
-                        'image': cropped,
-                        'success': True
-                    })
-                    print(f"✅ Applied {strategy}")
-                except Exception as e:
-                    print(f"❌ Failed {strategy}: {e}")
-                    results.append({
-                        'strategy': strategy,
-                        'error': str(e),
-                        'success': False
-                    })
+        for strategy, crop, error in run_within_budget(tasks, budget, started, megapixels,
+                                                       self.workers, self.strategy_timeout):
+            if error is not None:
+                print(f"❌ Failed {strategy}: {error}")
+                results.append({
+                    'strategy': strategy,
+                    'error': error,
+                    'success': False
+                })
+                continue
+            cropped, original_box = crop
+            results.append({
+                'strategy': strategy,
+                'image': cropped,
+                'box': original_box,
+                'success': True
+            })
+            print(f"✅ Applied {strategy}")
         
         return results
 
@@ -408,7 +439,7 @@ def main():
                 cv2.imwrite(output_path, result['image'])
                 print(f"📸 Saved smart crop: {output_path}")
                 break
-        
+    
     except Exception as e:
         print(f"❌ Error: {e}")
         sys.exit(1)
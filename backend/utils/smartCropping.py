@@ -10,10 +10,25 @@ from PIL import Image, ImageEnhance, ImageFilter
 import json
 import sys
 import os
+import time
+from workingResolution import WORKING_SIZE, make_proxy, pad_box, pad_rect, scale_box, crop_box, limit_size
+from imageAnalysis import ImageAnalysis, union_box
+from strategyBudget import run_within_budget
+from strategyRunner import check_cancelled
 
 class SmartCropper:
-    def __init__(self):
-        """Initialize the smart cropping system"""
+    def __init__(self, working_size=WORKING_SIZE, workers=1, strategy_timeout=None):
+        """
+        Initialize the smart cropping system
+        working_size: longest side of the proxy the crop boxes are found on
+        (None runs every strategy on the full-resolution photo)
+        workers: threads running the selected strategies concurrently (1 = one after another, 0 = auto)
+        strategy_timeout: seconds a strategy may run before it is reported as failed (with workers=1
+        the strategies then run one at a time on a pool thread)
+        """
+        self.working_size = working_size
+        self.workers = workers
+        self.strategy_timeout = strategy_timeout
         self.crop_strategies = {
             'center_crop': self.center_crop,
             'object_detection': self.object_detection_crop, 
@@ -22,6 +37,15 @@ class SmartCropper:
             'multi_region': self.multi_region_crop,
             'text_aware': self.text_aware_crop
         }
+        
+        # Box finders behind each strategy: ImageAnalysis -> (x1, y1, x2, y2)
+        self.box_strategies = {
+            'center_crop': lambda analysis: self.center_box(analysis.image),
+            'object_detection': self.object_detection_box,
+            'edge_detection': self.edge_detection_box,
+            'saliency_crop': self.saliency_box,
+            'text_aware': self.text_aware_box
+        }
     
     def enhance_image_quality(self, image):
         """Enhance image quality before cropping"""
@@ -41,11 +65,8 @@ class SmartCropper:
         
         return image
     
-    def center_crop(self, image, crop_ratio=0.8):
-        """
-        Center crop to focus on the main product
-        Removes background distractions from edges
-        """
+    def center_box(self, image, crop_ratio=0.8):
+        """Centered box covering crop_ratio of each side"""
         height, width = image.shape[:2]
         
         # Calculate crop dimensions
@@ -56,28 +77,27 @@ class SmartCropper:
         start_y = (height - new_height) // 2
         start_x = (width - new_width) // 2
         
-        cropped = image[start_y:start_y + new_height, start_x:start_x + new_width]
-        return cropped
+        return (start_x, start_y, start_x + new_width, start_y + new_height)
     
-    def object_detection_crop(self, image):
+    def center_crop(self, image, crop_ratio=0.8):
         """
-        Use contour detection to find the main object and crop around it
-        Good for products with clear boundaries
+        Center crop to focus on the main product
+        Removes background distractions from edges
         """
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Apply Gaussian blur to reduce noise
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        
-        # Edge detection
-        edges = cv2.Canny(blurred, 50, 150)
+        return crop_box(image, self.center_box(image, crop_ratio))
+    
+    def object_detection_box(self, image, scale=1.0):
+        """
+        Box around the largest contour
+        image: OpenCV image or ImageAnalysis (scale: original pixels per image pixel, for the padding)
+        """
+        analysis = ImageAnalysis.of(image, scale)
         
-        # Find contours
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Contours of the Canny edges of the 5x5 Gaussian blur
+        contours = analysis.contours('edges', 50, 150, 5)
         
         if not contours:
-            return self.center_crop(image)  # Fallback to center crop
+            return self.center_box(analysis.image)  # Fallback to center crop
         
         # Find the largest contour (likely the main product)
         largest_contour = max(contours, key=cv2.contourArea)
@@ -85,209 +105,195 @@ class SmartCropper:
         # Get bounding rectangle
         x, y, w, h = cv2.boundingRect(largest_contour)
         
-        # Add padding around the object
-        padding = 50
-        height, width = image.shape[:2]
-        
-        x = max(0, x - padding)
-        y = max(0, y - padding)
-        w = min(width - x, w + 2 * padding)
-        h = min(height - y, h + 2 * padding)
-        
-        cropped = image[y:y + h, x:x + w]
-        return cropped
+        # Add padding around the object (50 pixels of the original photo)
+        return pad_rect(x, y, w, h, int(round(50 / analysis.scale)), analysis.shape)
     
-    def edge_detection_crop(self, image):
+    def object_detection_crop(self, image):
         """
-        Use edge detection to find product boundaries
-        Effective for products with clear edges against backgrounds
+        Use contour detection to find the main object and crop around it
+        Good for products with clear boundaries
         """
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Apply bilateral filter to reduce noise while keeping edges sharp
-        filtered = cv2.bilateralFilter(gray, 9, 75, 75)
-        
-        # Edge detection with adaptive thresholds
-        edges = cv2.adaptiveThreshold(filtered, 255, cv2.ADAPTIVE_THRESH_MEAN_C, 
-                                     cv2.THRESH_BINARY, 11, 2)
+        return crop_box(image, self.object_detection_box(image))
+    
+    def edge_detection_box(self, image, scale=1.0):
+        """Box around every significant adaptive-threshold contour"""
+        analysis = ImageAnalysis.of(image, scale)
         
-        # Find contours
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Edge detection with adaptive thresholds on the bilateral-filtered grayscale
+        contours = analysis.contours('adaptive_edges')
         
         if not contours:
-            return self.center_crop(image)
+            return self.center_box(analysis.image)
         
-        # Get bounding box of all significant contours
+        # Get bounding box of all significant contours (100 px² of the original photo)
+        min_area = 100 / (analysis.scale * analysis.scale)
         all_points = np.vstack([contour.reshape(-1, 2) for contour in contours 
-                               if cv2.contourArea(contour) > 100])
+                               if cv2.contourArea(contour) > min_area])
         
         x, y, w, h = cv2.boundingRect(all_points)
         
         # Add small padding
-        padding = 20
-        height, width = image.shape[:2]
-        
-        x = max(0, x - padding)
-        y = max(0, y - padding)
-        w = min(width - x, w + 2 * padding)
-        h = min(height - y, h + 2 * padding)
-        
-        cropped = image[y:y + h, x:x + w]
-        return cropped
+        return pad_rect(x, y, w, h, int(round(20 / analysis.scale)), analysis.shape)
     
-    def saliency_crop(self, image):
+    def edge_detection_crop(self, image):
         """
-        Use saliency detection to find the most important regions
-        Good for complex scenes with multiple objects
+        Use edge detection to find product boundaries
+        Effective for products with clear edges against backgrounds
         """
-        # Create saliency detector
-        saliency = cv2.saliency.StaticSaliencySpectralResidual_create()
-        
-        # Compute saliency map
-        success, saliency_map = saliency.computeSaliency(image)
-        
-        if not success:
-            return self.center_crop(image)
-        
-        # Convert to 8-bit
-        saliency_map = (saliency_map * 255).astype(np.uint8)
-        
-        # Find the most salient region
-        _, thresh = cv2.threshold(saliency_map, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return crop_box(image, self.edge_detection_box(image))
+    
+    def saliency_box(self, image, scale=1.0):
+        """Box around the largest spectral-residual salient region"""
+        analysis = ImageAnalysis.of(image, scale)
         
-        # Find contours of salient regions
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Contours of the Otsu-thresholded saliency map (none when the detector fails)
+        check_cancelled()
+        contours = analysis.contours('saliency')
+        check_cancelled()
         
         if not contours:
-            return self.center_crop(image)
+            return self.center_box(analysis.image)
         
         # Get bounding box of the largest salient region
         largest_contour = max(contours, key=cv2.contourArea)
         x, y, w, h = cv2.boundingRect(largest_contour)
         
         # Add padding
-        padding = 30
-        height, width = image.shape[:2]
-        
-        x = max(0, x - padding)
-        y = max(0, y - padding)
-        w = min(width - x, w + 2 * padding)
-        h = min(height - y, h + 2 * padding)
-        
-        cropped = image[y:y + h, x:x + w]
-        return cropped
+        return pad_rect(x, y, w, h, int(round(30 / analysis.scale)), analysis.shape)
     
-    def multi_region_crop(self, image):
+    def saliency_crop(self, image):
         """
-        Create multiple crop regions to capture different aspects of the product
-        Returns multiple crops that can be analyzed separately
+        Use saliency detection to find the most important regions
+        Good for complex scenes with multiple objects
         """
+        return crop_box(image, self.saliency_box(image))
+    
+    def multi_region_boxes(self, image):
+        """Named boxes for the fixed multi-region layout"""
         height, width = image.shape[:2]
-        crops = []
+        boxes = []
         
         # Strategy 1: Center crop (80%)
-        center_crop = self.center_crop(image, 0.8)
-        crops.append(('center_80', center_crop))
+        boxes.append(('center_80', self.center_box(image, 0.8)))
         
         # Strategy 2: Tighter center crop (60%)
-        tight_crop = self.center_crop(image, 0.6)
-        crops.append(('center_60', tight_crop))
+        boxes.append(('center_60', self.center_box(image, 0.6)))
         
         # Strategy 3: Upper portion (for bottles/vertical products)
-        upper_crop = image[0:int(height*0.7), int(width*0.1):int(width*0.9)]
-        crops.append(('upper_region', upper_crop))
+        boxes.append(('upper_region', (int(width*0.1), 0, int(width*0.9), int(height*0.7))))
         
         # Strategy 4: Central square (for square products)
         size = min(height, width)
         start_x = (width - size) // 2
         start_y = (height - size) // 2
-        square_crop = image[start_y:start_y + size, start_x:start_x + size]
-        crops.append(('center_square', square_crop))
+        boxes.append(('center_square', (start_x, start_y, start_x + size, start_y + size)))
         
-        return crops
+        return boxes
     
-    def text_aware_crop(self, image):
+    def multi_region_crop(self, image):
         """
-        Detect text regions and ensure they're included in the crop
-        Good for products where brand/label text is important
+        Create multiple crop regions to capture different aspects of the product
+        Returns multiple crops that can be analyzed separately
         """
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return [(name, crop_box(image, box)) for name, box in self.multi_region_boxes(image)]
+    
+    def text_aware_box(self, image, scale=1.0):
+        """Box around every MSER region of text-like size"""
+        analysis = ImageAnalysis.of(image, scale)
+        image = analysis.image
         
-        # Use MSER (Maximally Stable Extremal Regions) for text detection
-        mser = cv2.MSER_create()
-        regions, _ = mser.detectRegions(gray)
+        # Use MSER (Maximally Stable Extremal Regions) for text detection: (N, 4) x, y, w, h boxes
+        boxes = analysis.mser_boxes()
         
-        if not regions:
-            return self.center_crop(image)
+        if not len(boxes):
+            return self.center_box(image)
         
-        # Get bounding boxes of all text regions
-        text_bboxes = []
-        for region in regions:
-            x, y, w, h = cv2.boundingRect(region.reshape(-1, 1, 2))
-            # Filter out very small or very large regions
-            if 10 < w < image.shape[1]/3 and 10 < h < image.shape[0]/3:
-                text_bboxes.append((x, y, x+w, y+h))
+        # Filter out very small or very large regions
+        min_side = 10 / analysis.scale
+        widths, heights = boxes[:, 2], boxes[:, 3]
+        text_boxes = boxes[(min_side < widths) & (widths < image.shape[1]/3) &
+                           (min_side < heights) & (heights < image.shape[0]/3)]
         
-        if not text_bboxes:
-            return self.center_crop(image)
+        if not len(text_boxes):
+            return self.center_box(image)
         
         # Find overall bounding box that includes all text regions
-        x1 = min(bbox[0] for bbox in text_bboxes)
-        y1 = min(bbox[1] for bbox in text_bboxes)
-        x2 = max(bbox[2] for bbox in text_bboxes)
-        y2 = max(bbox[3] for bbox in text_bboxes)
+        x1, y1, x2, y2 = union_box(text_boxes)
         
         # Add padding around text regions
-        padding = 50
-        height, width = image.shape[:2]
-        
-        x1 = max(0, x1 - padding)
-        y1 = max(0, y1 - padding)
-        x2 = min(width, x2 + padding)
-        y2 = min(height, y2 + padding)
-        
-        cropped = image[y1:y2, x1:x2]
-        return cropped
+        return pad_box(x1, y1, x2, y2, int(round(50 / analysis.scale)), image.shape)
+    
+    def text_aware_crop(self, image):
+        """
+        Detect text regions and ensure they're included in the crop
+        Good for products where brand/label text is important
+        """
+        return crop_box(image, self.text_aware_box(image))
     
-    def process_image(self, image_path, strategies=['center_crop', 'object_detection', 'multi_region']):
+    def process_image(self, image_path, strategies=['center_crop', 'object_detection', 'multi_region'], budget=None):
         """
         Process an image with multiple cropping strategies
+        Boxes are found on the enhanced working-resolution proxy; each crop is cut
+        from the original, limited to CROP_OUTPUT_SIZE and enhanced on its own.
+        Every crop reports its 'box' in original image coordinates
+        budget: seconds for the whole call; strategies that do not fit (by measured
+        cost and effectiveness weight) are skipped or aborted and reported as failed
         """
+        started = time.monotonic()
+        
         # Load image
         image = cv2.imread(image_path)
         if image is None:
             raise ValueError(f"Could not load image: {image_path}")
         
         # Enhance image quality first
-        enhanced_pil = self.enhance_image_quality(image)
+        proxy, scale = make_proxy(image, self.working_size)
+        enhanced_pil = self.enhance_image_quality(proxy)
         enhanced = cv2.cvtColor(np.array(enhanced_pil), cv2.COLOR_RGB2BGR)
         
+        # Grayscale, blur, edge and contour maps shared by all strategies
+        analysis = ImageAnalysis(enhanced, scale)
+        
+        def finish(box):
+            """(crop, original box) for a box on the enhanced proxy"""
+            original_box = scale_box(box, scale, image.shape)
+            if scale == 1.0:
+                return crop_box(enhanced, box), original_box
+            crop = limit_size(crop_box(image, original_box))
+            return cv2.cvtColor(np.array(self.enhance_image_quality(crop)), cv2.COLOR_RGB2BGR), original_box
+        
+        def strategy_crops(strategy):
+            """[(crop name, crop, original box)] of one strategy"""
+            if strategy == 'multi_region':
+                return [(f"{strategy}_{crop_name}",) + finish(box)
+                        for crop_name, box in self.multi_region_boxes(enhanced)]
+            return [(strategy,) + finish(self.box_strategies[strategy](analysis))]
+        
+        # Strategies run on the thread pool when workers != 1 or under a budget; results keep the strategy order
+        tasks = [(strategy, lambda strategy=strategy: strategy_crops(strategy))
+                 for strategy in strategies if strategy in self.crop_strategies]
+        
+        # Strategy costs scale with the analysed (proxy) image
+        megapixels = analysis.shape[0] * analysis.shape[1] / 1e6
+        
         results = {'original_image': image_path, 'crops': []}
         
-        for strategy in strategies:
-            if strategy in self.crop_strategies:
-                try:
-                    if strategy == 'multi_region':
-                        crops = self.crop_strategies[strategy](enhanced)
-                        for crop_name, crop_image in crops:
-                            results['crops'].append({
-                                'strategy': f"{strategy}_{crop_name}",
-                                'image': crop_image,
-                                'success': True
-                            })
-                    else:
-                        crop_image = self.crop_strategies[strategy](enhanced)
-                        results['crops'].append({
-                            'strategy': strategy,
-                            'image': crop_image,
-                            'success': True
-                        })
-                except Exception as e:
-                    results['crops'].append({
-                        'strategy': strategy,
-                        'error': str(e),
-                        'success': False
-                    })
+        for strategy, crops, error in run_within_budget(tasks, budget, started, megapixels,
+                                                        self.workers, self.strategy_timeout):
+            if error is not None:
+                results['crops'].append({
+                    'strategy': strategy,
+                    'error': error,
+                    'success': False
+                })
+                continue
+            for crop_name, crop_image, original_box in crops:
+                results['crops'].append({
+                    'strategy': crop_name,
+                    'image': crop_image,
+                    'box': original_box,
+                    'success': True
+                })
         
         return results
 
@@ -326,7 +332,7 @@ def main():
                 print(f"   ❌ Failed: {crop_result['strategy']} - {crop_result.get('error', 'Unknown error')}")
         
         print("✅ Cropping completed successfully")
-        
+    
     except Exception as e:
         print(f"❌ Error processing image: {e}")
         sys.exit(1)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Time-Budgeted Strategy Selection for the Cropping Pipelines
+Each strategy's cost is tracked in seconds per megapixel of the analysed
+(working-resolution) image, seeded with measured priors and updated from
+every run. Under a latency budget the strategies with the best effectiveness
+weight per second are kept and the rest are skipped, so a busy service returns
+fewer crops instead of running past the caller's timeout. One cheap fallback
+always runs, so even a tiny budget yields a crop
+"""
+
+import threading
+import time
+from strategyRunner import run_strategies, pool_size, BUDGET_SKIPPED
+
+# Effectiveness weight of each crop (the original photo included), used to
+# pick strategies under a budget and to weight crop embeddings
+STRATEGY_WEIGHTS = {
+    'original': 1.0,
+    'center_crop': 0.8,
+    'object_detection': 0.9,
+    'edge_detection': 0.7,
+    'saliency_crop': 0.8,
+    'text_aware': 0.85,
+    'multi_region_center_80': 0.75,
+    'multi_region_center_60': 0.7,
+    'multi_region_upper_region': 0.6,
+    'multi_region_center_square': 0.65
+}
+
+DEFAULT_WEIGHT = 0.5
+
+# Seconds per megapixel of the analysed image (box search plus crop finishing),
+# measured on one CPU core with the 1024 px working resolution
+# (product_isolation with fast GrabCut; exact GrabCut is ~23 s/MP)
+DEFAULT_COSTS = {
+    'center_crop': 0.1,
+    'object_detection': 0.1,
+    'edge_detection': 0.1,
+    'saliency_crop': 0.1,
+    'multi_region': 0.35,
+    'text_aware': 0.15,
+    'beverage_focus': 0.05,
+    'label_extraction': 0.1,
+    'product_isolation': 2.0,
+    'text_region_focus': 0.03,
+    'background_removal': 0.05,
+    'multi_scale': 0.05
+}
+
+DEFAULT_COST = 0.5
+
+# Kept under any budget when requested (otherwise the cheapest strategy is)
+FALLBACK_STRATEGY = 'center_crop'
+
+def strategy_weight(strategy):
+    """Effectiveness weight of a crop; a strategy producing several named crops gets its best one"""
+    if strategy in STRATEGY_WEIGHTS:
+        return STRATEGY_WEIGHTS[strategy]
+    named = [weight for name, weight in STRATEGY_WEIGHTS.items() if name.startswith(strategy + '_')]
+    return max(named) if named else DEFAULT_WEIGHT
+
+class StrategyCostModel:
+    def __init__(self, priors=None, smoothing=0.3):
+        """
+        priors: seconds per megapixel by strategy (DEFAULT_COSTS when omitted)
+        smoothing: weight of each new measurement in the moving average
+        """
+        self.costs = dict(DEFAULT_COSTS if priors is None else priors)
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+    
+    def estimate(self, strategy, megapixels):
+        """Expected seconds for a strategy on an image of the given size"""
+        with self.lock:
+            return self.costs.get(strategy, DEFAULT_COST) * megapixels
+    
+    def record(self, strategy, seconds, megapixels):
+        if megapixels <= 0:
+            return
+        per_megapixel = seconds / megapixels
+        with self.lock:
+            previous = self.costs.get(strategy)
+            self.costs[strategy] = per_megapixel if previous is None else (
+                (1 - self.smoothing) * previous + self.smoothing * per_megapixel)
+    
+    def timed(self, strategy, megapixels, function):
+        """
+        Wrap a strategy so every run updates the model, including one that
+        raises or is cancelled past its deadline (the time it ran until then)
+        """
+        def run():
+            start = time.perf_counter()
+            try:
+                return function()
+            finally:
+                self.record(strategy, time.perf_counter() - start, megapixels)
+        return run
+    
+    def fallback(self, strategies, megapixels):
+        """Index of the strategy kept under any budget (None for no strategies)"""
+        if not strategies:
+            return None
+        if FALLBACK_STRATEGY in strategies:
+            return strategies.index(FALLBACK_STRATEGY)
+        return min(range(len(strategies)), key=lambda i: self.estimate(strategies[i], megapixels))
+    
+    def plan(self, strategies, budget, megapixels, workers=1):
+        """
+        Which strategies fit a budget of seconds: a list of booleans aligned with strategies
+        The fallback is always kept and runs first; the others are taken in
+        order of weight per expected second, skipping any whose expected
+        wall-clock time (after the fallback: the slowest strategy, or the total
+        spread over the workers) would exceed the budget
+        """
+        costs = [max(self.estimate(strategy, megapixels), 1e-6) for strategy in strategies]
+        order = sorted(range(len(strategies)), key=lambda i: strategy_weight(strategies[i]) / costs[i], reverse=True)
+        
+        keep = [False] * len(strategies)
+        fallback = self.fallback(strategies, megapixels)
+        if fallback is None:
+            return keep
+        keep[fallback] = True
+        
+        total = longest = 0.0
+        for i in order:
+            if keep[i]:
+                continue
+            expected = costs[fallback] + max(longest, costs[i], (total + costs[i]) / max(1, workers))
+            if expected > budget:
+                continue
+            keep[i] = True
+            total += costs[i]
+            longest = max(longest, costs[i])
+        return keep
+
+# Shared by every cropper in the process, so measurements accumulate across requests
+COST_MODEL = StrategyCostModel()
+
+def run_within_budget(tasks, budget=None, started=None, megapixels=1.0, workers=1, timeout=None):
+    """
+    run_strategies under a latency budget: returns [(name, result, error)] in task order
+    budget: seconds since started (time.monotonic(), default now) for the whole stage;
+    strategies that do not fit are reported as skipped and any still running
+    when it runs out are abandoned, except the fallback, which runs first in
+    this thread and always completes. None runs every strategy
+    megapixels: size of the analysed image, for the cost model
+    """
+    tasks = [(name, COST_MODEL.timed(name, megapixels, function)) for name, function in tasks]
+    if budget is None:
+        return run_strategies(tasks, workers, timeout)
+    
+    started = time.monotonic() if started is None else started
+    remaining = budget - (time.monotonic() - started)
+    names = [name for name, _ in tasks]
+    keep = COST_MODEL.plan(names, remaining, megapixels, pool_size(workers))
+    fallback = COST_MODEL.fallback(names, megapixels)
+    
+    results = {}
+    if fallback is not None:
+        results[fallback] = run_strategies([tasks[fallback]])[0]
+    others = [i for i, kept in enumerate(keep) if kept and i != fallback]
+    if others:
+        ran = run_strategies([tasks[i] for i in others], workers, timeout, deadline=started + budget)
+        results.update(zip(others, ran))
+    return [results.get(i, (name, None, BUDGET_SKIPPED)) for i, name in enumerate(names)]
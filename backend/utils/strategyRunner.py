@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Concurrent Execution of Cropping Strategies
+OpenCV releases the GIL in GrabCut, MSER, bilateral filters and Canny, so
+independent strategies on the same photo can run side by side on a small
+thread pool. The cropping stage then takes about as long as its slowest
+strategy instead of the sum of all of them. The pools are shared by every
+call, so strategies abandoned past a timeout never add threads; they are
+flagged and stop at their next check_cancelled()
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+# Pool size used when workers=0 ("auto")
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+# Errors reported for strategies dropped by a time budget
+BUDGET_SKIPPED = "skipped: over the time budget"
+BUDGET_ABORTED = "aborted: over the time budget"
+BUDGET_ERRORS = (BUDGET_SKIPPED, BUDGET_ABORTED)
+
+# How often the collector checks whether a queued strategy has started
+_POLL_SECONDS = 0.05
+
+# One pool per thread count, shared by all calls and never shut down
+_executors = {}
+_executors_lock = threading.Lock()
+
+# Cancellation flag of the strategy running on the current pool thread
+_current = threading.local()
+
+class StrategyCancelled(Exception):
+    """Raised by check_cancelled() in a strategy whose result is no longer wanted"""
+
+def check_cancelled():
+    """
+    Stop a long strategy (between GrabCut iterations, before saliency...) once
+    it has timed out or its budget ran out; does nothing outside the pool
+    """
+    cancel = getattr(_current, 'cancel', None)
+    if cancel is not None and cancel.is_set():
+        raise StrategyCancelled("cancelled: result no longer needed")
+
+def pool_size(workers):
+    """Threads used for a workers setting (0 = DEFAULT_WORKERS)"""
+    return DEFAULT_WORKERS if workers == 0 else max(1, int(workers or 1))
+
+def _executor(workers):
+    """The shared pool with the given number of threads"""
+    with _executors_lock:
+        if workers not in _executors:
+            _executors[workers] = ThreadPoolExecutor(max_workers=workers,
+                                                     thread_name_prefix=f'crop-strategy-{workers}')
+        return _executors[workers]
+
+def run_strategies(tasks, workers=1, timeout=None, deadline=None):
+    """
+    Run (name, function) tasks and return [(name, result, error)] in task order
+    workers: threads to use (1 runs the tasks one after another, in this thread
+    unless a timeout or deadline needs the pool; 0 uses DEFAULT_WORKERS);
+    concurrent calls share the pool of that size
+    timeout: seconds each task may run once started; a task still running
+    after that is reported with an error, its result is discarded and it is
+    flagged to stop at its next check_cancelled()
+    deadline: time.monotonic() by which all results are due; tasks not started
+    by then are skipped and running ones are abandoned like timed-out ones
+    """
+    workers = pool_size(workers)
+    if not tasks:
+        return []
+    if timeout is None and deadline is None and (workers == 1 or len(tasks) <= 1):
+        return [_call(name, function) for name, function in tasks]
+    
+    executor = _executor(workers)
+    entries = []
+    for name, function in tasks:
+        started = {}
+        cancel = threading.Event()
+        entries.append((name, started, cancel, executor.submit(_started_call, started, cancel, name, function)))
+    try:
+        return [_collect(name, started, cancel, future, timeout, deadline) for name, started, cancel, future in entries]
+    finally:
+        # Whatever is still queued or running has been given up on
+        for _, _, cancel, future in entries:
+            if not future.done():
+                future.cancel()
+                cancel.set()
+
+def _call(name, function):
+    try:
+        return name, function(), None
+    except Exception as e:
+        return name, None, str(e)
+
+def _started_call(started, cancel, name, function):
+    started['at'] = time.monotonic()
+    _current.cancel = cancel
+    try:
+        return _call(name, function)
+    finally:
+        _current.cancel = None
+
+def _collect(name, started, cancel, future, timeout, deadline=None):
+    """
+    Wait for one task, measuring its timeout from when it started running
+    A task given up on is flagged right away, so it frees its thread for the
+    tasks queued behind it instead of running until the call returns
+    """
+    if timeout is None and deadline is None:
+        return future.result()
+    
+    while True:
+        if 'at' not in started:
+            # Still queued behind other strategies
+            if future.done():
+                return future.result()
+            if deadline is not None and time.monotonic() >= deadline and future.cancel():
+                return name, None, BUDGET_SKIPPED
+            time.sleep(_POLL_SECONDS)
+            continue
+        
+        limits = [started['at'] + timeout] if timeout is not None else []
+        if deadline is not None:
+            limits.append(deadline)
+        try:
+            return future.result(timeout=max(0.0, min(limits) - time.monotonic()))
+        except FutureTimeout:
+            cancel.set()
+            if timeout is not None and started['at'] + timeout <= min(limits):
+                return name, None, f"timed out after {timeout}s"
+            return name, None, BUDGET_ABORTED
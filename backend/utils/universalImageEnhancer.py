@@ -10,10 +10,19 @@ from PIL import Image, ImageEnhance, ImageFilter
 import json
 import sys
 import os
+from workingResolution import WORKING_SIZE, make_proxy, scale_box, crop_box, limit_size
+from fastGrabCut import grabcut_foreground, foreground_box
 
 class UniversalImageEnhancer:
-    def __init__(self):
-        """Initialize with universal enhancement techniques"""
+    def __init__(self, working_size=WORKING_SIZE, grabcut_mode='fast'):
+        """
+        Initialize with universal enhancement techniques
+        working_size: longest side of the proxy the product box is found on
+        (None enhances and crops the full-resolution photo)
+        grabcut_mode: 'fast' (proxy GrabCut + boundary refinement) or 'exact' (utils/fastGrabCut.py)
+        """
+        self.working_size = working_size
+        self.grabcut_mode = grabcut_mode
         self.enhancement_methods = [
             'adaptive_enhance',
             'contrast_optimization', 
@@ -44,7 +53,21 @@ class UniversalImageEnhancer:
         return output_path
     
     def apply_enhancement_pipeline(self, image):
-        """Apply a sequence of universal enhancements"""
+        """
+        Apply a sequence of universal enhancements
+        The product box is found on an enhanced working-resolution proxy; the
+        box is then cut from the original, limited to CROP_OUTPUT_SIZE and enhanced
+        """
+        proxy, scale = make_proxy(image, self.working_size)
+        if scale == 1.0:
+            return self.remove_background_and_crop(self.apply_enhancements(image))
+        
+        box = self.background_crop_box(self.apply_enhancements(proxy))
+        cropped = limit_size(crop_box(image, scale_box(box, scale, image.shape)))
+        return self.apply_enhancements(cropped)
+    
+    def apply_enhancements(self, image):
+        """Enhancement steps 1-5 of the pipeline (everything but the crop)"""
         # 1. Adaptive contrast enhancement
         enhanced = self.adaptive_contrast_enhancement(image)
         
@@ -60,9 +83,6 @@ class UniversalImageEnhancer:
         # 5. Histogram equalization for better exposure
         enhanced = self.adaptive_histogram_equalization(enhanced)
         
-        # 6. Background removal and intelligent cropping
-        enhanced = self.remove_background_and_crop(enhanced)
-        
         return enhanced
     
     def adaptive_contrast_enhancement(self, image):
@@ -225,61 +245,54 @@ class UniversalImageEnhancer:
     
     def remove_background_and_crop(self, image):
         """Remove background and intelligently crop to focus on the main product"""
-        height, width = image.shape[:2]
-        
+        return crop_box(image, self.background_crop_box(image))
+    
+    def background_crop_box(self, image):
+        """(x1, y1, x2, y2) of the main product: GrabCut, then contours, then a gentle center box"""
         print("🎯 Applying background removal and intelligent cropping...")
         
         # Method 1: Try GrabCut for sophisticated background removal
         try:
-            grabcut_result = self.grabcut_background_removal(image)
-            if grabcut_result is not None:
+            grabcut_box = self.grabcut_box(image)
+            if grabcut_box is not None:
                 print("✅ GrabCut background removal successful")
-                return grabcut_result
+                return grabcut_box
         except Exception as e:
             print(f"⚠️ GrabCut failed: {e}")
         
         # Method 2: Fallback to contour-based detection
         try:
-            contour_result = self.contour_based_crop(image)
-            if contour_result is not None:
+            contour_box = self.contour_box(image)
+            if contour_box is not None:
                 print("✅ Contour-based cropping successful")
-                return contour_result
+                return contour_box
         except Exception as e:
             print(f"⚠️ Contour-based cropping failed: {e}")
         
         # Method 3: Final fallback to gentle center crop
         print("✅ Applying gentle center crop as fallback")
-        return self.gentle_center_crop(image)
+        return self.gentle_center_box(image)
     
     def grabcut_background_removal(self, image):
         """Use GrabCut algorithm to remove background and focus on product"""
+        box = self.grabcut_box(image)
+        return crop_box(image, box) if box is not None else None
+    
+    def grabcut_box(self, image):
+        """Padded GrabCut foreground box, or None when it is missing or too small"""
         height, width = image.shape[:2]
         
-        # Create mask for GrabCut
-        mask = np.zeros((height, width), np.uint8)
-        
         # Define initial rectangle (center 70% of image)
         margin_x = int(width * 0.15)
         margin_y = int(height * 0.15)
         rect = (margin_x, margin_y, width - 2*margin_x, height - 2*margin_y)
         
-        # Initialize background and foreground models
-        bgd_model = np.zeros((1, 65), np.float64)
-        fgd_model = np.zeros((1, 65), np.float64)
-        
-        # Apply GrabCut
-        cv2.grabCut(image, mask, rect, bgd_model, fgd_model, 5, cv2.GC_INIT_WITH_RECT)
-        
-        # Extract foreground
-        mask2 = np.where((mask == 2) | (mask == 0), 0, 1).astype('uint8')
-        
-        # Find bounding box of foreground
-        coords = np.where(mask2 == 1)
-        if len(coords[0]) == 0:
+        # Apply GrabCut and find bounding box of foreground
+        box = foreground_box(grabcut_foreground(image, rect, self.grabcut_mode))
+        if box is None:
             return None
         
-        y_min, y_max = np.min(coords[0]), np.max(coords[0])
-        x_min, x_max = np.min(coords[1]), np.max(coords[1])
+        x_min, y_min, x_max, y_max = box
         
         # Add padding around the detected product
         padding_x = int((x_max - x_min) * 0.1)
@@ -299,12 +312,16 @@ class UniversalImageEnhancer:
         if crop_width < min_width or crop_height < min_height:
             return None
         
-        # Extract the product region
-        cropped = image[y_min:y_max, x_min:x_max]
-        return cropped
+        # The product region
+        return (x_min, y_min, x_max, y_max)
     
     def contour_based_crop(self, image):
         """Use contour detection to find and crop the main product"""
+        box = self.contour_box(image)
+        return crop_box(image, box) if box is not None else None
+    
+    def contour_box(self, image):
+        """Padded box of the largest significant contour, or None"""
         height, width = image.shape[:2]
         
         # Convert to grayscale
@@ -353,10 +370,14 @@ class UniversalImageEnhancer:
         if w < width * 0.4 or h < height * 0.4:
             return None
         
-        return image[y:y+h, x:x+w]
+        return (x, y, x + w, y + h)
     
     def gentle_center_crop(self, image):
         """Apply a gentle center crop as final fallback"""
+        return crop_box(image, self.gentle_center_box(image))
+    
+    def gentle_center_box(self, image):
+        """Centered box without the outer 10% on each side"""
         height, width = image.shape[:2]
         
         # Remove only outer 10% from each side
@@ -367,7 +388,7 @@ class UniversalImageEnhancer:
         start_y = (height - new_height) // 2
         start_x = (width - new_width) // 2
         
-        return image[start_y:start_y + new_height, start_x:start_x + new_width]
+        return (start_x, start_y, start_x + new_width, start_y + new_height)
 
 def main():
     """Test the universal enhancement system"""
@@ -398,7 +419,7 @@ def main():
         print(f"   Overall score: {quality_metrics['overall_score']:.2f}")
         
         print(f"SUCCESS:{enhanced_path}")
-        
+    
     except Exception as e:
         print(f"ERROR: {e}")
         sys.exit(1)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Working-Resolution Helpers for the Cropping Pipelines
+Crop boxes are found on a downscaled proxy of the photo, mapped back to the
+original coordinates and cut from the original, so bilateral filters, Canny,
+MSER, GrabCut and CLAHE cost the same for a 12 MP phone photo as for a
+1 MP one. Every crop is resized to 224 px for CLIP in the end anyway
+"""
+
+import cv2
+
+# Longest side of the proxy image the boxes are found on (None = full resolution)
+WORKING_SIZE = 1024
+
+# Longest side of the crops handed on: twice CLIP's 224 px input leaves room for its center crop
+CROP_OUTPUT_SIZE = 448
+
+def make_proxy(image, working_size=WORKING_SIZE):
+    """
+    Downscaled copy of an OpenCV image whose longest side is at most working_size
+    Returns (proxy, scale) with scale = original pixels per proxy pixel (1.0 = unchanged)
+    """
+    height, width = image.shape[:2]
+    longest = max(height, width)
+    if not working_size or longest <= working_size:
+        return image, 1.0
+    
+    scale = longest / float(working_size)
+    size = (max(1, round(width / scale)), max(1, round(height / scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+
+def pad_box(x1, y1, x2, y2, padding, shape):
+    """Grow a box by padding pixels on every side, clamped to an image of the given shape"""
+    height, width = shape[:2]
+    return (max(0, x1 - padding), max(0, y1 - padding), min(width, x2 + padding), min(height, y2 + padding))
+
+def pad_rect(x, y, w, h, padding, shape, padding_y=None):
+    """
+    Grow an x, y, w, h rectangle the way the original strategies did: the
+    corner moves out by padding and is clamped to the image, then the size
+    grows by twice the padding. Near the left/top edge the box therefore
+    reaches further right/down than pad_box's would
+    Returns (x1, y1, x2, y2) clamped to an image of the given shape
+    """
+    height, width = shape[:2]
+    padding_y = padding if padding_y is None else padding_y
+    x1 = max(0, x - padding)
+    y1 = max(0, y - padding_y)
+    return (x1, y1, x1 + min(width - x1, w + 2 * padding), y1 + min(height - y1, h + 2 * padding_y))
+
+def scale_box(box, scale, shape):
+    """Map an (x1, y1, x2, y2) proxy box to the original image of the given shape"""
+    if scale == 1.0:
+        return tuple(int(v) for v in box)
+    height, width = shape[:2]
+    x1, y1, x2, y2 = box
+    return (
+        max(0, int(x1 * scale)),
+        max(0, int(y1 * scale)),
+        min(width, int(round(x2 * scale))),
+        min(height, int(round(y2 * scale)))
+    )
+
+def crop_box(image, box):
+    x1, y1, x2, y2 = box
+    return image[y1:y2, x1:x2]
+
+def limit_size(image, max_side=CROP_OUTPUT_SIZE):
+    """Downscale a crop so its longest side is at most max_side"""
+    return make_proxy(image, max_side)[0]